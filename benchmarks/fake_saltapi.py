@@ -0,0 +1,905 @@
+#!/usr/bin/env python
+""" Fake salt-api for benchmarks and load tests of SaltStack backends without real SaltStack masters.
+
+    Server implements /login, /run, / (lowstate with X-Auth-Token) and /jobs/<jid> endpoints
+    of salt-api, clients local (test.ping and cmd.run), local_async and runner jobs.lookup_jid.
+    PowerShell commands of Exchange and SharePoint backends are emulated using in-memory state,
+    minions which names contain "sharepoint" run SharePoint commands, other ones run Exchange commands.
+    Only the first matched minion executes a command, the rest respond with "Inactive" status,
+    minions which are down are missing from outputs.
+
+    Run standalone:
+
+        python benchmarks/fake_saltapi.py --port 8080 --latency 0.05 --failure-rate 0.01
+
+    and register SaltStack service settings with backend_url http://localhost:8080/, any username
+    and password and options {"exchange_target": "exchange-*", "sharepoint_target": "sharepoint-*"}.
+
+    Or use it from Python, e.g. in benchmarks:
+
+        app = FakeSaltAPI(latency=0.01)
+        server = app.serve(port=0)  # started in a background thread
+        app.seed_exchange_tenant('NC_TENANT', 'example.com', users=1000)
+        ...
+        server.shutdown()
+"""
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+try:
+    from SocketServer import ThreadingMixIn
+except ImportError:  # Python 3
+    from socketserver import ThreadingMixIn
+
+
+COMMAND_RE = re.compile(r'^powershell\.exe -f .*\\(?P<name>\w+)\.ps1(?P<args>.*)$', re.DOTALL)
+ARGUMENT_RE = re.compile(r'-(?P<key>\w+)(?:\s+(?P<value>"(?:[^"\\]|\\.)*"|true|false))?')
+
+
+class CommandError(Exception):
+    pass
+
+
+def parse_command(command):
+    """ Parse command built by SaltStackAPI.get_command() to its name and arguments """
+    match = COMMAND_RE.match(command)
+    if not match:
+        raise CommandError("Unknown command: %s" % command)
+
+    args = {}
+    for arg in ARGUMENT_RE.finditer(match.group('args')):
+        value = arg.group('value')
+        if value is None:
+            value = True  # flag
+        elif value in ('true', 'false'):
+            value = value == 'true'
+        else:
+            value = re.sub(r'\\(["\$])', r'\1', value[1:-1])
+        args[arg.group('key')] = value
+    return match.group('name'), args
+
+
+def split_ids(value):
+    return [item for item in str(value).split(',') if item]
+
+
+def format_size(size):
+    return '%s MB' % int(size or 0)
+
+
+class Commands(object):
+    """ Base class for emulation of PowerShell commands, each command is a method with the same name """
+
+    def __init__(self):
+        self.tenants = {}
+        self.objects = {}
+        self.emails = {}
+        self.counter = itertools.count(1)
+
+    def add_object(self, obj):
+        self.objects[obj['id']] = obj
+        if obj.get('email'):
+            self.emails[obj['email']] = obj['id']
+        return obj
+
+    def delete_object(self, obj):
+        del self.objects[obj['id']]
+        if self.emails.get(obj.get('email')) == obj['id']:
+            del self.emails[obj['email']]
+
+    def set_email(self, obj, email):
+        if self.emails.get(obj.get('email')) == obj['id']:
+            del self.emails[obj['email']]
+        obj['email'] = email
+        self.emails[email] = obj['id']
+
+    def new_id(self):
+        return str(uuid.uuid4())
+
+    def get_tenant(self, name):
+        try:
+            return self.tenants[name]
+        except KeyError:
+            raise CommandError("Tenant %s doesn't exist" % name)
+
+    def get_object(self, obj_id, kind=None):
+        # objects could be referenced by email as well
+        obj = self.objects.get(obj_id) or self.objects.get(self.emails.get(obj_id))
+        if obj is None or (kind and obj['kind'] != kind):
+            raise CommandError("Object %s doesn't exist" % obj_id)
+        return obj
+
+    def list_objects(self, kind, **filters):
+        return [obj for obj in self.objects.values()
+                if obj['kind'] == kind and all(obj.get(k) == v for k, v in filters.items())]
+
+    def password(self):
+        return 'Pwd%06d!' % random.randint(0, 999999)
+
+    def DiskUsage(self, DriveLetter='D'):
+        used = 1024 * len(self.objects)
+        return {'Free [MB]': 10 * 1024 * 1024 - used, 'Used [MB]': used}
+
+
+class ExchangeCommands(Commands):
+
+    def dn(self, name, tenant):
+        return 'CN=%s,OU=%s,DC=example,DC=com' % (name, tenant)
+
+    def user_output(self, user, password=False):
+        output = {
+            'Guid': user['id'],
+            'Email Address': user['email'],
+            'DisplayName': user['name'],
+            'FirstName': user['first_name'],
+            'LastName': user['last_name'],
+            'MailboxQuota': format_size(user['mailbox_size']),
+            'DistinguishedName': self.dn(user['name'], user['tenant']),
+            'Office': user['office'],
+            'Phone': user['phone'],
+            'Department': user['department'],
+            'Company': user['company'],
+            'Manager': user['manager'],
+            'Title': user['title'],
+        }
+        if password:
+            output['TempPassword'] = user['password']
+        return output
+
+    def contact_output(self, contact):
+        return {
+            'Guid': contact['id'],
+            'EmailAddress': contact['email'],
+            'DisplayName': contact['name'],
+            'DistinguishedName': self.dn(contact['name'], contact['tenant']),
+        }
+
+    def group_output(self, group):
+        return {
+            'Guid': group['id'],
+            'EmailAddress': group['email'],
+            'DisplayName': group['name'],
+            'DistinguishedName': self.dn(group['name'], group['tenant']),
+        }
+
+    def room_output(self, room):
+        return {
+            'Guid': room['id'],
+            'Email Address': room['email'],
+            'DisplayName': room['name'],
+            'DistinguishedName': self.dn(room['name'], room['tenant']),
+            'RoomAlias': room['username'],
+            'Location': room['location'],
+            'Phone': room['phone'],
+            'MailboxQuota': format_size(room['mailbox_size']),
+        }
+
+    def check_username(self, tenant, username):
+        domain = self.get_tenant(tenant)['domain']
+        email = '%s@%s' % (username, domain)
+        if email in self.emails:
+            raise CommandError("Address %s is already in use" % email)
+        return email
+
+    # Tenants
+
+    def AddTenant(self, TenantName, TenantDomain, TenantStorageSize=0):
+        if TenantName in self.tenants or any(t['domain'] == TenantDomain for t in self.tenants.values()):
+            raise CommandError("Tenant %s or domain %s already exists" % (TenantName, TenantDomain))
+        self.tenants[TenantName] = {'domain': TenantDomain, 'mailbox_size': int(TenantStorageSize)}
+        return {
+            'Mailbox Database': '%s_DB' % TenantName,
+            'Accepted DomainName': TenantDomain,
+            'DistinguishedName': 'OU=%s,DC=example,DC=com' % TenantName,
+        }
+
+    def DelTenant(self, TenantName, TenantDomain=None):
+        self.get_tenant(TenantName)
+        del self.tenants[TenantName]
+        for obj in list(self.objects.values()):
+            if obj['tenant'] == TenantName:
+                self.delete_object(obj)
+        return {}
+
+    def EditDomain(self, TenantName, TenantDomain):
+        tenant = self.get_tenant(TenantName)
+        tenant['domain'] = TenantDomain
+        for obj in list(self.objects.values()):
+            if obj['tenant'] == TenantName and obj['kind'] != 'contact':
+                self.set_email(obj, '%s@%s' % (obj['username'], TenantDomain))
+        return {}
+
+    def CheckTenant(self, TenantName, TenantDomain):
+        if TenantName in self.tenants or any(t['domain'] == TenantDomain for t in self.tenants.values()):
+            raise CommandError("Tenant %s or domain %s already exists" % (TenantName, TenantDomain))
+        return {}
+
+    def EditQuota(self, TenantName, MailboxDatabaseSize):
+        tenant = self.get_tenant(TenantName)
+        tenant['mailbox_size'] = int(MailboxDatabaseSize)
+        return {'Mailbox Database Size': tenant['mailbox_size']}
+
+    # Users
+
+    def AddUser(self, TenantName, UserName, UserFirstName, UserLastName, TenantDomain=None, DisplayName=None,
+                UserInitials=None, UserMailboxSize=0, UserOffice='', UserPhone='', UserDepartment='',
+                UserCompany='', UserManager='', UserTitle=''):
+        user = {
+            'kind': 'user',
+            'id': self.new_id(),
+            'tenant': TenantName,
+            'email': self.check_username(TenantName, UserName),
+            'username': UserName,
+            'name': DisplayName or '%s %s' % (UserFirstName, UserLastName),
+            'first_name': UserFirstName,
+            'last_name': UserLastName,
+            'password': self.password(),
+            'mailbox_size': int(UserMailboxSize or 0),
+            'usage': 0,
+            'office': UserOffice,
+            'phone': UserPhone,
+            'department': UserDepartment,
+            'company': UserCompany,
+            'manager': UserManager,
+            'title': UserTitle,
+            'send_as': set(),
+            'send_on_behalf': set(),
+        }
+        self.add_object(user)
+        return self.user_output(user, password=True)
+
+    def UserList(self, TenantName):
+        return [self.user_output(user) for user in self.list_objects('user', tenant=TenantName)]
+
+    def DelUser(self, Id):
+        self.delete_object(self.get_object(Id, 'user'))
+        return {}
+
+    def ResetUserPassword(self, Id):
+        user = self.get_object(Id, 'user')
+        user['password'] = self.password()
+        return {'TempPassword': user['password']}
+
+    def EditUser(self, Guid, **kwargs):
+        user = self.get_object(Guid, 'user')
+        fields = {
+            'DisplayName': 'name', 'UserName': 'username', 'UserFirstName': 'first_name',
+            'UserLastName': 'last_name', 'UserMailboxSize': 'mailbox_size', 'UserOffice': 'office',
+            'UserPhone': 'phone', 'UserDepartment': 'department', 'UserCompany': 'company',
+            'UserManager': 'manager', 'UserTitle': 'title',
+        }
+        for arg, value in kwargs.items():
+            if arg in fields:
+                user[fields[arg]] = value
+        if 'UserName' in kwargs:
+            self.set_email(user, '%s@%s' % (user['username'], self.get_tenant(user['tenant'])['domain']))
+        return self.user_output(user)
+
+    def MailboxStat(self, Id):
+        user = self.get_object(Id)
+        return {'Quota Limit': format_size(user['mailbox_size']), 'MailboxUsage': format_size(user['usage'])}
+
+    def MailboxStatList(self, TenantName):
+        return [{
+            'Guid': obj['id'],
+            'Quota Limit': format_size(obj['mailbox_size']),
+            'MailboxUsage': format_size(obj['usage']),
+            'EmailAddress': obj['email'],
+            'Type': 'UserMailbox' if obj['kind'] == 'user' else 'RoomMailbox',
+        } for obj in self.objects.values() if obj['tenant'] == TenantName and obj['kind'] in ('user', 'room')]
+
+    def UserDelegationList(self, Id, SendOnBehalf=False, SendAs=False):
+        user = self.get_object(Id, 'user')
+        members = user['send_on_behalf'] if SendOnBehalf else user['send_as']
+        return [self.user_output(self.objects[member]) for member in members if member in self.objects]
+
+    def change_delegation(self, field, Id, MemberId, Add=False, Remove=False):
+        user = self.get_object(Id, 'user')
+        members = [self.get_object(member, 'user')['id'] for member in split_ids(MemberId)]
+        if Add:
+            user[field].update(members)
+        elif Remove:
+            user[field].difference_update(members)
+        return self.user_output(user)
+
+    def UserDelegationSB(self, **kwargs):
+        return self.change_delegation('send_on_behalf', **kwargs)
+
+    def UserDelegationSA(self, **kwargs):
+        return self.change_delegation('send_as', **kwargs)
+
+    # Contacts
+
+    def AddContact(self, TenantName, ContactEmail, ContactFirstName, ContactLastName, ContactName=None):
+        self.get_tenant(TenantName)
+        contact = {
+            'kind': 'contact',
+            'id': self.new_id(),
+            'tenant': TenantName,
+            'email': ContactEmail,
+            'name': ContactName or '%s %s' % (ContactFirstName, ContactLastName),
+        }
+        self.add_object(contact)
+        return self.contact_output(contact)
+
+    def ContactList(self, TenantName):
+        return [self.contact_output(contact) for contact in self.list_objects('contact', tenant=TenantName)]
+
+    def DelContact(self, Id):
+        self.delete_object(self.get_object(Id, 'contact'))
+        return {}
+
+    def EditContact(self, Guid, ContactName=None, ContactEmail=None, ContactFirstName=None, ContactLastName=None):
+        contact = self.get_object(Guid, 'contact')
+        if ContactName:
+            contact['name'] = ContactName
+        if ContactEmail:
+            self.set_email(contact, ContactEmail)
+        return self.contact_output(contact)
+
+    # Distribution groups
+
+    def AddDistGrp(self, TenantName, DisplayName, Alias, ManagedByUser, TenantDomain=None):
+        self.get_object(ManagedByUser, 'user')
+        group = {
+            'kind': 'group',
+            'id': self.new_id(),
+            'tenant': TenantName,
+            'email': self.check_username(TenantName, Alias),
+            'username': Alias,
+            'name': DisplayName,
+            'manager': ManagedByUser,
+            'members': set(),
+            'delivery': set(),
+            'senders_out': False,
+        }
+        self.add_object(group)
+        return self.group_output(group)
+
+    def DgList(self, TenantName):
+        return [self.group_output(group) for group in self.list_objects('group', tenant=TenantName)]
+
+    def DelDistGrp(self, Id):
+        self.delete_object(self.get_object(Id, 'group'))
+        return {}
+
+    def EditDg(self, Guid, TenantDomain=None, DisplayName=None, Alias=None, ManagedByUser=None):
+        group = self.get_object(Guid, 'group')
+        if DisplayName:
+            group['name'] = DisplayName
+        if Alias:
+            group['username'] = Alias
+            self.set_email(group, '%s@%s' % (Alias, self.get_tenant(group['tenant'])['domain']))
+        if ManagedByUser:
+            group['manager'] = ManagedByUser
+        return self.group_output(group)
+
+    def AddDgMember(self, Id, MemberId):
+        group = self.get_object(Id, 'group')
+        group['members'].update(self.get_object(member, 'user')['id'] for member in split_ids(MemberId))
+        return self.group_output(group)
+
+    def DelDgMember(self, Id, MemberId):
+        group = self.get_object(Id, 'group')
+        group['members'].difference_update(self.get_object(member)['id'] for member in split_ids(MemberId))
+        return self.group_output(group)
+
+    def DgMemberList(self, Id):
+        group = self.get_object(Id, 'group')
+        return [self.user_output(self.objects[member]) for member in group['members'] if member in self.objects]
+
+    def DgDeliveryList(self, Id):
+        group = self.get_object(Id, 'group')
+        return [self.group_output(self.objects[member]) for member in group['delivery'] if member in self.objects]
+
+    def DgDeliveryMgmt(self, Id, MemberId, Add=False, Remove=False):
+        group = self.get_object(Id, 'group')
+        members = [self.get_object(member)['id'] for member in split_ids(MemberId)]
+        if Add:
+            group['delivery'].update(members)
+        elif Remove:
+            group['delivery'].difference_update(members)
+        return self.DgDeliveryList(Id)
+
+    def DgDeliveryIO(self, Id, SendersOut):
+        group = self.get_object(Id, 'group')
+        group['senders_out'] = SendersOut
+        return self.group_output(group)
+
+    # Conference rooms
+
+    def AddConfRoom(self, TenantName, DisplayName, Alias, TenantDomain=None, Location='', Phone='', MailboxSize=0):
+        room = {
+            'kind': 'room',
+            'id': self.new_id(),
+            'tenant': TenantName,
+            'email': self.check_username(TenantName, Alias),
+            'username': Alias,
+            'name': DisplayName,
+            'location': Location,
+            'phone': Phone,
+            'mailbox_size': int(MailboxSize or 0),
+            'usage': 0,
+        }
+        self.add_object(room)
+        return self.room_output(room)
+
+    def ConfRoomList(self, TenantName):
+        return [self.room_output(room) for room in self.list_objects('room', tenant=TenantName)]
+
+    def DelConfRoom(self, Id):
+        self.delete_object(self.get_object(Id, 'room'))
+        return {}
+
+    def EditConfRoom(self, Id, DisplayName=None, Alias=None, Location=None, Phone=None, MailboxSize=None):
+        room = self.get_object(Id, 'room')
+        for field, value in (('name', DisplayName), ('location', Location), ('phone', Phone)):
+            if value is not None:
+                room[field] = value
+        if MailboxSize is not None:
+            room['mailbox_size'] = int(MailboxSize)
+        if Alias:
+            room['username'] = Alias
+            self.set_email(room, '%s@%s' % (Alias, self.get_tenant(room['tenant'])['domain']))
+        return self.room_output(room)
+
+
+class SharepointCommands(Commands):
+
+    TEMPLATES = (
+        ('Team Site', 'STS#0'),
+        ('Blog', 'BLOG#0'),
+        ('My Site Host', 'SPSMSITEHOST#0'),
+    )
+
+    def user_output(self, user, password=False):
+        output = {
+            'ObjectGUID': user['id'],
+            'EmailAddress': user['email'],
+            'DisplayName': user['name'],
+            'FirstName': user['first_name'],
+            'LastName': user['last_name'],
+            'userPrincipalName': user['email'],
+            'DistinguishedName': 'CN=%s,OU=%s,DC=example,DC=com' % (user['name'], user['tenant']),
+            'SamAccountName': user['admin_id'],
+        }
+        if password:
+            output['UserPassword'] = user['password']
+        return output
+
+    def site_output(self, site):
+        return {
+            'URL': site['url'],
+            'Quota Usage [MB]': site['usage'],
+            'Quota Size [MB]': site['storage'],
+        }
+
+    def add_site(self, tenant, url, storage, template='STS#0'):
+        site = {
+            'kind': 'site',
+            'id': url,
+            'tenant': tenant,
+            'url': url,
+            'storage': int(storage or 0),
+            'usage': 0,
+            'template': template,
+        }
+        self.add_object(site)
+        return site
+
+    def AddTenant(self, TenantName, TenantDomain):
+        if TenantName in self.tenants or any(t['domain'] == TenantDomain for t in self.tenants.values()):
+            raise CommandError("Tenant %s or domain %s already exists" % (TenantName, TenantDomain))
+        self.tenants[TenantName] = {'domain': TenantDomain}
+        return {
+            'Tenant Database': '%s_DB' % TenantName,
+            'DistinguishedName': 'OU=%s,DC=example,DC=com' % TenantName,
+            'UPNSuffix': TenantDomain,
+        }
+
+    def DelTenant(self, TenantName, TenantDomain=None):
+        self.get_tenant(TenantName)
+        del self.tenants[TenantName]
+        for obj in list(self.objects.values()):
+            if obj['tenant'] == TenantName:
+                self.delete_object(obj)
+        return {}
+
+    def CheckTenant(self, TenantName, TenantDomain):
+        if TenantName in self.tenants or any(t['domain'] == TenantDomain for t in self.tenants.values()):
+            raise CommandError("Tenant %s or domain %s already exists" % (TenantName, TenantDomain))
+        return {}
+
+    def get_tenant_by_domain(self, domain):
+        for name, tenant in self.tenants.items():
+            if tenant['domain'] == domain:
+                return name
+        raise CommandError("Tenant with domain %s doesn't exist" % domain)
+
+    def EditSiteCollectionQuota(self, TenantDomain, MainSiteSizeQuota=None, NumberOfUsers=None):
+        self.get_tenant_by_domain(TenantDomain)
+        return {}
+
+    def StorageUsage(self, TenantDomain):
+        tenant = self.get_tenant_by_domain(TenantDomain)
+        return {'Storage Usage [MB]': sum(site['usage'] for site in self.list_objects('site', tenant=tenant))}
+
+    def ListAllTemplates(self):
+        return [{'Template Name': name, 'Template Code': code} for name, code in self.TEMPLATES]
+
+    # Site collections
+
+    def AddSiteCollection(self, TenantName, TenantDomain, SiteCollectionName, SiteQuotaSize,
+                          SiteName=None, SiteDesc=None, SiteTemplate='STS#0', SiteAdmin=None):
+        url = 'https://%s/sites/%s' % (TenantDomain, SiteCollectionName)
+        if url in self.objects:
+            raise CommandError("Site collection %s already exists" % url)
+        return self.site_output(self.add_site(TenantName, url, SiteQuotaSize, SiteTemplate))
+
+    def AddTenantSiteCollections(self, TenantName, TenantDomain, StorageQuotaSize, SiteAdmin=None,
+                                 SiteName=None, SiteDesc=None, SiteTemplate='STS#0'):
+        main = self.add_site(TenantName, 'https://%s/' % TenantDomain, StorageQuotaSize, SiteTemplate)
+        admin = self.add_site(TenantName, 'https://admin.%s/' % TenantDomain, 100, 'TENANTADMIN#0')
+        return {
+            'My Site URL': 'https://my.%s/' % TenantDomain,
+            'My Site Quota [MB]': 100,
+            'My Site Template': 'SPSMSITEHOST#0',
+            'Main Site URL': main['url'],
+            'Main Site Quota [MB]': main['storage'],
+            'Admin Site Admin URL': admin['url'],
+            'Admin Site Quota [MB]': admin['storage'],
+            'Admin Site Template': admin['template'],
+            'Site Subscription ID': self.new_id(),
+        }
+
+    def ListAllTenantSites(self, TenantDomain):
+        tenant = self.get_tenant_by_domain(TenantDomain)
+        return [self.site_output(site) for site in self.list_objects('site', tenant=tenant)]
+
+    def DelSiteCollection(self, SiteCollectionUrl):
+        self.delete_object(self.get_object(SiteCollectionUrl, 'site'))
+        return {}
+
+    def EditSiteQuota(self, SiteCollectionUrl, SiteQuotaSize):
+        self.get_object(SiteCollectionUrl, 'site')['storage'] = int(SiteQuotaSize)
+        return {}
+
+    def CheckPersonalSiteCollection(self, SiteUrl):
+        site = self.get_object(SiteUrl, 'site')
+        return {'QuotaSize': site['storage'], 'SiteTemplate': site['template'], 'QuotaUsage': site['usage']}
+
+    # Users
+
+    def AddUser(self, TenantName, TenantDomain, UserName, UserFirstName, UserLastName,
+                DisplayName=None, UserEmail=None):
+        self.get_tenant(TenantName)
+        email = UserEmail or '%s@%s' % (UserName, TenantDomain)
+        if email in self.emails:
+            raise CommandError("User %s already exists" % email)
+        user = {
+            'kind': 'user',
+            'id': self.new_id(),
+            'tenant': TenantName,
+            'email': email,
+            'name': DisplayName or '%s %s' % (UserFirstName, UserLastName),
+            'first_name': UserFirstName,
+            'last_name': UserLastName,
+            'admin_id': '%s\\%s' % (TenantName, UserName),
+            'password': self.password(),
+        }
+        self.add_object(user)
+        site = self.add_site(TenantName, 'https://my.%s/personal/%s' % (TenantDomain, UserName), 100)
+        output = self.user_output(user, password=True)
+        output['PersonalSiteCollection'] = site['url']
+        return output
+
+    def ListAllUsers(self, TenantName, TenantDomain=None):
+        return [self.user_output(user) for user in self.list_objects('user', tenant=TenantName)]
+
+    def ResetUserPassword(self, Id):
+        user = self.get_object(Id, 'user')
+        user['password'] = self.password()
+        return {'UserPassword': user['password']}
+
+    def DelUser(self, Id):
+        self.delete_object(self.get_object(Id, 'user'))
+        return {}
+
+    def EditUser(self, Id, TenantName=None, TenantDomain=None, DisplayName=None, UserName=None,
+                 UserFirstName=None, UserLastName=None, UserEmail=None):
+        user = self.get_object(Id, 'user')
+        for field, value in (('name', DisplayName), ('first_name', UserFirstName), ('last_name', UserLastName)):
+            if value is not None:
+                user[field] = value
+        if UserEmail:
+            self.set_email(user, UserEmail)
+        return self.user_output(user)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSaltAPI(object):
+    """ WSGI application emulating salt-api.
+
+        minions - names of minions, names containing "sharepoint" run SharePoint commands;
+        latency - seconds added to each HTTP request;
+        command_latency - seconds added to each executed command, so batches take longer;
+        failure_rate - probability of a command to fail with "Error" status;
+        http_error_rate - probability of a request to fail with HTTP 500;
+        job_duration - seconds after which output of asynchronous job becomes available;
+        username, password - accepted credentials, any credentials are accepted if not set;
+        token_ttl - seconds of authentication token validity;
+        down_minions - names of minions which don't respond, see also set_minion_down().
+    """
+
+    def __init__(self, minions=('exchange-1', 'sharepoint-1'), latency=0, command_latency=0, failure_rate=0,
+                 http_error_rate=0, job_duration=0, username=None, password=None, token_ttl=12 * 60 * 60,
+                 down_minions=()):
+        self.minions = list(minions)
+        self.down_minions = set(down_minions)
+        self.latency = latency
+        self.command_latency = command_latency
+        self.failure_rate = failure_rate
+        self.http_error_rate = http_error_rate
+        self.job_duration = job_duration
+        self.username = username
+        self.password = password
+        self.token_ttl = token_ttl
+
+        self.lock = threading.RLock()
+        self.tokens = {}
+        self.jobs = {}
+        self.exchange = ExchangeCommands()
+        self.sharepoint = SharepointCommands()
+        self.stats = {'requests': 0, 'lowstates': 0, 'commands': {}, 'minions': {}, 'failures': 0}
+
+    # Python interface
+
+    def serve(self, host='127.0.0.1', port=0):
+        """ Start server in a background thread, return server with actual port in server.server_port """
+        server = make_server(host, port, self, server_class=ThreadingWSGIServer, handler_class=QuietRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'lowstates': 0, 'commands': {}, 'minions': {}, 'failures': 0}
+
+    def set_minion_down(self, minion, down=True):
+        """ Stop or resume responses of minion """
+        with self.lock:
+            if down:
+                self.down_minions.add(minion)
+            else:
+                self.down_minions.discard(minion)
+
+    def seed_exchange_tenant(self, name, domain, users=0, mailbox_size=1024):
+        """ Create Exchange tenant with given number of users directly in state, returns users outputs """
+        with self.lock:
+            self.exchange.AddTenant(name, domain, mailbox_size * max(users, 1))
+            return [self.exchange.AddUser(name, 'user%s' % index, 'First%s' % index, 'Last%s' % index,
+                                          UserMailboxSize=mailbox_size)
+                    for index in range(users)]
+
+    def seed_sharepoint_tenant(self, name, domain, users=0):
+        with self.lock:
+            self.sharepoint.AddTenant(name, domain)
+            return [self.sharepoint.AddUser(name, domain, 'user%s' % index, 'First%s' % index, 'Last%s' % index)
+                    for index in range(users)]
+
+    # salt-api emulation
+
+    def get_commands(self, minion):
+        return self.sharepoint if 'sharepoint' in minion else self.exchange
+
+    def match_minions(self, target):
+        return [minion for minion in self.minions if fnmatch.fnmatch(minion, target or '')]
+
+    def match_responding_minions(self, target):
+        with self.lock:
+            return [minion for minion in self.match_minions(target) if minion not in self.down_minions]
+
+    def execute(self, minion, command):
+        """ Run command on minion, return its output as salt returns output of cmd.run """
+        time.sleep(self.command_latency)
+        try:
+            name, args = parse_command(command)
+            with self.lock:
+                self.stats['commands'][name] = self.stats['commands'].get(name, 0) + 1
+                if random.random() < self.failure_rate:
+                    self.stats['failures'] += 1
+                    raise CommandError("Injected failure of %s" % name)
+                handler = getattr(self.get_commands(minion), name, None)
+                if handler is None:
+                    raise CommandError("Command %s is not supported" % name)
+                try:
+                    output = handler(**args)
+                except TypeError as e:
+                    raise CommandError("Wrong arguments of %s: %s" % (name, e))
+            result = {'Status': 'OK', 'Output': output}
+        except CommandError as e:
+            result = {'Status': 'Error', 'Message': str(e), 'Output': None}
+        return json.dumps(result, default=list)
+
+    def run_local(self, lowstate):
+        minions = self.match_responding_minions(lowstate.get('tgt'))
+        fun = lowstate.get('fun')
+        if fun == 'test.ping':
+            return {minion: True for minion in minions}
+        elif fun == 'cmd.run':
+            output = {}
+            for index, minion in enumerate(minions):
+                # every targeted minion runs the script, stats show how work is spread between them
+                with self.lock:
+                    self.stats['minions'][minion] = self.stats['minions'].get(minion, 0) + 1
+                if index == 0:
+                    output[minion] = self.execute(minion, lowstate.get('arg'))
+                else:
+                    output[minion] = json.dumps({'Status': 'Inactive'})
+            return output
+        raise ValueError("Function %s is not supported" % fun)
+
+    def run_local_async(self, lowstate):
+        # salt reports all targeted minions of a job, output of minions which are down never appears
+        minions = self.match_minions(lowstate.get('tgt'))
+        if not minions:
+            return {}
+        jid = time.strftime('%Y%m%d%H%M%S') + '%06d' % next(self.exchange.counter)
+        with self.lock:
+            self.jobs[jid] = {'lowstate': dict(lowstate, client='local'), 'ready': time.time() + self.job_duration}
+        return {'jid': jid, 'minions': minions}
+
+    def lookup_job(self, jid):
+        with self.lock:
+            job = self.jobs.get(jid)
+        if job is None or job['ready'] > time.time():
+            return {}
+        if 'output' not in job:
+            job['output'] = self.run_local(job['lowstate'])
+        return job['output']
+
+    def run_lowstate(self, lowstate):
+        client = lowstate.get('client')
+        if client == 'local':
+            return self.run_local(lowstate)
+        elif client == 'local_async':
+            return self.run_local_async(lowstate)
+        elif client == 'runner' and lowstate.get('fun') == 'jobs.lookup_jid':
+            return self.lookup_job(lowstate.get('jid'))
+        raise ValueError("Client %s is not supported" % client)
+
+    def check_credentials(self, data):
+        return ((self.username is None or data.get('username') == self.username) and
+                (self.password is None or data.get('password') == self.password))
+
+    def check_token(self, environ):
+        token = environ.get('HTTP_X_AUTH_TOKEN')
+        with self.lock:
+            expire = self.tokens.get(token, 0)
+        return expire > time.time()
+
+    def login(self, data):
+        if not self.check_credentials(data):
+            return 401, {'return': 'Authentication failed'}
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.tokens[token] = now + self.token_ttl
+        return 200, {'return': [{
+            'token': token, 'start': now, 'expire': now + self.token_ttl,
+            'user': data.get('username'), 'eauth': data.get('eauth'), 'perms': ['.*', '@runner', '@jobs'],
+        }]}
+
+    def handle(self, method, path, environ, data):
+        if path == '/login' and method == 'POST':
+            return self.login(data)
+
+        if path == '/stats' and method == 'GET':
+            with self.lock:
+                return 200, json.loads(json.dumps(self.stats))
+
+        lowstates = data if isinstance(data, list) else [data]
+        if path == '/run' and method == 'POST':
+            if not all(self.check_credentials(lowstate) for lowstate in lowstates):
+                return 401, {'return': 'Authentication failed'}
+        elif not self.check_token(environ):
+            return 401, {'return': 'Please log in'}
+
+        if path == '/' and method == 'POST' or path == '/run':
+            with self.lock:
+                self.stats['lowstates'] += len(lowstates)
+            return 200, {'return': [self.run_lowstate(lowstate) for lowstate in lowstates]}
+
+        match = re.match(r'^/jobs/(?P<jid>\w+)$', path)
+        if match and method == 'GET':
+            return 200, {'return': [self.lookup_job(match.group('jid'))], 'info': [{'jid': match.group('jid')}]}
+
+        return 404, {'return': 'Not found'}
+
+    def __call__(self, environ, start_response):
+        time.sleep(self.latency)
+        with self.lock:
+            self.stats['requests'] += 1
+
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO') or '/'
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length else b''
+
+        if random.random() < self.http_error_rate:
+            status, payload = 500, {'return': 'Injected server error'}
+        else:
+            try:
+                data = json.loads(body.decode('utf-8')) if body else {}
+                status, payload = self.handle(method, path, environ, data)
+            except ValueError as e:
+                status, payload = 400, {'return': str(e)}
+
+        reasons = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 500: 'Internal Server Error'}
+        content = json.dumps(payload).encode('utf-8')
+        start_response('%s %s' % (status, reasons[status]), [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(content))),
+        ])
+        return [content]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake salt-api emulating Exchange and SharePoint minions.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--minions', default='exchange-1,sharepoint-1',
+                        help='comma separated names of minions, default: %(default)s')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to each HTTP request')
+    parser.add_argument('--command-latency', type=float, default=0, help='seconds added to each command')
+    parser.add_argument('--failure-rate', type=float, default=0, help='probability of command failure')
+    parser.add_argument('--http-error-rate', type=float, default=0, help='probability of HTTP 500 response')
+    parser.add_argument('--job-duration', type=float, default=0, help='seconds of asynchronous job execution')
+    parser.add_argument('--username', help='accepted username, any if omitted')
+    parser.add_argument('--password', help='accepted password, any if omitted')
+    parser.add_argument('--down-minions', default='', help='comma separated names of minions which do not respond')
+    parser.add_argument('--seed', type=int, help='random seed for reproducible failure injection')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    app = FakeSaltAPI(
+        minions=args.minions.split(','), latency=args.latency, command_latency=args.command_latency,
+        failure_rate=args.failure_rate, http_error_rate=args.http_error_rate, job_duration=args.job_duration,
+        username=args.username, password=args.password,
+        down_minions=[minion for minion in args.down_minions.split(',') if minion])
+    server = make_server(args.host, args.port, app, server_class=ThreadingWSGIServer)
+    print('Fake salt-api is listening on http://%s:%s/' % (args.host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
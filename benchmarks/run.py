@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+""" Benchmarks of SaltStack backends and synchronization tasks against fake salt-api.
+
+    Benchmarks need Django settings of NodeConductor installation with nodeconductor_saltstack
+    plugin and a database where a throwaway test database can be created:
+
+        DJANGO_SETTINGS_MODULE=nodeconductor.server.test_settings \\
+            python benchmarks/run.py --output results.json
+
+    Results are printed or written as JSON, see benchmarks/README.rst for their structure.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+from fake_saltapi import FakeSaltAPI
+
+
+ROWS = (1000, 10000, 100000)
+TENANTS = (10, 100, 1000)
+BENCHMARKS = ('run_cmd', 'api_construction', 'create_entity', 'sync')
+
+
+def log(message, *args):
+    print(message % args, file=sys.stderr)
+
+
+def percentile(values, percent):
+    """ Nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def summarize(durations):
+    """ Aggregate durations of operations in seconds """
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        'count': len(durations),
+        'seconds': total,
+        'ops_per_sec': len(durations) / total if total else None,
+        'mean': total / len(durations) if durations else None,
+        'min': durations[0] if durations else None,
+        'p50': percentile(durations, 50),
+        'p99': percentile(durations, 99),
+        'max': durations[-1] if durations else None,
+    }
+
+
+def timed(func, *args, **kwargs):
+    gc.collect()
+    started = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - started, result
+
+
+class Counters(object):
+    """ Count DB queries and salt-api calls made within the block """
+
+    def __init__(self, app):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.app = app
+        self.queries = CaptureQueriesContext(connection)
+
+    def __enter__(self):
+        self.app.reset_stats()
+        self.queries.__enter__()
+        gc.collect()
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self.started
+        self.queries.__exit__(exc_type, exc_value, traceback)
+
+    def report(self, **extra):
+        stats = self.app.stats
+        report = {
+            'seconds': self.seconds,
+            'queries': len(self.queries),
+            'http_requests': stats['requests'],
+            'commands': sum(stats['commands'].values()),
+            'failures': stats['failures'],
+        }
+        report.update(extra)
+        return report
+
+
+# Client benchmarks
+
+def bench_run_cmd(api_url, iterations):
+    from nodeconductor_saltstack.saltstack.backend import SaltStackAPI
+
+    api = SaltStackAPI(api_url, 'benchmark', 'benchmark', 'exchange-*')
+    for _ in range(10):  # warm up session pool and authentication token
+        api.run_cmd('DiskUsage', DriveLetter='D')
+
+    durations = []
+    for _ in range(iterations):
+        started = time.time()
+        api.run_cmd('DiskUsage', DriveLetter='D')
+        durations.append(time.time() - started)
+
+    return summarize(durations)
+
+
+def bench_api_construction(api_url, iterations):
+    from nodeconductor_saltstack.exchange.backend import UserAPI
+
+    def construct_cold():
+        # new subclass has no compiled methods, so it is compiled again like on first use of API class
+        api_class = type('BenchmarkUserAPI', (UserAPI,), {})
+        api_class(api_url, 'benchmark', 'benchmark', 'exchange-*')
+
+    def construct_warm():
+        UserAPI(api_url, 'benchmark', 'benchmark', 'exchange-*')
+
+    results = {}
+    for name, func in (('cold', construct_cold), ('warm', construct_warm)):
+        durations = []
+        for _ in range(iterations):
+            started = time.time()
+            func()
+            durations.append(time.time() - started)
+        results[name] = summarize(durations)
+    return results
+
+
+def create_entities(api, method, data):
+    return [api.create_entity(method, row) for row in data]
+
+
+def bench_create_entity(app, sizes):
+    from nodeconductor_saltstack.exchange.backend import UserAPI
+
+    api = UserAPI('http://localhost/', 'benchmark', 'benchmark', 'exchange-*')
+    method = api.methods['list']
+    sample = app.seed_exchange_tenant('ENTITY', 'entity.example.com', users=1)[0]
+
+    results = {}
+    for rows in sizes:
+        data = [dict(sample, Guid=str(index)) for index in range(rows)]
+        create_seconds, _ = timed(create_entities, api, method, data)
+        process_seconds, _ = timed(api.process_method_output, 'list', data)
+        results[str(rows)] = {
+            'rows': rows,
+            'create_entity_seconds': create_seconds,
+            'process_method_output_seconds': process_seconds,
+            'rows_per_sec': rows / process_seconds if process_seconds else None,
+        }
+        log('create_entity: %s rows in %.3fs', rows, process_seconds)
+    return results
+
+
+# Synchronization benchmarks
+
+def create_service_project_link(api_url):
+    from nodeconductor_saltstack.exchange.tests.factories import ServiceProjectLinkFactory
+
+    return ServiceProjectLinkFactory(
+        service__settings__backend_url=api_url,
+        service__settings__username='benchmark',
+        service__settings__password='benchmark',
+        service__settings__options={'exchange_target': 'exchange-*', 'sharepoint_target': 'sharepoint-*'},
+    )
+
+
+def seed_exchange(app, spl, count, users):
+    from nodeconductor_saltstack.exchange.models import ExchangeTenant
+
+    tenants = []
+    for index in range(count):
+        name = 'EX%s_%s' % (count, index)
+        domain = 'ex%s-%s.example.com' % (count, index)
+        app.seed_exchange_tenant(name, domain, users=users)
+        tenants.append(ExchangeTenant.objects.create(
+            service_project_link=spl, name=name, backend_id=name, domain=domain,
+            state=ExchangeTenant.States.ONLINE))
+    return [tenant.uuid.hex for tenant in tenants]
+
+
+def seed_sharepoint(app, spl, count, users):
+    from nodeconductor_saltstack.sharepoint.models import SharepointTenant, SiteCollection, User
+
+    tenants = []
+    for index in range(count):
+        name = 'SP%s_%s' % (count, index)
+        domain = 'sp%s-%s.example.com' % (count, index)
+        app.seed_sharepoint_tenant(name, domain, users=users)
+        sites = app.sharepoint.AddTenantSiteCollections(name, domain, 1024)
+
+        tenant = SharepointTenant.objects.create(
+            service_project_link=spl, name=name, backend_id=name, domain=domain,
+            state=SharepointTenant.States.ONLINE)
+        admin = User.objects.create(
+            tenant=tenant, name='Admin', username='admin', email='admin@%s' % domain,
+            first_name='Admin', last_name='Admin', admin_id='admin', password='benchmark', backend_id='admin')
+        for site_type, url in ((SiteCollection.Types.MAIN, sites['Main Site URL']),
+                               (SiteCollection.Types.ADMIN, sites['Admin Site Admin URL'])):
+            SiteCollection.objects.create(
+                user=admin, name=site_type, type=site_type, backend_id=url, access_url=url, description='')
+        tenant.admin = admin
+        tenant.save(update_fields=['admin'])
+        tenants.append(tenant)
+    return [tenant.uuid.hex for tenant in tenants]
+
+
+def run_sync(app, task, uuids, chunked):
+    """ Run synchronization task synchronously, by SYNC_CHUNK_SIZE chunks like scheduled or per tenant """
+    from django.core.cache import cache
+    from nodeconductor_saltstack.saltstack.settings import get_setting
+
+    cache.clear()  # drop cached backend lists, authentication token stays in process memory
+    with Counters(app) as counters:
+        if chunked:
+            chunk_size = get_setting('SYNC_CHUNK_SIZE')
+            for index in range(0, len(uuids), chunk_size):
+                task(uuids[index:index + chunk_size])
+        else:
+            for uuid in uuids:
+                task(uuid)
+    return counters.report(tenants=len(uuids))
+
+
+def bench_sync(app, api_url, sizes, users):
+    from nodeconductor_saltstack.exchange import tasks as exchange_tasks
+    from nodeconductor_saltstack.sharepoint import tasks as sharepoint_tasks
+
+    spl = create_service_project_link(api_url)
+    # users are synchronized first, so quotas synchronization updates stored users
+    scenarios = (
+        ('exchange.sync_tenant_users', seed_exchange, exchange_tasks.sync_tenant_users, False),
+        ('exchange.sync_tenant_quotas', seed_exchange, exchange_tasks.sync_tenant_quotas, True),
+        ('sharepoint.sync_tenant_users', seed_sharepoint, sharepoint_tasks.sync_tenant_users, False),
+        ('sharepoint.sync_site_collection_quotas', seed_sharepoint,
+         sharepoint_tasks.sync_site_collection_quotas, True),
+    )
+
+    results = {name: {} for name, _, _, _ in scenarios}
+    for count in sizes:
+        uuids = {
+            seed_exchange: seed_exchange(app, spl, count, users),
+            seed_sharepoint: seed_sharepoint(app, spl, count, users),
+        }
+        for name, seed, task, chunked in scenarios:
+            # first run imports backend objects, second one measures sync without changes
+            initial = run_sync(app, task, uuids[seed], chunked)
+            steady = run_sync(app, task, uuids[seed], chunked)
+            results[name][str(count)] = {'initial': initial, 'steady': steady}
+            log('%s: %s tenants in %.3fs, %s queries, %s HTTP requests',
+                name, count, steady['seconds'], steady['queries'], steady['http_requests'])
+    return results
+
+
+def get_meta(args):
+    from django.conf import settings
+    from nodeconductor_saltstack import __version__
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'latency': args.latency,
+        'iterations': args.iterations,
+        'users': args.users,
+    }
+
+
+def parse_sizes(value):
+    return tuple(int(size) for size in value.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of SaltStack backends against fake salt-api.')
+    parser.add_argument('--output', help='file to write JSON results to, stdout if omitted')
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help='comma separated benchmarks to run, default: %(default)s')
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='number of calls in run_cmd and API construction benchmarks')
+    parser.add_argument('--rows', type=parse_sizes, default=ROWS,
+                        help='comma separated row counts of create_entity benchmark')
+    parser.add_argument('--tenants', type=parse_sizes, default=TENANTS,
+                        help='comma separated tenant counts of synchronization benchmarks')
+    parser.add_argument('--users', type=int, default=10, help='number of users of each tenant')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added by fake salt-api to each request')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nodeconductor.server.test_settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    app = FakeSaltAPI(latency=args.latency)
+    server = app.serve()
+    api_url = 'http://127.0.0.1:%s/' % server.server_port
+
+    only = args.only.split(',')
+    results = {}
+    setup_test_environment()
+    database = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        if 'run_cmd' in only:
+            results['run_cmd'] = bench_run_cmd(api_url, args.iterations)
+            log('run_cmd: %(ops_per_sec).1f ops/sec, p50 %(p50).4fs, p99 %(p99).4fs', results['run_cmd'])
+        if 'api_construction' in only:
+            results['api_construction'] = bench_api_construction(api_url, args.iterations)
+        if 'create_entity' in only:
+            results['create_entity'] = bench_create_entity(app, args.rows)
+        if 'sync' in only:
+            results['sync'] = bench_sync(app, api_url, args.tenants, args.users)
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+        server.shutdown()
+
+    output = json.dumps({'meta': get_meta(args), 'results': results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
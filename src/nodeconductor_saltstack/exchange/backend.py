@@ -74,6 +74,7 @@ class TenantAPI(SaltStackBaseAPI):
 
 
 class UserAPI(SaltStackBaseAPI):
+    invalidates_apis = ('DistributionGroupAPI',)
 
     class Methods:
         _base = dict(
@@ -262,6 +263,7 @@ class UserAPI(SaltStackBaseAPI):
 
 
 class ContactAPI(SaltStackBaseAPI):
+    invalidates_apis = ('DistributionGroupAPI',)
 
     class Methods:
         _base = dict(
@@ -19,6 +19,7 @@ class ExchangeExtension(NodeConductorExtension):
             'exchange-sync-tenants': {
                 'task': 'nodeconductor.exchange.sync_tenants',
                 'schedule': timedelta(minutes=60),
-                'args': ()
+                'args': (),
+                'kwargs': {'period': timedelta(minutes=60).total_seconds()},
             },
         }
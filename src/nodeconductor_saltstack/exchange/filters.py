@@ -36,6 +36,7 @@ class ContactFilter(django_filters.FilterSet):
 class ConferenceRoomFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(lookup_type='icontains')
     username = django_filters.CharFilter(lookup_type='icontains')
+    email = django_filters.CharFilter(lookup_type='icontains')
     phone = django_filters.CharFilter(lookup_type='icontains')
     location = django_filters.CharFilter(lookup_type='icontains')
     tenant_domain = django_filters.CharFilter(name='tenant__domain', lookup_type='icontains')
@@ -46,6 +47,7 @@ class ConferenceRoomFilter(django_filters.FilterSet):
         fields = [
             'name',
             'username',
+            'email',
             'phone',
             'location',
             'tenant_domain',
@@ -56,6 +58,7 @@ class ConferenceRoomFilter(django_filters.FilterSet):
 class GroupFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(lookup_type='icontains')
     username = django_filters.CharFilter(lookup_type='icontains')
+    email = django_filters.CharFilter(lookup_type='icontains')
     tenant_domain = django_filters.CharFilter(name='tenant__domain', lookup_type='icontains')
     tenant_uuid = UUIDFilter(name='tenant__uuid')
 
@@ -64,6 +67,7 @@ class GroupFilter(django_filters.FilterSet):
         fields = [
             'name',
             'username',
+            'email',
             'tenant_domain',
             'tenant_uuid',
         ]
@@ -100,3 +104,20 @@ class UserFilter(django_filters.FilterSet):
             '-first_name',
             '-last_name',
         ]
+
+
+class UserImportFilter(django_filters.FilterSet):
+    tenant_uuid = UUIDFilter(name='tenant__uuid')
+    state = django_filters.CharFilter()
+
+    class Meta(object):
+        model = models.UserImport
+        fields = [
+            'tenant_uuid',
+            'state',
+        ]
+        order_by = [
+            'created',
+            # desc
+            '-created',
+        ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import jsonfield.fields
+import model_utils.fields
+import nodeconductor.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0018_remove_payable_mixin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserImport',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('uuid', nodeconductor.core.fields.UUIDField()),
+                ('state', models.CharField(default='pending', max_length=30, choices=[('pending', 'pending'), ('processing', 'processing'), ('done', 'done'), ('erred', 'erred')])),
+                ('notify', models.BooleanField(default=False, help_text='Send password to users by SMS')),
+                ('error_message', models.TextField(blank=True)),
+                ('tenant', models.ForeignKey(related_name='user_imports', to='exchange.ExchangeTenant')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserImportRow',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('index', models.PositiveIntegerField()),
+                ('state', models.CharField(default='pending', max_length=30, db_index=True, choices=[('pending', 'pending'), ('created', 'created'), ('done', 'done'), ('erred', 'erred')])),
+                ('data', jsonfield.fields.JSONField()),
+                ('backend_id', models.CharField(max_length=255, blank=True)),
+                ('password', models.CharField(max_length=255, blank=True)),
+                ('error_message', models.TextField(blank=True)),
+                ('user_import', models.ForeignKey(related_name='rows', to='exchange.UserImport')),
+            ],
+            options={
+                'ordering': ('user_import', 'index'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='userimportrow',
+            unique_together=set([('user_import', 'index')]),
+        ),
+    ]
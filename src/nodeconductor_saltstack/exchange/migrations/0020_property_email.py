@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models.functions import Concat
+
+
+def init_emails(apps, schema_editor):
+    Tenant = apps.get_model('exchange', 'ExchangeTenant')
+    models_with_email = [apps.get_model('exchange', name) for name in ('User', 'Group', 'ConferenceRoom')]
+
+    for tenant in Tenant.objects.all():
+        for model in models_with_email:
+            model.objects.filter(tenant=tenant).update(email=Concat('username', models.Value('@' + tenant.domain)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0019_userimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email',
+            field=models.CharField(db_index=True, max_length=255, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='email',
+            field=models.CharField(db_index=True, max_length=255, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='conferenceroom',
+            name='email',
+            field=models.CharField(db_index=True, max_length=255, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(init_emails),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0020_property_email'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userimportrow',
+            name='state',
+            field=models.CharField(default='pending', max_length=30, db_index=True, choices=[('pending', 'pending'), ('sending', 'sending'), ('created', 'created'), ('done', 'done'), ('erred', 'erred')]),
+        ),
+    ]
@@ -1,16 +1,19 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.db.models.functions import Concat
 from django.utils.encoding import python_2_unicode_compatible
 from gm2m import GM2MField
+from jsonfield import JSONField
 from model_utils import FieldTracker
+from model_utils.models import TimeStampedModel
 
-from nodeconductor.core.models import DescendantMixin
+from nodeconductor.core.models import DescendantMixin, UuidMixin
 from nodeconductor.quotas.models import QuotaModelMixin
 from nodeconductor.quotas.fields import QuotaLimitField, QuotaField, CounterQuotaField, LimitAggregatorQuotaField
 from nodeconductor.structure import models as structure_models
 
-from ..saltstack.models import SaltStackServiceProjectLink, SaltStackProperty
+from ..saltstack.models import SaltStackServiceProjectLink, SaltStackProperty, SearchTrigram
 from .validators import domain_validator
 
 
@@ -44,15 +47,35 @@ class ExchangeTenant(QuotaModelMixin, structure_models.PublishableResource, stru
         return super(ExchangeTenant, self).get_backend(backend_class=ExchangeBackend, tenant=self)
 
     def is_username_available(self, username, exclude=None):
+        return username not in self.get_unavailable_usernames([username], exclude=exclude)
+
+    def get_unavailable_usernames(self, usernames, exclude=None, chunk_size=500):
+        """ Return set of given usernames which are already taken by tenant users, groups or conference rooms """
         if exclude is None:
             exclude = []
         if isinstance(exclude, basestring):
             exclude = [exclude]
+        usernames = list(set(usernames) - set(exclude))
+
+        taken = set()
+        for index in range(0, len(usernames), chunk_size):
+            chunk = usernames[index:index + chunk_size]
+            for model in (User, Group, ConferenceRoom):
+                taken.update(model.objects.filter(tenant=self, username__in=chunk).values_list('username', flat=True))
+        return taken
+
+    def update_emails(self):
+        """ Rewrite stored emails of tenant properties after domain change.
+            Queryset update doesn't send signals, so search index has to be refreshed
+            by update_search_index() afterwards.
+        """
+        for model in (User, Group, ConferenceRoom):
+            model.objects.filter(tenant=self).update(email=Concat('username', models.Value('@' + self.domain)))
+
+    def update_search_index(self):
+        """ Rebuild search index of all tenant properties with email """
         for model in (User, Group, ConferenceRoom):
-            users = set(model.objects.filter(tenant=self).values_list('username', flat=True))
-            if username in users - set(exclude):
-                return False
-        return True
+            SearchTrigram.update_index(model, model.objects.filter(tenant=self))
 
     @property
     def full_name(self):
@@ -72,6 +95,28 @@ class ExchangeProperty(SaltStackProperty):
         return super(ExchangeProperty, self).get_log_fields() + ('tenant',)
 
 
+class EmailExchangeProperty(models.Model):
+    """ Property with email address built from its username and tenant domain.
+        Email is stored in DB to allow indexed lookups, it's updated on save and by ExchangeTenant.update_emails().
+    """
+    email = models.CharField(max_length=255, db_index=True, blank=True, editable=False)
+
+    class Meta(object):
+        abstract = True
+
+    def get_email(self):
+        return '{}@{}'.format(self.username, self.tenant.domain)
+
+    def save(self, *args, **kwargs):
+        # tenant is fetched for new or renamed properties only, tenant domain changes are handled by update_emails()
+        if not self.email or self.email.rsplit('@', 1)[0] != self.username:
+            self.email = self.get_email()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'email' not in update_fields:
+                kwargs['update_fields'] = list(update_fields) + ['email']
+        super(EmailExchangeProperty, self).save(*args, **kwargs)
+
+
 class MailboxExchangeProperty(QuotaModelMixin, DescendantMixin, ExchangeProperty):
 
     class Meta(object):
@@ -88,7 +133,7 @@ class MailboxExchangeProperty(QuotaModelMixin, DescendantMixin, ExchangeProperty
 
 
 @python_2_unicode_compatible
-class User(MailboxExchangeProperty):
+class User(EmailExchangeProperty, MailboxExchangeProperty):
     username = models.CharField(max_length=255)
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
@@ -103,14 +148,11 @@ class User(MailboxExchangeProperty):
     send_as_members = models.ManyToManyField('self', related_name='+')
 
     tracker = FieldTracker()
+    search_fields = ('name', 'username', 'email', 'first_name', 'last_name')
 
     class Meta(object):
         unique_together = (('username', 'tenant'), ('name', 'tenant'))
 
-    @property
-    def email(self):
-        return '{}@{}'.format(self.username, self.tenant.domain)
-
     def get_stats(self):
         backend = self.tenant.get_backend()
         return backend.users.stats(id=self.backend_id)
@@ -132,12 +174,17 @@ class Contact(ExchangeProperty):
     last_name = models.CharField(max_length=255)
 
     tracker = FieldTracker()
+    search_fields = ('name', 'email', 'first_name', 'last_name')
+
+    @classmethod
+    def get_url_name(cls):
+        return 'exchange-contacts'
 
     def get_log_fields(self):
         return super(Contact, self).get_log_fields() + ('email',)
 
 
-class Group(ExchangeProperty):
+class Group(EmailExchangeProperty, ExchangeProperty):
     manager = models.ForeignKey(User, related_name='groups')
     username = models.CharField(max_length=255)
     members = models.ManyToManyField(User, related_name='+')
@@ -146,25 +193,23 @@ class Group(ExchangeProperty):
         default=False, help_text='Delivery management for senders outside organizational unit')
 
     tracker = FieldTracker()
+    search_fields = ('name', 'username', 'email')
 
-    @property
-    def email(self):
-        return '{}@{}'.format(self.username, self.tenant.domain)
+    @classmethod
+    def get_url_name(cls):
+        return 'exchange-groups'
 
     def get_log_fields(self):
         return super(Group, self).get_log_fields() + ('username', 'email')
 
 
-class ConferenceRoom(MailboxExchangeProperty):
+class ConferenceRoom(EmailExchangeProperty, MailboxExchangeProperty):
     username = models.CharField(max_length=255)
     location = models.CharField(max_length=255, blank=True)
     phone = models.CharField(max_length=255, blank=True)
 
     tracker = FieldTracker()
-
-    @property
-    def email(self):
-        return '{}@{}'.format(self.username, self.tenant.domain)
+    search_fields = ('name', 'username', 'email', 'location')
 
     @classmethod
     def get_url_name(cls):
@@ -172,3 +217,54 @@ class ConferenceRoom(MailboxExchangeProperty):
 
     def get_log_fields(self):
         return super(ConferenceRoom, self).get_log_fields() + ('username', )
+
+
+class UserImport(UuidMixin, TimeStampedModel):
+    """ Bulk creation of tenant users from CSV, processed by chunks and resumable after failure """
+
+    class States(object):
+        PENDING = 'pending'
+        PROCESSING = 'processing'
+        DONE = 'done'
+        ERRED = 'erred'
+
+        CHOICES = ((PENDING, PENDING), (PROCESSING, PROCESSING), (DONE, DONE), (ERRED, ERRED))
+
+    tenant = models.ForeignKey(ExchangeTenant, related_name='user_imports')
+    state = models.CharField(max_length=30, choices=States.CHOICES, default=States.PENDING)
+    notify = models.BooleanField(default=False, help_text='Send password to users by SMS')
+    error_message = models.TextField(blank=True)
+
+    def get_progress(self):
+        progress = {state: 0 for state, _ in UserImportRow.States.CHOICES}
+        progress.update(self.rows.values_list('state').annotate(count=models.Count('id')))
+        progress['total'] = sum(progress.values())
+        return progress
+
+
+class UserImportRow(models.Model):
+    """ Single user of import. Row is 'sending' while its creation request is in flight,
+        'created' once user exists on backend and 'done' once it is stored in DB
+    """
+
+    class States(object):
+        PENDING = 'pending'
+        SENDING = 'sending'
+        CREATED = 'created'
+        DONE = 'done'
+        ERRED = 'erred'
+
+        CHOICES = ((PENDING, PENDING), (SENDING, SENDING), (CREATED, CREATED), (DONE, DONE), (ERRED, ERRED))
+        UNFINISHED = (PENDING, SENDING, CREATED)
+
+    user_import = models.ForeignKey(UserImport, related_name='rows')
+    index = models.PositiveIntegerField()
+    state = models.CharField(max_length=30, choices=States.CHOICES, default=States.PENDING, db_index=True)
+    data = JSONField()
+    backend_id = models.CharField(max_length=255, blank=True)
+    password = models.CharField(max_length=255, blank=True)
+    error_message = models.TextField(blank=True)
+
+    class Meta(object):
+        ordering = ('user_import', 'index')
+        unique_together = ('user_import', 'index')
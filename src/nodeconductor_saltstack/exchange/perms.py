@@ -8,4 +8,5 @@ PERMISSION_LOGICS = (
     ('exchange.Contact', property_permission_logic),
     ('exchange.User', property_permission_logic),
     ('exchange.ConferenceRoom', property_permission_logic),
+    ('exchange.UserImport', property_permission_logic),
 )
@@ -2,6 +2,7 @@ import os
 import re
 import binascii
 
+from django.db.models import Manager
 from rest_framework import serializers
 from rest_framework.compat import OrderedDict
 
@@ -13,6 +14,7 @@ from nodeconductor.structure import serializers as structure_serializers
 from ..saltstack.backend import SaltStackBackendError
 from ..saltstack.models import SaltStackServiceProjectLink
 from ..saltstack.serializers import PhoneValidationMixin
+from ..saltstack.quotas import get_quota_snapshot
 from . import models
 
 
@@ -72,7 +74,7 @@ class TenantSerializer(structure_serializers.PublishableResourceSerializer):
         if not self.instance:
             spl = attrs['service_project_link']
 
-            spl_storage_quota = spl.quotas.get(name=spl.Quotas.exchange_storage)
+            spl_storage_quota = get_quota_snapshot(self.context).get(spl, spl.Quotas.exchange_storage)
             if spl_storage_quota.is_exceeded(delta=attrs['mailbox_size']):
                 storage_left = spl_storage_quota.limit - spl_storage_quota.usage
                 raise serializers.ValidationError({
@@ -114,14 +116,16 @@ class TenantQuotaSerializer(serializers.Serializer):
 
     def validate_mailbox_size(self, value):
         tenant = self.context['tenant']
+        spl = tenant.service_project_link
+        snapshot = get_quota_snapshot(self.context)
+        snapshot.load(tenant, spl)
 
-        mailbox_size_quota = tenant.quotas.get(name=models.ExchangeTenant.Quotas.mailbox_size)
+        mailbox_size_quota = snapshot.get(tenant, models.ExchangeTenant.Quotas.mailbox_size)
         if value < mailbox_size_quota.usage:
             raise serializers.ValidationError('Global mailbox size limit cannot be lower than current usage.')
 
         diff = value - mailbox_size_quota.limit
-        spl = tenant.service_project_link
-        spl_storage_quota = spl.quotas.get(name=spl.Quotas.exchange_storage)
+        spl_storage_quota = snapshot.get(spl, spl.Quotas.exchange_storage)
         if diff > 0 and spl_storage_quota.is_exceeded(delta=diff):
             storage_left = spl_storage_quota.limit - spl_storage_quota.usage
             raise serializers.ValidationError(
@@ -129,6 +133,20 @@ class TenantQuotaSerializer(serializers.Serializer):
         return value
 
 
+class PrefetchedQuotaLimitField(serializers.IntegerField):
+    """ Quota limit which is read from prefetched quotas of object instead of separate query """
+
+    def __init__(self, quota_name, **kwargs):
+        self.quota_name = quota_name
+        super(PrefetchedQuotaLimitField, self).__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        for quota in instance.quotas.all():
+            if quota.name == self.quota_name:
+                return quota.limit
+        return None
+
+
 class BasePropertySerializer(AugmentedSerializerMixin, serializers.HyperlinkedModelSerializer):
 
     class Meta(object):
@@ -145,6 +163,10 @@ class BasePropertySerializer(AugmentedSerializerMixin, serializers.HyperlinkedMo
             'tenant': ('uuid', 'domain')
         }
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related('tenant')
+
 
 class MembersSerializer(serializers.Serializer):
 
@@ -175,12 +197,31 @@ class UsernameValidationMixin(object):
                     "The username can contain only letters, numbers, hyphens, underscores and period.")
         return value
 
+    def is_username_available(self, tenant, username):
+        if self.instance:
+            return tenant.is_username_available(username, exclude=self.instance.username)
+
+        # Check usernames of all items of bulk request at once and reuse result for each of them
+        cache = self.context.setdefault('unavailable_usernames', {})
+        if tenant.pk not in cache:
+            candidates = {username}
+            parent = self.parent
+            if isinstance(parent, serializers.ListSerializer) and isinstance(parent.initial_data, list):
+                candidates.update(item['username'] for item in parent.initial_data
+                                  if isinstance(item, dict) and item.get('username') and
+                                  isinstance(item['username'], basestring))
+            cache[tenant.pk] = (candidates, tenant.get_unavailable_usernames(candidates))
+
+        candidates, unavailable = cache[tenant.pk]
+        if username not in candidates:
+            return tenant.is_username_available(username)
+        return username not in unavailable
+
     def validate(self, attrs):
         attrs = super(UsernameValidationMixin, self).validate(attrs)
         tenant = self.instance.tenant if self.instance else attrs['tenant']
-        exclude = self.instance.username if self.instance else None
 
-        if 'username' in attrs and not tenant.is_username_available(attrs['username'], exclude=exclude):
+        if 'username' in attrs and not self.is_username_available(tenant, attrs['username']):
             raise serializers.ValidationError(
                 {'username': "This username is already taken."})
 
@@ -189,24 +230,30 @@ class UsernameValidationMixin(object):
 
 class MailboxExchangePropertySerializer(BasePropertySerializer):
 
-    mailbox_size = serializers.IntegerField(
-        min_value=1, help_text='Maximum storage size of all tenant mailboxes together, MB')
+    mailbox_size = PrefetchedQuotaLimitField(
+        quota_name='mailbox_size', min_value=1, help_text='Maximum storage size of all tenant mailboxes together, MB')
 
     quotas = BasicQuotaSerializer(many=True, read_only=True)
 
     class Meta(BasePropertySerializer.Meta):
         fields = BasePropertySerializer.Meta.fields + ('mailbox_size', 'quotas',)
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related('tenant').prefetch_related('quotas')
+
     def validate(self, attrs):
         attrs = super(MailboxExchangePropertySerializer, self).validate(attrs)
         tenant = self.instance.tenant if self.instance else attrs['tenant']
 
+        snapshot = get_quota_snapshot(self.context)
         quota = attrs['mailbox_size']
         if self.instance:
-            quota -= self.instance.mailbox_size
+            snapshot.load(self.instance, tenant)
+            quota -= snapshot.get(self.instance, self.instance.Quotas.mailbox_size).limit
 
         try:
-            tenant.validate_quota_change({tenant.Quotas.mailbox_size: quota}, raise_exception=True)
+            snapshot.validate_quota_change(tenant, {tenant.Quotas.mailbox_size: quota})
         except QuotaExceededException as e:
             raise serializers.ValidationError(str(e))
 
@@ -235,6 +282,11 @@ class UserSerializer(UsernameValidationMixin, PhoneValidationMixin, MailboxExcha
         )
         protected_fields = MailboxExchangePropertySerializer.Meta.protected_fields + ('notify',)
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related('tenant', 'manager').prefetch_related(
+            'quotas', 'send_on_behalf_members', 'send_as_members')
+
     def get_fields(self):
         fields = super(UserSerializer, self).get_fields()
         fields['send_as_members'].required = False
@@ -271,10 +323,42 @@ class ConferenceRoomSerializer(UsernameValidationMixin, PhoneValidationMixin, Ma
         read_only_fields = MailboxExchangePropertySerializer.Meta.read_only_fields + ('email',)
 
 
+class DeliveryMembersListSerializer(serializers.ListSerializer):
+
+    def get_attribute(self, instance):
+        # members loaded by GroupListSerializer together with their relations
+        members = getattr(instance, 'prefetched_delivery_members', None)
+        if members is not None:
+            return members
+        return super(DeliveryMembersListSerializer, self).get_attribute(instance)
+
+
 class DeliveryMembersSerializer(serializers.BaseSerializer):
 
     SERIALIZERS = (UserSerializer, ContactSerializer)
 
+    class Meta(object):
+        list_serializer_class = DeliveryMembersListSerializer
+
+    @classmethod
+    def prefetch(cls, groups):
+        """ Load delivery members of all groups and their relations used for representation with a few queries """
+        members = {}
+        for group in groups:
+            for member in group.delivery_members.all():
+                members.setdefault(type(member), set()).add(member.pk)
+
+        loaded = {}
+        for serializer in cls.SERIALIZERS:
+            model = serializer.Meta.model
+            if model in members:
+                for obj in serializer.eager_load(model.objects.filter(pk__in=members[model])):
+                    loaded[(model, obj.pk)] = obj
+
+        for group in groups:
+            group.prefetched_delivery_members = [
+                loaded.get((type(member), member.pk), member) for member in group.delivery_members.all()]
+
     def to_internal_value(self, data):
         members = data.get('members', [])
         result = []
@@ -304,6 +388,14 @@ class DeliveryMembersSerializer(serializers.BaseSerializer):
         raise serializers.ValidationError('Unsupported object: %s' % instance)
 
 
+class GroupListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        groups = list(data.all() if isinstance(data, Manager) else data)
+        DeliveryMembersSerializer.prefetch(groups)
+        return super(GroupListSerializer, self).to_representation(groups)
+
+
 class GroupSerializer(UsernameValidationMixin, BasePropertySerializer):
 
     delivery_members = DeliveryMembersSerializer(many=True, read_only=True)
@@ -325,6 +417,11 @@ class GroupSerializer(UsernameValidationMixin, BasePropertySerializer):
             BasePropertySerializer.Meta.related_paths.items() +
             {'manager': ('uuid', 'name')}.items()
         )
+        list_serializer_class = GroupListSerializer
+
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related('tenant', 'manager').prefetch_related('members', 'delivery_members')
 
     def get_fields(self):
         fields = super(GroupSerializer, self).get_fields()
@@ -346,3 +443,31 @@ class GroupSerializer(UsernameValidationMixin, BasePropertySerializer):
                     "Users must be from the same tenant as group, can't add %s." % user)
 
         return attrs
+
+
+class UserImportSerializer(AugmentedSerializerMixin, serializers.HyperlinkedModelSerializer):
+
+    progress = serializers.SerializerMethodField()
+    errors = serializers.SerializerMethodField()
+
+    class Meta(object):
+        model = models.UserImport
+        view_name = 'exchange-user-imports-detail'
+        fields = ('url', 'uuid', 'tenant', 'tenant_uuid', 'tenant_domain', 'state', 'notify',
+                  'error_message', 'created', 'modified', 'progress', 'errors')
+        read_only_fields = ('tenant', 'state', 'notify', 'error_message')
+        extra_kwargs = {
+            'url': {'lookup_field': 'uuid'},
+            'tenant': {'lookup_field': 'uuid', 'view_name': 'exchange-tenants-detail'},
+        }
+        related_paths = {
+            'tenant': ('uuid', 'domain')
+        }
+
+    def get_progress(self, user_import):
+        return user_import.get_progress()
+
+    def get_errors(self, user_import):
+        rows = user_import.rows.filter(state=models.UserImportRow.States.ERRED)
+        return [{'index': index, 'username': data.get('username'), 'error_message': error_message}
+                for index, data, error_message in rows.values_list('index', 'data', 'error_message')]
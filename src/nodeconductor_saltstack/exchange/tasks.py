@@ -1,15 +1,34 @@
-from celery import shared_task
+import logging
+
+from celery import chain, shared_task
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Sum, signals
 from django.utils import timezone
 
 from nodeconductor.core.tasks import save_error_message, transition, throttle
-
+from nodeconductor.quotas.models import Quota
+
+from ..saltstack.backend import SaltStackBackendError
+from ..saltstack.log import event_buffer
+from ..saltstack.tasks import poll_job
+from ..saltstack.quotas import bulk_sync_quotas
+from ..saltstack.settings import get_setting
+from ..saltstack.sync import reconcile_properties, schedule_tenants_sync
 from ..saltstack.utils import sms_user_password
-from .models import ExchangeTenant, ConferenceRoom, User
+from .models import ExchangeTenant, ConferenceRoom, Group, User, UserImport, UserImportRow
+
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task(name='nodeconductor.exchange.provision')
 def provision(tenant_uuid, **kwargs):
-    provision_tenant.si(tenant_uuid, **kwargs).apply_async(
+    chain(
+        provision_tenant.si(tenant_uuid, **kwargs),
+        poll_job.s('exchange.ExchangeTenant', tenant_uuid, 'tenants', 'create'),
+        save_tenant.s(tenant_uuid),
+    ).apply_async(
         link=set_online.si(tenant_uuid),
         link_error=set_erred.si(tenant_uuid)
     )
@@ -42,6 +61,154 @@ def create_user(tenant_uuid, notify=False, **kwargs):
             sms_user_password(user)
 
 
+@shared_task(name='nodeconductor.exchange.import_users', heavy_task=True)
+def import_users(import_uuid):
+    """ Create users of import by chunks: each chunk is created on backend within a single batch request
+        and then stored in DB in bulk. Rows keep their state, so interrupted import continues from the
+        first unfinished chunk once started again. Users sent to backend without known result
+        are looked up on backend first, so they are never created twice.
+    """
+    user_import = UserImport.objects.select_related('tenant').get(uuid=import_uuid)
+    user_import.state = UserImport.States.PROCESSING
+    user_import.error_message = ''
+    user_import.save(update_fields=['state', 'error_message'])
+
+    rows = user_import.rows.filter(state__in=UserImportRow.States.UNFINISHED)
+    chunk_size = get_setting('IMPORT_CHUNK_SIZE')
+    try:
+        while True:
+            chunk = list(rows[:chunk_size])
+            if not chunk:
+                break
+            recover_sent_users([row for row in chunk if row.state == UserImportRow.States.SENDING], user_import)
+            create_imported_users([row for row in chunk if row.state == UserImportRow.States.PENDING], user_import)
+            store_imported_users([row for row in chunk if row.state == UserImportRow.States.CREATED], user_import)
+            # mark import as alive, stale import can be resumed
+            user_import.save(update_fields=['modified'])
+    except Exception as e:
+        user_import.state = UserImport.States.ERRED
+        user_import.error_message = unicode(e)
+        user_import.save(update_fields=['state', 'error_message'])
+        raise
+
+    user_import.state = UserImport.States.DONE
+    user_import.save(update_fields=['state'])
+    logger.info('Users import %s for tenant %s has been finished: %s',
+                import_uuid, user_import.tenant.uuid.hex, user_import.get_progress())
+
+
+def get_imported_user_kwargs(row, managers):
+    kwargs = dict(row.data)
+    manager = managers.get(kwargs.pop('manager', None))
+    if manager is not None:
+        kwargs['manager'] = manager
+    return kwargs
+
+
+def recover_sent_users(rows, user_import):
+    """ Resolve rows which were sent to backend without known result, e.g. because of request timeout.
+        Users found on backend are marked as created with a new temporary password, others are sent again.
+    """
+    if not rows:
+        return
+
+    tenant = user_import.tenant
+    backend = tenant.get_backend()
+    backend.users.invalidate_cache()
+    backend_users = {user.email.lower(): user for user in backend.users.list() if getattr(user, 'email', None)}
+
+    for row in rows:
+        backend_user = backend_users.get('{}@{}'.format(row.data['username'], tenant.domain).lower())
+        if backend_user is None:
+            row.state = UserImportRow.States.PENDING
+        else:
+            # password of created user is unknown, it's reset to be stored and sent to user
+            row.state = UserImportRow.States.CREATED
+            row.backend_id = backend_user.id
+            row.password = backend.users.reset_password(id=backend_user.id).password
+        row.save(update_fields=['state', 'backend_id', 'password'])
+
+
+def create_imported_users(rows, user_import):
+    """ Create users on backend and save their backend ids in import rows.
+        Rows are marked as sending before request, so users aren't created again if its result is lost.
+    """
+    if not rows:
+        return
+
+    tenant = user_import.tenant
+    managers = User.objects.in_bulk([row.data['manager'] for row in rows if row.data.get('manager')])
+    backend = tenant.get_backend()
+
+    UserImportRow.objects.filter(id__in=[row.id for row in rows]).update(state=UserImportRow.States.SENDING)
+    for row in rows:
+        row.state = UserImportRow.States.SENDING
+
+    results = []
+    batch_error = None
+    with throttle(key=tenant.service_project_link.service.settings.backend_url, concurrency=3):
+        try:
+            with backend.users.batch():
+                for row in rows:
+                    results.append(backend.users.create(**get_imported_user_kwargs(row, managers)))
+        except SaltStackBackendError as e:
+            # errors of separate commands are stored in their rows
+            batch_error = e
+
+    with transaction.atomic():
+        for row, result in zip(rows, results):
+            if not result.executed:
+                continue
+            try:
+                backend_user = result.result
+            except SaltStackBackendError as e:
+                row.state = UserImportRow.States.ERRED
+                row.error_message = e.traceback_str
+            else:
+                row.state = UserImportRow.States.CREATED
+                row.backend_id = backend_user.id
+                row.password = backend_user.password
+            row.save(update_fields=['state', 'backend_id', 'password', 'error_message'])
+
+    # whole request has failed, rows stay sending and are looked up on backend once import is resumed
+    if batch_error and not all(result.executed for result in results):
+        raise batch_error
+
+
+def store_imported_users(rows, user_import):
+    """ Store users which were created on backend in DB """
+    if not rows:
+        return
+
+    tenant = user_import.tenant
+    managers = User.objects.in_bulk([row.data['manager'] for row in rows if row.data.get('manager')])
+    mailbox_sizes = {}
+    new_users = []
+    for row in rows:
+        kwargs = get_imported_user_kwargs(row, managers)
+        mailbox_sizes[row.backend_id] = kwargs.pop('mailbox_size')
+        user = User(tenant=tenant, backend_id=row.backend_id, password=row.password, **kwargs)
+        user.email = user.get_email()
+        new_users.append(user)
+
+    # creation events are emitted once users are committed
+    with event_buffer.collect(), transaction.atomic():
+        User.objects.bulk_create(new_users, batch_size=get_setting('BULK_UPDATE_SIZE'))
+        users = list(User.objects.filter(tenant=tenant, backend_id__in=mailbox_sizes.keys()))
+        # bulk_create doesn't send signals, while quotas and events rely on them
+        for user in users:
+            signals.post_save.send(sender=User, instance=user, created=True)
+        bulk_sync_quotas(User, User.Quotas.mailbox_size,
+                         {user.id: {'limit': mailbox_sizes[user.backend_id]} for user in users})
+        UserImportRow.objects.filter(id__in=[row.id for row in rows]).update(state=UserImportRow.States.DONE)
+
+    update_mailbox_size_usage(tenant)
+
+    if user_import.notify:
+        for user in users:
+            sms_user_password(user)
+
+
 @shared_task
 @transition(ExchangeTenant, 'begin_deleting')
 @save_error_message
@@ -51,15 +218,19 @@ def destroy_tenant(tenant_uuid, transition_entity=None):
     backend.tenants.delete()
 
 
-@shared_task(is_heavy_task=True)
+@shared_task
 @transition(ExchangeTenant, 'begin_provisioning')
 @save_error_message
 def provision_tenant(tenant_uuid, transition_entity=None, **kwargs):
     tenant = transition_entity
     backend = tenant.get_backend()
-    backent_tenant = backend.tenants.create(mailbox_size=kwargs['mailbox_size'])
+    return backend.tenants.submit('create', mailbox_size=kwargs['mailbox_size'])
+
 
-    tenant.backend_id = backent_tenant.id
+@shared_task
+def save_tenant(backend_tenant, tenant_uuid):
+    tenant = ExchangeTenant.objects.get(uuid=tenant_uuid)
+    tenant.backend_id = backend_tenant['id']
     tenant.save()
 
 
@@ -82,11 +253,27 @@ def delete(tenant_uuid):
     ExchangeTenant.objects.get(uuid=tenant_uuid).delete()
 
 
+@shared_task(name='nodeconductor.exchange.update_search_index', heavy_task=True)
+def update_search_index(tenant_uuid):
+    """ Rebuild search index of tenant properties, e.g. once their emails are changed with tenant domain """
+    ExchangeTenant.objects.get(uuid=tenant_uuid).update_search_index()
+
+
 @shared_task(name='nodeconductor.exchange.sync_tenants')
-def sync_tenants():
+def sync_tenants(period=60 * 60):
     tenants = ExchangeTenant.objects.filter(state=ExchangeTenant.States.ONLINE)
-    for tenant in tenants:
-        sync_tenant_quotas.delay(tenant.uuid.hex)
+    schedule_tenants_sync(tenants, sync_tenant_quotas, period)
+
+
+def update_mailbox_size_usage(tenant):
+    mailbox_size = 0
+    for model in (User, ConferenceRoom):
+        mailbox_size += Quota.objects.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id__in=model.objects.filter(tenant=tenant).values('id'),
+            name=model.Quotas.mailbox_size,
+        ).aggregate(limit=Sum('limit'))['limit'] or 0
+    tenant.set_quota_usage(ExchangeTenant.Quotas.mailbox_size, mailbox_size)
 
 
 @shared_task(name='nodeconductor.exchange.sync_tenant_quotas')
@@ -100,7 +287,11 @@ def sync_tenant_quotas(tenant_uuids):
     for tenant in tenants:
         backend = tenant.get_backend()
         counts = {User: 0, ConferenceRoom: 0}
-        for data in backend.stats.mailbox():
+        with throttle(key=tenant.service_project_link.service.settings.backend_url,
+                      concurrency=get_setting('SYNC_CONCURRENCY')):
+            mailboxes = backend.stats.mailbox()
+
+        for data in mailboxes:
             if data.type == 'UserMailbox':
                 stats[User][data.user_id] = data
                 counts[User] += 1
@@ -111,35 +302,61 @@ def sync_tenant_quotas(tenant_uuids):
         tenant.set_quota_usage(ExchangeTenant.Quotas.user_count, counts[User])
         tenant.set_quota_usage(ExchangeTenant.Quotas.conference_room_count, counts[ConferenceRoom])
 
+    report = {}
     for model in (User, ConferenceRoom):
-        for obj in model.objects.filter(backend_id__in=stats[model].keys()):
-            data = stats[model][obj.backend_id]
-            obj.set_quota_usage(model.Quotas.mailbox_size, data.usage)
-            obj.set_quota_limit(model.Quotas.mailbox_size, data.limit)
+        ids = model.objects.filter(tenant__in=tenants, backend_id__in=stats[model].keys())
+        values = {obj_id: {'usage': stats[model][backend_id].usage, 'limit': stats[model][backend_id].limit}
+                  for backend_id, obj_id in ids.values_list('backend_id', 'id')}
+        report[model._meta.model_name] = bulk_sync_quotas(model, model.Quotas.mailbox_size, values)
+
+    # mailbox quotas were updated in bulk, so their sum has to be aggregated explicitly
+    for tenant in tenants:
+        update_mailbox_size_usage(tenant)
+
+    logger.info('Mailbox quotas of tenants %s have been synchronized: %s', ', '.join(tenant_uuids), report)
+    return report
 
 
 @shared_task(name='nodeconductor.exchange.sync_tenant_users', heavy_task=True)
 def sync_tenant_users(tenant_uuid):
     tenant = ExchangeTenant.objects.get(uuid=tenant_uuid)
-    user_model_fields = set(User._meta.get_all_field_names())
+    fields = ('name', 'first_name', 'last_name', 'office', 'phone', 'department', 'company', 'title')
 
     backend = tenant.get_backend()
-    backend_users = backend.users.list()
-    backend_users_ids = set([user.id for user in backend_users])
-    db_users_ids = set(User.objects.filter(tenant=tenant).values_list('backend_id', flat=True))
-    added_users = [user for user in backend_users if user.id not in db_users_ids]
-    for user in added_users:
-        fields = user_model_fields & set(user.__dict__.keys())
-        new_user = {field: getattr(user, field) for field in fields}
-        new_user.update({
-            'backend_id': new_user.pop('id'),
-            'tenant': tenant
+    backend_users = []
+    incomplete_ids = []
+    for user in backend.users.list():
+        if not getattr(user, 'email', None):
+            # username can't be derived, such user is neither imported nor updated nor deleted
+            logger.warning('User %s of tenant %s has no email on backend', user.id, tenant_uuid)
+            incomplete_ids.append(user.id)
+            continue
+        # attributes absent in output are not compared, so DB values are kept for them
+        backend_user = {field: getattr(user, field) or '' for field in fields if hasattr(user, field)}
+        backend_user.update({
+            'backend_id': user.id,
+            'username': user.email.split('@')[0],
         })
-        if hasattr(user, 'email') and user.email:
-            new_user['username'] = user.email.split('@')[0]
-
-        User.objects.create(**new_user)
-
-    deleted_users = db_users_ids - backend_users_ids
-    if deleted_users:
-        User.objects.filter(tenant=tenant, name__in=deleted_users).delete()
+        if hasattr(user, 'password'):
+            backend_user['password'] = user.password or ''
+        # users are created in bulk without save(), so email has to be set explicitly
+        backend_user['email'] = '{}@{}'.format(backend_user['username'], tenant.domain)
+        backend_users.append(backend_user)
+
+    def before_delete(users):
+        users = users.exclude(backend_id__in=incomplete_ids)
+        # group manager is required and its deletion would cascade to groups which still exist on backend,
+        # such users are kept until their groups are changed
+        managers = Group.objects.filter(manager__in=users).values_list('manager', flat=True).distinct()
+        if managers:
+            logger.warning('Users %s of tenant %s are missing on backend but still manage groups, '
+                           'they are not deleted.', ', '.join(str(pk) for pk in managers), tenant_uuid)
+            users = users.exclude(pk__in=list(managers))
+        # manager relation cascades deletion, but subordinates of removed user still exist
+        User.objects.filter(manager__in=users).update(manager=None)
+        return users
+
+    report = reconcile_properties(
+        User, {'tenant': tenant}, backend_users, fields=fields + ('username',), before_delete=before_delete)
+    logger.info('Users of tenant %s have been synchronized: %s', tenant_uuid, report)
+    return report
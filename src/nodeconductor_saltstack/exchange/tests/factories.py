@@ -58,6 +58,7 @@ class ExchangeUserFactory(factory.DjangoModelFactory):
 
     tenant = factory.SubFactory(ExchangeTenantFactory)
     name = factory.Sequence(lambda n: 'user-%s' % n)
+    username = factory.Sequence(lambda n: 'user%s' % n)
     backend_id = factory.Sequence(lambda n: 'backend_id-%s' % n)
     first_name = 'Alice'
     last_name = 'Lebowski'
@@ -0,0 +1,75 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+from rest_framework import status, test
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange import tasks
+from nodeconductor_saltstack.exchange.models import ConferenceRoom, ExchangeTenant, Group, User
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+from nodeconductor_saltstack.saltstack.models import SearchTrigram
+
+
+class EmailTest(TestCase):
+    def setUp(self):
+        self.tenant = ExchangeTenantFactory(domain='example.com')
+        self.user = ExchangeUserFactory(tenant=self.tenant, username='alice')
+
+    def test_email_is_built_on_creation(self):
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, 'alice@example.com')
+
+    def test_email_is_updated_with_username(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.username = 'alice.lebowski'
+        user.save(update_fields=['username'])
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, 'alice.lebowski@example.com')
+
+    def test_tenant_is_not_fetched_if_username_is_not_changed(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.office = 'HQ'
+        with CaptureQueriesContext(connection) as context:
+            user.save(update_fields=['office'])
+
+        self.assertFalse([query for query in context.captured_queries
+                          if ExchangeTenant._meta.db_table in query['sql']])
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, 'alice@example.com')
+
+
+@patch('nodeconductor_saltstack.exchange.models.ExchangeTenant.get_backend')
+class DomainChangeTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.admin = structure_factories.UserFactory(is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.tenant = ExchangeTenantFactory(domain='example.com')
+        self.user = ExchangeUserFactory(tenant=self.tenant, username='alice')
+        self.group = Group.objects.create(tenant=self.tenant, manager=self.user, name='group', username='sales')
+        self.room = ConferenceRoom.objects.create(tenant=self.tenant, name='room', username='room')
+
+    def change_domain(self, domain):
+        with patch('nodeconductor_saltstack.exchange.views.send_task') as send_task:
+            response = self.client.post(ExchangeTenantFactory.get_url(self.tenant, 'domain'), data={'domain': domain})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return send_task
+
+    def test_emails_are_rewritten_with_domain(self, get_backend):
+        self.change_domain('example.org')
+
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, 'alice@example.org')
+        self.assertEqual(Group.objects.get(pk=self.group.pk).email, 'sales@example.org')
+        self.assertEqual(ConferenceRoom.objects.get(pk=self.room.pk).email, 'room@example.org')
+
+    def test_search_index_is_rebuilt_by_task(self, get_backend):
+        send_task = self.change_domain('dudeabides.org')
+
+        send_task.assert_called_once_with('exchange', 'update_search_index')
+        send_task.return_value.assert_called_once_with(self.tenant.uuid.hex)
+        self.assertFalse(SearchTrigram.search(self.tenant, 'dudeabides'))
+
+        tasks.update_search_index(self.tenant.uuid.hex)
+        ranking = SearchTrigram.search(self.tenant, 'dudeabides')
+        self.assertEqual({(item['content_type'], item['object_id']) for item in ranking},
+                         {(ContentType.objects.get_for_model(obj).id, obj.pk)
+                          for obj in (self.user, self.group, self.room)})
@@ -0,0 +1,50 @@
+import csv
+from cStringIO import StringIO
+
+from django.test import TestCase
+from rest_framework import status, test
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange.models import User
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+from nodeconductor_saltstack.exchange.views import stream_csv
+
+
+class StreamCSVTest(TestCase):
+    def test_rows_are_yielded_by_chunks(self):
+        rows = ({'name': 'user%s' % index, 'office': u'\u043e\u0444\u0438\u0441'} for index in range(100))
+        chunks = list(stream_csv(rows, ['name', 'office'], chunk_size=100))
+
+        self.assertTrue(len(chunks) > 10)
+        self.assertTrue(all(len(chunk) < 200 for chunk in chunks))
+        reader = csv.DictReader(StringIO(''.join(chunks)))
+        rows = list(reader)
+        self.assertEqual(reader.fieldnames, ['name', 'office'])
+        self.assertEqual([row['name'] for row in rows], ['user%s' % index for index in range(100)])
+        self.assertEqual(rows[0]['office'].decode('utf-8'), u'\u043e\u0444\u0438\u0441')
+
+    def test_header_is_yielded_without_rows(self):
+        self.assertEqual(''.join(stream_csv(iter([]), ['name', 'office'])), 'name,office\r\n')
+
+
+class UsersExportTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.admin = structure_factories.UserFactory(is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.tenant = ExchangeTenantFactory()
+        self.users = [ExchangeUserFactory(tenant=self.tenant, office='HQ') for _ in range(3)]
+        self.users[0].set_quota_limit(User.Quotas.mailbox_size, 300)
+        ExchangeUserFactory()
+
+    def test_users_of_tenant_are_streamed_as_csv(self):
+        response = self.client.get(ExchangeTenantFactory.get_url(self.tenant, 'users'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(''.join(response.streaming_content))))
+        self.assertEqual(sorted(row['uuid'] for row in rows), sorted(user.uuid.hex for user in self.users))
+        rows = {row['uuid']: row for row in rows}
+        self.assertEqual(rows[self.users[0].uuid.hex]['mailbox_size'], '300')
+        self.assertEqual(rows[self.users[0].uuid.hex]['office'], 'HQ')
+        self.assertEqual(rows[self.users[0].uuid.hex]['username'], self.users[0].username)
+        self.assertNotIn('manager', rows[self.users[0].uuid.hex])
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import MagicMock, patch
+from rest_framework import status, test
+from rest_framework.reverse import reverse
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange import tasks
+from nodeconductor_saltstack.exchange.models import ExchangeTenant, User, UserImport, UserImportRow
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory
+from nodeconductor_saltstack.saltstack.backend import BatchResult, SaltStackUnavailableError
+
+
+class BackendUser(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeUserAPI(object):
+    """ Create users within batch() block, its request could fail before or after users are created """
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.users = []
+        self.created = []
+        self.calls = None
+        self.fail = None
+
+    @contextmanager
+    def batch(self):
+        self.calls = []
+        yield
+        calls, self.calls = self.calls, None
+        if self.fail == 'request':
+            raise SaltStackUnavailableError('Connection refused')
+
+        for kwargs, result in calls:
+            self.created.append(kwargs['username'])
+            user = BackendUser(id='id-%s' % kwargs['username'], password='password-%s' % kwargs['username'],
+                               email='%s@%s' % (kwargs['username'], self.tenant.domain))
+            self.users.append(user)
+            result.set_value(user)
+
+        if self.fail == 'response':
+            for _, result in calls:
+                result.executed = False
+            raise SaltStackUnavailableError('Read timed out')
+
+    def create(self, **kwargs):
+        result = BatchResult('create')
+        self.calls.append((kwargs, result))
+        return result
+
+    def list(self):
+        return list(self.users)
+
+    def reset_password(self, id):
+        return BackendUser(password='new-password-%s' % id)
+
+    def invalidate_cache(self):
+        pass
+
+
+class ImportUsersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tenant = ExchangeTenantFactory()
+        self.backend = MagicMock()
+        self.backend.users = FakeUserAPI(self.tenant)
+        patcher = patch.object(ExchangeTenant, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user_import = UserImport.objects.create(tenant=self.tenant)
+        for index, username in enumerate(('alice', 'bob', 'carol'), start=1):
+            UserImportRow.objects.create(user_import=self.user_import, index=index, data={
+                'username': username, 'name': username.title(), 'first_name': username.title(),
+                'last_name': 'Lebowski', 'mailbox_size': 100})
+
+    def run_import(self):
+        tasks.import_users(self.user_import.uuid.hex)
+        self.user_import.refresh_from_db()
+
+    def get_states(self):
+        return list(self.user_import.rows.values_list('state', flat=True))
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'IMPORT_CHUNK_SIZE': 2})
+    def test_users_are_created_and_stored_by_chunks(self):
+        with patch.object(self.backend.users, 'batch', wraps=self.backend.users.batch) as batch:
+            self.run_import()
+
+        self.assertEqual(batch.call_count, 2)
+        self.assertEqual(self.user_import.state, UserImport.States.DONE)
+        self.assertEqual(self.get_states(), [UserImportRow.States.DONE] * 3)
+        user = User.objects.get(tenant=self.tenant, username='alice')
+        self.assertEqual((user.backend_id, user.password), ('id-alice', 'password-alice'))
+        self.assertEqual(user.quotas.get(name=User.Quotas.mailbox_size).limit, 100)
+
+    def test_users_are_not_created_twice_if_response_is_lost(self):
+        self.backend.users.fail = 'response'
+        self.assertRaises(SaltStackUnavailableError, self.run_import)
+        self.user_import.refresh_from_db()
+        self.assertEqual(self.user_import.state, UserImport.States.ERRED)
+        self.assertEqual(self.get_states(), [UserImportRow.States.SENDING] * 3)
+
+        self.backend.users.fail = None
+        self.run_import()
+
+        self.assertEqual(self.backend.users.created, ['alice', 'bob', 'carol'])
+        self.assertEqual(self.get_states(), [UserImportRow.States.DONE] * 3)
+        user = User.objects.get(tenant=self.tenant, username='alice')
+        self.assertEqual((user.backend_id, user.password), ('id-alice', 'new-password-id-alice'))
+
+    def test_users_missing_on_backend_are_sent_again(self):
+        self.backend.users.fail = 'request'
+        self.assertRaises(SaltStackUnavailableError, self.run_import)
+
+        self.backend.users.fail = None
+        self.run_import()
+
+        self.assertEqual(self.backend.users.created, ['alice', 'bob', 'carol'])
+        self.assertEqual(User.objects.get(tenant=self.tenant, username='alice').password, 'password-alice')
+
+
+class ResumeUserImportTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.admin = structure_factories.UserFactory(is_staff=True, is_superuser=True)
+        self.client.force_authenticate(self.admin)
+        self.user_import = UserImport.objects.create(
+            tenant=ExchangeTenantFactory(), state=UserImport.States.PROCESSING)
+        UserImportRow.objects.create(user_import=self.user_import, index=1, data={}, state=UserImportRow.States.SENDING)
+        self.url = reverse('exchange-user-imports-detail', kwargs={'uuid': self.user_import.uuid.hex}) + 'resume/'
+        patcher = patch('nodeconductor_saltstack.exchange.views.send_task')
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'IMPORT_STALE_TIMEOUT': 60})
+    def test_import_in_progress_is_not_resumed(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(self.send_task.called)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'IMPORT_STALE_TIMEOUT': 60})
+    def test_stale_import_is_resumed(self):
+        UserImport.objects.filter(pk=self.user_import.pk).update(modified=timezone.now() - timedelta(minutes=2))
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.send_task.return_value.assert_called_once_with(self.user_import.uuid.hex)
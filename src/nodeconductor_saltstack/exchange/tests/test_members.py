@@ -0,0 +1,90 @@
+from unittest import skipUnless
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from mock import MagicMock, patch
+
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+from nodeconductor_saltstack.saltstack.log import event_buffer
+from nodeconductor_saltstack.saltstack.sync import MembersSync
+
+
+class MembersSyncTest(TestCase):
+    def setUp(self):
+        tenant = ExchangeTenantFactory()
+        self.user = ExchangeUserFactory(tenant=tenant)
+        self.members = [ExchangeUserFactory(tenant=tenant) for _ in range(4)]
+        self.user.send_as_members.add(*self.members[:2])
+        self.api = MagicMock()
+        self.sync = MembersSync(self.user, 'send_as_members', self.api, 'add_send_as', 'del_send_as')
+
+    def test_backend_receives_single_add_and_remove_command(self):
+        self.sync.apply(self.members[1:3])
+
+        self.api.add_send_as.assert_called_once_with(id=self.user.backend_id, user_id=self.members[2].backend_id)
+        self.api.del_send_as.assert_called_once_with(id=self.user.backend_id, user_id=self.members[0].backend_id)
+
+    def test_symmetrical_relation_is_changed_in_both_directions(self):
+        added, removed = self.sync.apply(self.members[1:])
+
+        self.assertEqual(added, set(self.members[2:]))
+        self.assertEqual(removed, {self.members[0]})
+        self.assertEqual(set(self.user.send_as_members.all()), set(self.members[1:]))
+        self.assertEqual(list(self.members[3].send_as_members.all()), [self.user])
+        self.assertFalse(self.members[0].send_as_members.exists())
+
+
+@patch('nodeconductor_saltstack.saltstack.log.event_logger')
+class EventBufferTest(TestCase):
+    def log_members(self, count):
+        event_buffer.log_items(
+            'exchange_group_member',
+            'Member %s was added to group {group_name}',
+            '%(count)s members were added to group {group_name}: %(items)s',
+            ['user%02d@example.com' % index for index in range(count)],
+            event_type='exchange_group_member_add',
+            event_context={})
+
+    def test_events_are_emitted_after_block_is_finished(self, event_logger):
+        with event_buffer.collect():
+            self.log_members(3)
+            self.assertFalse(event_logger.exchange_group_member.info.called)
+        self.assertEqual(event_logger.exchange_group_member.info.call_count, 3)
+
+    def test_events_are_dropped_if_block_fails(self, event_logger):
+        with self.assertRaises(ValueError):
+            with event_buffer.collect():
+                self.log_members(3)
+                raise ValueError()
+        self.assertFalse(event_logger.exchange_group_member.info.called)
+
+    def test_large_change_is_logged_as_single_summary_event(self, event_logger):
+        with self.settings(NODECONDUCTOR_SALTSTACK={'EVENTS_SUMMARY_THRESHOLD': 2}):
+            self.log_members(5)
+
+        event_logger.exchange_group_member.info.assert_called_once_with(
+            '5 members were added to group {group_name}: user00@example.com, user01@example.com and 3 more',
+            event_type='exchange_group_member_add', event_context={})
+
+
+@skipUnless(hasattr(transaction, 'on_commit'), 'Events are deferred until commit only with transaction.on_commit')
+@patch('nodeconductor_saltstack.saltstack.log.event_logger')
+class EventBufferTransactionTest(TransactionTestCase):
+    def log_member(self):
+        event_buffer.log('exchange_group_member', 'Member was added', 'exchange_group_member_add', {})
+
+    def test_events_are_emitted_after_enclosing_transaction_is_committed(self, event_logger):
+        with transaction.atomic():
+            with event_buffer.collect():
+                self.log_member()
+            self.assertFalse(event_logger.exchange_group_member.info.called)
+        event_logger.exchange_group_member.info.assert_called_once_with(
+            'Member was added', event_type='exchange_group_member_add', event_context={})
+
+    def test_events_are_dropped_if_enclosing_transaction_is_rolled_back(self, event_logger):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                with event_buffer.collect():
+                    self.log_member()
+                raise ValueError()
+        self.assertFalse(event_logger.exchange_group_member.info.called)
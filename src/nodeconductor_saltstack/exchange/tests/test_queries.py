@@ -0,0 +1,56 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status, test
+from rest_framework.reverse import reverse
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange.models import ConferenceRoom, Contact, Group
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+
+
+class ListQueriesTest(test.APITransactionTestCase):
+    """ Number of queries of list endpoints should not depend on number of objects """
+
+    def setUp(self):
+        self.admin = structure_factories.UserFactory(is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.tenant = ExchangeTenantFactory()
+
+    def create_objects(self, count):
+        for _ in range(count):
+            manager = ExchangeUserFactory(tenant=self.tenant)
+            user = ExchangeUserFactory(tenant=self.tenant, manager=manager)
+            user.send_as_members.add(manager)
+            user.send_on_behalf_members.add(manager)
+            contact = Contact.objects.create(
+                tenant=self.tenant, name='contact', email='contact@example.com', backend_id=user.backend_id)
+            group = Group.objects.create(
+                tenant=self.tenant, manager=manager, name=user.name, username=user.name, backend_id=user.backend_id)
+            group.members.add(user, manager)
+            group.delivery_members.add(user, contact)
+            ConferenceRoom.objects.create(
+                tenant=self.tenant, name=user.name, username=user.username, backend_id=user.backend_id)
+
+    def get_queries_count(self, url_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name), {'page_size': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def assert_queries_count_is_constant(self, url_name):
+        self.create_objects(2)
+        expected = self.get_queries_count(url_name)
+        self.create_objects(8)
+        self.assertEqual(self.get_queries_count(url_name), expected)
+
+    def test_users_list(self):
+        self.assert_queries_count_is_constant('exchange-users-list')
+
+    def test_groups_list(self):
+        self.assert_queries_count_is_constant('exchange-groups-list')
+
+    def test_contacts_list(self):
+        self.assert_queries_count_is_constant('exchange-contacts-list')
+
+    def test_conference_rooms_list(self):
+        self.assert_queries_count_is_constant('exchange-conference-rooms-list')
@@ -0,0 +1,132 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from mock import MagicMock, patch
+from rest_framework.test import APIRequestFactory
+
+from nodeconductor.quotas.exceptions import QuotaExceededException
+from nodeconductor.quotas.models import Quota
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange import tasks
+from nodeconductor_saltstack.exchange.models import ConferenceRoom, ExchangeTenant, User
+from nodeconductor_saltstack.exchange.serializers import UserSerializer
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+from nodeconductor_saltstack.saltstack.quotas import QuotaSnapshot, bulk_sync_quotas
+
+
+class Mailbox(object):
+    def __init__(self, user_id, type, usage, limit):
+        self.user_id = user_id
+        self.type = type
+        self.usage = usage
+        self.limit = limit
+
+
+class BulkSyncQuotasTest(TestCase):
+    def setUp(self):
+        self.users = [ExchangeUserFactory() for _ in range(3)]
+        for user in self.users:
+            user.set_quota_limit(User.Quotas.mailbox_size, 100)
+            user.set_quota_usage(User.Quotas.mailbox_size, 10)
+
+    def get_quota(self, user):
+        return user.quotas.get(name=User.Quotas.mailbox_size)
+
+    def test_changed_quotas_are_updated_by_single_statement(self):
+        values = {
+            self.users[0].id: {'usage': 20, 'limit': 100},
+            self.users[1].id: {'usage': 30, 'limit': 200},
+            self.users[2].id: {'usage': 10, 'limit': 100},
+        }
+        with CaptureQueriesContext(connection) as context:
+            report = bulk_sync_quotas(User, User.Quotas.mailbox_size, values)
+
+        self.assertEqual(report, {'changed': 2, 'unchanged': 1})
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)  # one CASE statement per field
+        self.assertEqual((self.get_quota(self.users[0]).usage, self.get_quota(self.users[0]).limit), (20, 100))
+        self.assertEqual((self.get_quota(self.users[1]).usage, self.get_quota(self.users[1]).limit), (30, 200))
+        self.assertEqual((self.get_quota(self.users[2]).usage, self.get_quota(self.users[2]).limit), (10, 100))
+
+    def test_unchanged_quotas_are_not_written(self):
+        values = {user.id: {'usage': 10, 'limit': 100} for user in self.users}
+        with CaptureQueriesContext(connection) as context:
+            report = bulk_sync_quotas(User, User.Quotas.mailbox_size, values)
+
+        self.assertEqual(report, {'changed': 0, 'unchanged': 3})
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('UPDATE')])
+
+
+class SyncTenantQuotasTest(TestCase):
+    def setUp(self):
+        self.tenant = ExchangeTenantFactory()
+        self.users = [ExchangeUserFactory(tenant=self.tenant) for _ in range(2)]
+        self.room = ConferenceRoom.objects.create(
+            tenant=self.tenant, name='room', username='room', backend_id='room')
+        self.backend = MagicMock()
+        self.backend.stats.mailbox.return_value = [
+            Mailbox(self.users[0].backend_id, 'UserMailbox', 10, 100),
+            Mailbox(self.users[1].backend_id, 'UserMailbox', 20, 200),
+            Mailbox(self.room.backend_id, 'RoomMailbox', 5, 50),
+        ]
+        patcher = patch.object(ExchangeTenant, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mailbox_quotas_and_tenant_usage_are_synchronized(self):
+        report = tasks.sync_tenant_quotas([self.tenant.uuid.hex])
+
+        self.assertEqual(report['user'], {'changed': 2, 'unchanged': 0})
+        self.assertEqual(report['conferenceroom'], {'changed': 1, 'unchanged': 0})
+        quota = self.users[1].quotas.get(name=User.Quotas.mailbox_size)
+        self.assertEqual((quota.usage, quota.limit), (20, 200))
+        # tenant usage is a sum of mailbox limits of users and conference rooms
+        self.assertEqual(self.tenant.quotas.get(name=ExchangeTenant.Quotas.mailbox_size).usage, 350)
+        self.assertEqual(self.tenant.quotas.get(name=ExchangeTenant.Quotas.user_count).usage, 2)
+        self.assertEqual(self.tenant.quotas.get(name=ExchangeTenant.Quotas.conference_room_count).usage, 1)
+
+    def test_second_run_has_nothing_to_change(self):
+        tasks.sync_tenant_quotas([self.tenant.uuid.hex])
+        report = tasks.sync_tenant_quotas([self.tenant.uuid.hex])
+
+        self.assertEqual(report['user'], {'changed': 0, 'unchanged': 2})
+        self.assertEqual(self.tenant.quotas.get(name=ExchangeTenant.Quotas.mailbox_size).usage, 350)
+
+
+class QuotaSnapshotTest(TestCase):
+    def setUp(self):
+        self.tenant = ExchangeTenantFactory()
+        self.tenant.set_quota_limit(ExchangeTenant.Quotas.mailbox_size, 100)
+        self.users = [ExchangeUserFactory(tenant=self.tenant) for _ in range(3)]
+        # content types are cached by Django once loaded
+        ContentType.objects.get_for_models(ExchangeTenant, User)
+
+    def get_quota_queries(self, context):
+        return [query for query in context.captured_queries if Quota._meta.db_table in query['sql']]
+
+    def test_quotas_of_several_objects_are_loaded_by_single_query(self):
+        snapshot = QuotaSnapshot()
+        with self.assertNumQueries(1):
+            snapshot.load(self.tenant, *self.users)
+            snapshot.get(self.users[0], User.Quotas.mailbox_size)
+            snapshot.validate_quota_change(self.tenant, {ExchangeTenant.Quotas.mailbox_size: 50})
+
+        self.assertRaises(QuotaExceededException, snapshot.validate_quota_change,
+                          self.tenant, {ExchangeTenant.Quotas.mailbox_size: 200})
+
+    def test_missing_quota_raises_does_not_exist(self):
+        self.assertRaises(Quota.DoesNotExist, QuotaSnapshot().get, self.tenant, 'missing')
+
+    def test_users_list_validation_loads_tenant_quotas_once(self):
+        request = APIRequestFactory().post('/')
+        request.user = structure_factories.UserFactory(is_staff=True)
+        tenant_url = ExchangeTenantFactory.get_url(self.tenant)
+        data = [{'tenant': tenant_url, 'name': 'New user %s' % index, 'username': 'new%s' % index,
+                 'first_name': 'Alice', 'last_name': 'Lebowski', 'mailbox_size': 10} for index in range(5)]
+
+        serializer = UserSerializer(data=data, many=True, context={'request': request})
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        self.assertEqual(len(self.get_quota_queries(context)), 1)
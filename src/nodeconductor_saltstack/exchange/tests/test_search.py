@@ -0,0 +1,38 @@
+from rest_framework import status, test
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange.models import Contact
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+
+
+class TenantSearchTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.admin = structure_factories.UserFactory(is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.tenant = ExchangeTenantFactory()
+        self.user = ExchangeUserFactory(tenant=self.tenant, first_name='Jeffrey', last_name='Lebowski')
+        self.contact = Contact.objects.create(
+            tenant=self.tenant, name='Walter', email='walter.sobchak@example.com', first_name='Walter',
+            last_name='Sobchak', backend_id='contact')
+        ExchangeUserFactory(first_name='Jeffrey', last_name='Lebowski')
+
+    def search(self, **params):
+        response = self.client.get(ExchangeTenantFactory.get_url(self.tenant, 'search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['uuid'] for item in response.data]
+
+    def test_objects_of_tenant_are_found_by_name_fragment(self):
+        self.assertEqual(self.search(query='lebowsk'), [self.user.uuid.hex])
+        self.assertEqual(self.search(query='sobchak'), [self.contact.uuid.hex])
+
+    def test_search_can_be_limited_by_type(self):
+        self.assertEqual(self.search(query='walter', type='exchange.user'), [])
+
+    def test_index_is_updated_on_save_and_delete(self):
+        self.user.last_name = 'Dude'
+        self.user.save()
+        self.assertEqual(self.search(query='lebowski'), [])
+        self.assertEqual(self.search(query='dude'), [self.user.uuid.hex])
+
+        self.contact.delete()
+        self.assertEqual(self.search(query='sobchak'), [])
@@ -0,0 +1,110 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from mock import MagicMock, patch
+
+from nodeconductor_saltstack.exchange import tasks
+from nodeconductor_saltstack.exchange.models import ExchangeTenant, Group, User
+from nodeconductor_saltstack.exchange.tests.factories import (
+    ExchangeTenantFactory, ExchangeUserFactory, ServiceProjectLinkFactory)
+from nodeconductor_saltstack.saltstack.sync import schedule_tenants_sync
+
+
+class BackendUser(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class SyncTenantUsersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tenant = ExchangeTenantFactory()
+        self.user = ExchangeUserFactory(tenant=self.tenant, office='HQ', phone='123')
+        self.backend = MagicMock()
+        patcher = patch.object(ExchangeTenant, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sync(self, *users):
+        self.backend.users.list.return_value = list(users)
+        return tasks.sync_tenant_users(self.tenant.uuid.hex)
+
+    def test_attributes_absent_in_backend_output_are_not_cleared(self):
+        self.sync(BackendUser(id=self.user.backend_id, email='alice@example.com', name='Alice', office='Office'))
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.office, 'Office')
+        self.assertEqual(self.user.phone, '123')
+        self.assertEqual(self.user.username, 'alice')
+
+    def test_users_without_email_are_neither_created_nor_deleted(self):
+        report = self.sync(BackendUser(id=self.user.backend_id, name='Alice'), BackendUser(id='new', name='Bob'))
+
+        self.assertEqual(report['created'], 0)
+        self.assertEqual(report['deleted'], 0)
+        self.assertEqual(list(User.objects.filter(tenant=self.tenant)), [self.user])
+
+    def test_snapshot_is_not_skipped_if_users_were_deleted_from_database(self):
+        backend_user = BackendUser(id=self.user.backend_id, email='alice@example.com', name='Alice')
+        self.sync(backend_user)
+        self.assertEqual(self.sync(backend_user), {'skipped': True})
+
+        self.user.delete()
+        self.assertEqual(self.sync(backend_user)['created'], 1)
+
+    def test_changed_users_are_updated_by_single_statement_per_field(self):
+        other = ExchangeUserFactory(tenant=self.tenant, office='HQ', phone='123')
+        with CaptureQueriesContext(connection) as context:
+            report = self.sync(
+                BackendUser(id=self.user.backend_id, email='alice@example.com', name='Alice', office='Office'),
+                BackendUser(id=other.backend_id, email='bob@example.com', name='Bob', office='Office'))
+
+        self.assertEqual(report['updated'], 2)
+        updates = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE') and User._meta.db_table in query['sql']]
+        self.assertEqual(len(updates), 3)  # name, username and office
+        self.assertEqual(User.objects.get(pk=other.pk).office, 'Office')
+
+    def test_users_managing_groups_are_not_deleted(self):
+        manager = ExchangeUserFactory(tenant=self.tenant)
+        group = Group.objects.create(tenant=self.tenant, manager=manager, name='group', username='group')
+        backend_user = BackendUser(id=self.user.backend_id, email='alice@example.com', name='Alice')
+
+        report = self.sync(backend_user)
+
+        self.assertEqual(report['deleted'], 0)
+        self.assertTrue(Group.objects.filter(pk=group.pk).exists())
+        self.assertTrue(User.objects.filter(pk=manager.pk).exists())
+
+        group.delete()
+        self.assertEqual(self.sync(backend_user)['deleted'], 1)
+        self.assertFalse(User.objects.filter(pk=manager.pk).exists())
+
+
+@override_settings(NODECONDUCTOR_SALTSTACK={'SYNC_CHUNK_SIZE': 2, 'SYNC_CONCURRENCY': 2, 'SYNC_SPREAD': 0.5})
+class ScheduleTenantsSyncTest(TestCase):
+    def setUp(self):
+        link = ServiceProjectLinkFactory(service__settings__backend_url='http://master-a/')
+        self.tenants_a = [ExchangeTenantFactory(service_project_link=link) for _ in range(7)]
+        link = ServiceProjectLinkFactory(service__settings__backend_url='http://master-b/')
+        self.tenants_b = [ExchangeTenantFactory(service_project_link=link)]
+        self.task = MagicMock()
+
+    def get_calls(self, tenants):
+        uuids = {tenant.uuid.hex for tenant in tenants}
+        calls = [(kwargs['args'][0], kwargs['countdown']) for _, kwargs in self.task.apply_async.call_args_list]
+        return [(chunk, countdown) for chunk, countdown in calls if uuids.issuperset(chunk)]
+
+    def test_chunks_of_each_master_are_started_by_waves_within_spread_part_of_period(self):
+        schedule_tenants_sync(ExchangeTenant.objects.order_by('pk'), self.task, period=100)
+
+        calls = self.get_calls(self.tenants_a)
+        self.assertEqual([len(chunk) for chunk, _ in calls], [2, 2, 2, 1])
+        # 4 chunks with concurrency 2 are started by 2 waves within 50 seconds
+        self.assertEqual([countdown for _, countdown in calls], [0, 0, 25, 25])
+        self.assertEqual(sorted(uuid for chunk, _ in calls for uuid in chunk),
+                         sorted(tenant.uuid.hex for tenant in self.tenants_a))
+
+        # load of other master doesn't delay its tenants
+        self.assertEqual(self.get_calls(self.tenants_b), [([self.tenants_b[0].uuid.hex], 0)])
@@ -0,0 +1,42 @@
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.exchange.serializers import UserSerializer
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ExchangeUserFactory
+
+
+class UsernameAvailabilityTest(TestCase):
+    def setUp(self):
+        self.tenant = ExchangeTenantFactory()
+        ExchangeUserFactory(tenant=self.tenant, username='alice')
+        ExchangeUserFactory(tenant=self.tenant, username='bob')
+        ExchangeUserFactory(username='carol')
+
+    def test_unavailable_usernames_are_checked_with_constant_number_of_queries(self):
+        usernames = ['alice', 'bob', 'carol'] + ['user%s' % i for i in range(100)]
+        with self.assertNumQueries(3):
+            unavailable = self.tenant.get_unavailable_usernames(usernames)
+
+        self.assertEqual(unavailable, {'alice', 'bob'})
+
+    def test_excluded_username_is_available(self):
+        self.assertFalse(self.tenant.is_username_available('alice'))
+        self.assertTrue(self.tenant.is_username_available('alice', exclude='alice'))
+        self.assertTrue(self.tenant.is_username_available('carol'))
+
+    def test_non_string_usernames_of_bulk_request_fail_validation(self):
+        request = APIRequestFactory().post('/')
+        request.user = structure_factories.UserFactory(is_staff=True)
+        self.tenant.set_quota_limit(self.tenant.Quotas.mailbox_size, 100)
+        tenant_url = ExchangeTenantFactory.get_url(self.tenant)
+        data = [{'tenant': tenant_url, 'name': 'User %s' % index, 'username': username,
+                 'first_name': 'Alice', 'last_name': 'Lebowski', 'mailbox_size': 10}
+                for index, username in enumerate(('dave', ['eve'], {'name': 'frank'}))]
+
+        serializer = UserSerializer(data=data, many=True, context={'request': request})
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[0], {})
+        self.assertIn('username', serializer.errors[1])
+        self.assertIn('username', serializer.errors[2])
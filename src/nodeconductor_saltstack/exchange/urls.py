@@ -7,3 +7,4 @@ def register_in(router):
     router.register(r'exchange-groups', views.GroupViewSet, base_name='exchange-groups')
     router.register(r'exchange-users', views.UserViewSet, base_name='exchange-users')
     router.register(r'exchange-conference-rooms', views.ConferenceRoomViewSet, base_name='exchange-conference-rooms')
+    router.register(r'exchange-user-imports', views.UserImportViewSet, base_name='exchange-user-imports')
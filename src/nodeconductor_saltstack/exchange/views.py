@@ -1,21 +1,48 @@
+from datetime import timedelta
 from cStringIO import StringIO
-from django.http import HttpResponse
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
+from rest_framework import filters as rf_filters, permissions, viewsets
 from rest_framework.decorators import detail_route
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 
+from nodeconductor.core.exceptions import IncorrectStateException
 from nodeconductor.core.tasks import send_task
 from nodeconductor.core.csv import UnicodeDictReader, UnicodeDictWriter
+from nodeconductor.quotas.models import Quota
 from nodeconductor.structure import views as structure_views
+from nodeconductor.structure.filters import GenericRoleFilter
 
 from . import filters, models, serializers
+from ..saltstack.quotas import get_quota_snapshot
+from ..saltstack.settings import get_setting
+from ..saltstack.sync import MembersSync
 from ..saltstack.utils import sms_user_password
-from ..saltstack.views import BasePropertyViewSet, track_exceptions
+from ..saltstack.views import BasePropertyViewSet, TenantSearchMixin, track_exceptions
 from log import event_logger
+from ..saltstack.log import buffer_events, event_buffer
 
 
-class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
+def stream_csv(rows, fieldnames, chunk_size=64 * 1024):
+    """ Render dictionaries as CSV yielding output by chunks of about chunk_size bytes """
+    buf = StringIO()
+    writer = UnicodeDictWriter(buf, fieldnames=fieldnames)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= chunk_size:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+class TenantViewSet(TenantSearchMixin, structure_views.BaseOnlineResourceViewSet):
     queryset = models.ExchangeTenant.objects.all()
     serializer_class = serializers.TenantSerializer
     filter_class = filters.TenantFilter
@@ -42,8 +69,11 @@ class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
             old_domain = tenant.domain
             if new_domain != old_domain:
                 backend.tenants.change(domain=new_domain)
-                tenant.domain = new_domain
-                tenant.save()
+                with transaction.atomic():
+                    tenant.domain = new_domain
+                    tenant.save()
+                    tenant.update_emails()
+                send_task('exchange', 'update_search_index')(tenant.uuid.hex)
 
                 event_logger.exchange_tenant.info(
                     'Exchange tenant {tenant_name} domain has been changed from %s to %s.' % (old_domain, new_domain),
@@ -83,7 +113,8 @@ class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
             serializer.is_valid(raise_exception=True)
 
             mailbox_size_sum = sum([user['mailbox_size'] for user in serializer.validated_data])
-            mailbox_quota = tenant.quotas.get(name='mailbox_size')
+            snapshot = get_quota_snapshot(serializer.context)
+            mailbox_quota = snapshot.get(tenant, models.ExchangeTenant.Quotas.mailbox_size)
             if mailbox_quota.is_exceeded(mailbox_size_sum):
                 return Response({'detail': "Size of users' mailboxes exceeds tenant's quota %s" %
                                  mailbox_quota.limit}, status=HTTP_400_BAD_REQUEST)
@@ -91,28 +122,47 @@ class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
             # check if global notification has been requested
             notify_user = request.data.get('notify', False)
 
-            for user in serializer.validated_data:
-                del user['tenant']
-                send_task('exchange', 'create_user')(
-                    tenant_uuid=tenant.uuid.hex,
-                    notify=notify_user,
-                    **user)
+            rows = []
+            for index, user in enumerate(serializer.validated_data, start=1):
+                data = {k: v for k, v in user.items()
+                        if k not in ('tenant', 'notify', 'send_on_behalf_members', 'send_as_members')}
+                if data.get('manager'):
+                    data['manager'] = data['manager'].pk
+                rows.append(models.UserImportRow(index=index, data=data))
+
+            with transaction.atomic():
+                user_import = models.UserImport.objects.create(tenant=tenant, notify=notify_user)
+                for row in rows:
+                    row.user_import = user_import
+                models.UserImportRow.objects.bulk_create(rows, batch_size=get_setting('BULK_UPDATE_SIZE'))
+
+            send_task('exchange', 'import_users')(user_import.uuid.hex)
 
-            return Response({'status': "%s users scheduled for creation" % len(serializer.validated_data)})
+            import_url = reverse(
+                'exchange-user-imports-detail', kwargs={'uuid': user_import.uuid.hex}, request=request)
+            return Response({'status': "%s users scheduled for creation" % len(rows), 'import': import_url})
 
         elif request.method == 'GET':
             users = models.User.objects.filter(tenant=tenant)
-            serializer = serializers.UserSerializer(instance=users, many=True, context={'request': request})
-
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="%s_users.csv"' % tenant.backend_id
+            mailbox_sizes = dict(Quota.objects.filter(
+                content_type=ContentType.objects.get_for_model(models.User),
+                object_id__in=users.values('pk'),
+                name=models.User.Quotas.mailbox_size,
+            ).values_list('object_id', 'limit'))
 
             exclude = ('url', 'tenant', 'tenant_uuid', 'tenant_domain', 'manager',
                        'notify', 'send_on_behalf_members', 'send_as_members', 'quotas')
             headers = [f for f in serializers.UserSerializer.Meta.fields if f not in exclude]
-            writer = UnicodeDictWriter(response, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(serializer.data)
+
+            def get_rows():
+                for user in users.select_related('tenant').iterator():
+                    row = {f: getattr(user, f) for f in headers if f not in ('uuid', 'mailbox_size')}
+                    row['uuid'] = user.uuid.hex
+                    row['mailbox_size'] = int(mailbox_sizes.get(user.pk, 0))
+                    yield row
+
+            response = StreamingHttpResponse(stream_csv(get_rows(), headers), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="%s_users.csv"' % tenant.backend_id
             return response
 
     # XXX: put was added as portal has a temporary bug with widget update
@@ -125,7 +175,7 @@ class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
         serializer = serializers.TenantQuotaSerializer(data=request.data, context={'tenant': tenant})
         serializer.is_valid(raise_exception=True)
 
-        old_quota = tenant.quotas.get(name=models.ExchangeTenant.Quotas.mailbox_size)
+        old_quota = get_quota_snapshot(serializer.context).get(tenant, models.ExchangeTenant.Quotas.mailbox_size)
         new_quota_limit = serializer.validated_data['mailbox_size']
         backend.tenants.change_quotas(mailbox_size=new_quota_limit)
         tenant.set_quota_limit(models.ExchangeTenant.Quotas.mailbox_size, new_quota_limit)
@@ -145,34 +195,31 @@ class PropertyWithMembersViewSet(BasePropertyViewSet):
     # TODO: Add events to `members_create` and `members_update` methods,
     #       remove `members_update_with_db` method.
 
-    def members_create(self, obj, field_name='', add_method=None):
-        backend = self.get_backend(obj.tenant)
-        members_ids = getattr(obj, field_name).values_list('backend_id', flat=True)
+    def get_members_sync(self, obj, field_name, add_method=None, del_method=None):
+        return MembersSync(obj, field_name, self.get_backend(obj.tenant), add_method, del_method)
 
-        if members_ids:
-            getattr(backend, add_method)(id=obj.backend_id, user_id=','.join(members_ids))
-        return members_ids
+    def members_create(self, obj, field_name='', add_method=None):
+        sync = self.get_members_sync(obj, field_name, add_method=add_method)
+        members = sync.get_members()
+        sync.push(members, ())
+        return members
 
     def members_update(self, obj, field_name='', add_method=None, del_method=None, list_method=None, data=None):
-        backend = self.get_backend(obj.tenant)
+        """ Push members changed by serializer to backend, current members are stored by pre_update """
         if field_name in data:
-            cur_members = getattr(self, 'cur_%s' % field_name)
-            new_members = set(u.backend_id for u in data.get(field_name))
-
-            new_users = new_members - cur_members
-            if new_users:
-                getattr(backend, add_method)(id=obj.backend_id, user_id=','.join(new_users))
-
-            # TODO: replace it with single method deletion when implemented on backend
-            for old_user in cur_members - new_members:
-                getattr(backend, del_method)(id=obj.backend_id, user_id=old_user)
-            return new_users, cur_members - new_members
-        return [], []
+            sync = self.get_members_sync(obj, field_name, add_method=add_method, del_method=del_method)
+            added, removed = sync.diff(data[field_name], current=getattr(self, 'cur_%s' % field_name))
+            with sync.api.batch():
+                results = sync.push(added, removed)
+            for result in results:
+                result.result  # raise backend error if any
+            return added, removed
+        return set(), set()
 
     def members_list(self, field_name='', list_method=None):
         obj = self.get_object()
         request = self.request
-        entities = getattr(obj, field_name).all()
+        entities = serializers.UserSerializer.eager_load(getattr(obj, field_name).all())
 
         return Response(serializers.UserSerializer(
             entities, many=True, context={'request': request}).data, status=HTTP_200_OK)
@@ -180,26 +227,11 @@ class PropertyWithMembersViewSet(BasePropertyViewSet):
     # XXX: temporary method
     def members_update_with_db(self, request, field_name='', add_method=None, del_method=None):
         obj = self.get_object()
-        backend = self.get_backend(obj.tenant)
-        members_qs = getattr(obj, field_name)
-
         serializer = serializers.MembersSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        new_members = set(u.backend_id for u in serializer.validated_data['members'])
-        cur_members = set(members_qs.values_list('backend_id', flat=True))
-
-        new_users = new_members - cur_members
-        if new_users:
-            getattr(backend, add_method)(id=obj.backend_id, user_id=','.join(new_users))
-            members_qs.add(*models.User.objects.filter(backend_id__in=new_users))
-
-        old_users = cur_members - new_members
-        if old_users:
-            getattr(backend, del_method)(id=obj.backend_id, user_id=','.join(old_users))
-            members_qs.remove(*models.User.objects.filter(backend_id__in=old_users))
-
-        return new_users, old_users
+        sync = self.get_members_sync(obj, field_name, add_method=add_method, del_method=del_method)
+        return sync.apply(serializer.validated_data['members'])
 
 
 class UserViewSet(PropertyWithMembersViewSet):
@@ -212,15 +244,16 @@ class UserViewSet(PropertyWithMembersViewSet):
         user.password = backend_user.password
         user.save()
 
-        self.members_create(user, 'send_on_behalf_members', 'add_send_on_behalf')
-        self.members_create(user, 'send_as_members', 'add_send_as')
+        with self.get_backend(user.tenant).batch():
+            self.members_create(user, 'send_on_behalf_members', 'add_send_on_behalf')
+            self.members_create(user, 'send_as_members', 'add_send_as')
 
         if serializer.validated_data.get('notify'):
             sms_user_password(user)
 
     def pre_update(self, user, serializer):
-        self.cur_send_on_behalf_members = set(user.send_on_behalf_members.values_list('backend_id', flat=True))
-        self.cur_send_as_members = set(user.send_as_members.values_list('backend_id', flat=True))
+        self.cur_send_on_behalf_members = set(user.send_on_behalf_members.all())
+        self.cur_send_as_members = set(user.send_as_members.all())
 
     def post_update(self, user, serializer):
         self.members_update(
@@ -257,55 +290,60 @@ class UserViewSet(PropertyWithMembersViewSet):
 
     # XXX: put was added as portal has a temporary bug with widget update
     @detail_route(methods=['get', 'post', 'put'])
+    @buffer_events
     def sendonbehalf(self, request, pk=None, **kwargs):
         affected_user = self.get_object()
         if request.method in ('POST', 'PUT'):
-            new_users_ids, old_users_ids = self.members_update_with_db(
+            new_users, old_users = self.members_update_with_db(
                 request, 'send_on_behalf_members',
                 add_method='add_send_on_behalf', del_method='del_send_on_behalf')
 
-            for user in models.User.objects.filter(backend_id__in=new_users_ids):
-                event_logger.exchange_user_member.info(
-                    'Send On Behalf member %s was added to user {affected_user_name} ({affected_user_email})' % user.email,
-                    event_type='exchange_user_send_on_behalf_member_add',
-                    event_context={
-                        'affected_user': affected_user,
-                    })
-
-            for user in models.User.objects.filter(backend_id__in=old_users_ids):
-                event_logger.exchange_user_member.info(
-                    'Send On Behalf member %s was removed from user {affected_user_name} ({affected_user_email})' % user.email,
-                    event_type='exchange_user_send_on_behalf_member_remove',
-                    event_context={
-                        'affected_user': affected_user,
-                    })
+            event_buffer.log_items(
+                'exchange_user_member',
+                'Send On Behalf member %s was added to user {affected_user_name} ({affected_user_email})',
+                '%(count)s Send On Behalf members were added to user'
+                ' {affected_user_name} ({affected_user_email}): %(items)s',
+                [user.email for user in new_users],
+                event_type='exchange_user_send_on_behalf_member_add',
+                event_context={'affected_user': affected_user})
+
+            event_buffer.log_items(
+                'exchange_user_member',
+                'Send On Behalf member %s was removed from user {affected_user_name} ({affected_user_email})',
+                '%(count)s Send On Behalf members were removed from user'
+                ' {affected_user_name} ({affected_user_email}): %(items)s',
+                [user.email for user in old_users],
+                event_type='exchange_user_send_on_behalf_member_remove',
+                event_context={'affected_user': affected_user})
 
         return self.members_list('send_on_behalf_members')
 
     # XXX: put was added as portal has a temporary bug with widget update
     @detail_route(methods=['get', 'post', 'put'])
+    @buffer_events
     def sendas(self, request, pk=None, **kwargs):
         affected_user = self.get_object()
         if request.method in ('POST', 'PUT'):
-            new_users_ids, old_users_ids = self.members_update_with_db(
+            new_users, old_users = self.members_update_with_db(
                 request, 'send_as_members',
                 add_method='add_send_as', del_method='del_send_as')
 
-            for user in models.User.objects.filter(backend_id__in=new_users_ids):
-                event_logger.exchange_user_member.info(
-                    'Send As member %s was added to user {affected_user_name} ({affected_user_email})' % user.email,
-                    event_type='exchange_user_send_as_member_add',
-                    event_context={
-                        'affected_user': affected_user,
-                    })
-
-            for user in models.User.objects.filter(backend_id__in=old_users_ids):
-                event_logger.exchange_user_member.info(
-                    'Send As member %s was removed from user {affected_user_name} ({affected_user_email})' % user.email,
-                    event_type='exchange_user_send_as_member_remove',
-                    event_context={
-                        'affected_user': affected_user,
-                    })
+            event_buffer.log_items(
+                'exchange_user_member',
+                'Send As member %s was added to user {affected_user_name} ({affected_user_email})',
+                '%(count)s Send As members were added to user {affected_user_name} ({affected_user_email}): %(items)s',
+                [user.email for user in new_users],
+                event_type='exchange_user_send_as_member_add',
+                event_context={'affected_user': affected_user})
+
+            event_buffer.log_items(
+                'exchange_user_member',
+                'Send As member %s was removed from user {affected_user_name} ({affected_user_email})',
+                '%(count)s Send As members were removed from user'
+                ' {affected_user_name} ({affected_user_email}): %(items)s',
+                [user.email for user in old_users],
+                event_type='exchange_user_send_as_member_remove',
+                event_context={'affected_user': affected_user})
 
         return self.members_list('send_as_members')
 
@@ -338,40 +376,40 @@ class GroupViewSet(PropertyWithMembersViewSet):
 
     def post_create(self, group, serializer, backend_group):
         self.update_senders_out(group, serializer)
-        new_users_ids = self.members_create(group, 'members', 'add_member')
+        new_users = self.members_create(group, 'members', 'add_member')
 
-        for user in models.User.objects.filter(backend_id__in=new_users_ids):
-            event_logger.exchange_group_member.info(
-                'Member %s was added to group {group_name} ({group_email})' % user.email,
-                event_type='exchange_group_member_add',
-                event_context={
-                    'group': group,
-                })
+        event_buffer.log_items(
+            'exchange_group_member',
+            'Member %s was added to group {group_name} ({group_email})',
+            '%(count)s members were added to group {group_name} ({group_email}): %(items)s',
+            [user.email for user in new_users],
+            event_type='exchange_group_member_add',
+            event_context={'group': group})
 
     def pre_update(self, group, serializer):
-        self.cur_members = set(group.members.values_list('backend_id', flat=True))
+        self.cur_members = set(group.members.all())
 
     def post_update(self, group, serializer):
         self.update_senders_out(group, serializer)
-        new_users_ids, old_users_ids = self.members_update(
+        new_users, old_users = self.members_update(
             group, 'members', data=serializer.validated_data,
             add_method='add_member', del_method='del_member', list_method='list_members')
 
-        for user in models.User.objects.filter(backend_id__in=new_users_ids):
-            event_logger.exchange_group_member.info(
-                'Member %s was added to group {group_name} ({group_email})' % user.email,
-                event_type='exchange_group_member_add',
-                event_context={
-                    'group': group,
-                })
-
-        for user in models.User.objects.filter(backend_id__in=old_users_ids):
-            event_logger.exchange_group_member.info(
-                'Member %s was removed from group {group_name} ({group_email})' % user.email,
-                event_type='exchange_group_member_remove',
-                event_context={
-                    'group': group,
-                })
+        event_buffer.log_items(
+            'exchange_group_member',
+            'Member %s was added to group {group_name} ({group_email})',
+            '%(count)s members were added to group {group_name} ({group_email}): %(items)s',
+            [user.email for user in new_users],
+            event_type='exchange_group_member_add',
+            event_context={'group': group})
+
+        event_buffer.log_items(
+            'exchange_group_member',
+            'Member %s was removed from group {group_name} ({group_email})',
+            '%(count)s members were removed from group {group_name} ({group_email}): %(items)s',
+            [user.email for user in old_users],
+            event_type='exchange_group_member_remove',
+            event_context={'group': group})
 
     @detail_route(methods=['get'])
     def members(self, request, pk=None, **kwargs):
@@ -379,43 +417,66 @@ class GroupViewSet(PropertyWithMembersViewSet):
 
     # XXX: put was added as portal has a temporary bug with widget update
     @detail_route(methods=['get', 'post', 'put'])
+    @buffer_events
     def delivery_members(self, request, pk=None, **kwargs):
         group = self.get_object()
-        backend = self.get_backend(group.tenant)
         members_qs = group.delivery_members
 
         if request.method in ('POST', 'PUT'):
             serializer = serializers.DeliveryMembersSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
 
-            new_members = set(serializer.validated_data['members'])
-            cur_members = set(members_qs.all())
-
-            new_users = new_members - cur_members
-            if new_users:
-                backend.add_delivery_members(
-                    id=group.backend_id, user_id=','.join([u.backend_id for u in new_users]))
-                members_qs.add(*new_users)
-                for member in new_users:
-                    event_logger.exchange_group_delivery_member.info(
-                        'Delivery member %s has been added to exchange group {group_name} ({group_email}).' % member.email,
-                        event_type='exchange_group_delivery_member_add',
-                        event_context={
-                            'group': group
-                        })
-
-            old_users = cur_members - new_members
-            if old_users:
-                backend.del_delivery_members(
-                    id=group.backend_id, user_id=','.join([u.backend_id for u in old_users]))
-                members_qs.remove(*old_users)
-                for member in old_users:
-                    event_logger.exchange_group_delivery_member.info(
-                        'Delivery member %s has been removed from exchange group {group_name} ({group_email}).' % member.email,
-                        event_type='exchange_group_delivery_member_remove',
-                        event_context={
-                            'group': group
-                        })
+            sync = self.get_members_sync(
+                group, 'delivery_members', add_method='add_delivery_members', del_method='del_delivery_members')
+            new_users, old_users = sync.apply(serializer.validated_data['members'])
+
+            event_buffer.log_items(
+                'exchange_group_delivery_member',
+                'Delivery member %s has been added to exchange group {group_name} ({group_email}).',
+                '%(count)s delivery members have been added to exchange group {group_name} ({group_email}): %(items)s.',
+                [member.email for member in new_users],
+                event_type='exchange_group_delivery_member_add',
+                event_context={'group': group})
+
+            event_buffer.log_items(
+                'exchange_group_delivery_member',
+                'Delivery member %s has been removed from exchange group {group_name} ({group_email}).',
+                '%(count)s delivery members have been removed from exchange group'
+                ' {group_name} ({group_email}): %(items)s.',
+                [member.email for member in old_users],
+                event_type='exchange_group_delivery_member_remove',
+                event_context={'group': group})
 
         return Response(serializers.DeliveryMembersSerializer(
             members_qs.all(), many=True, context={'request': request}).data, status=HTTP_200_OK)
+
+
+class UserImportViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = models.UserImport.objects.all().select_related('tenant')
+    serializer_class = serializers.UserImportSerializer
+    filter_class = filters.UserImportFilter
+    lookup_field = 'uuid'
+    permission_classes = (permissions.IsAuthenticated, permissions.DjangoObjectPermissions)
+    filter_backends = (GenericRoleFilter, rf_filters.DjangoFilterBackend,)
+
+    @detail_route(methods=['post'])
+    def resume(self, request, uuid=None):
+        """ Continue failed or interrupted import from the first unfinished user """
+        user_import = self.get_object()
+
+        if user_import.tenant.state != models.ExchangeTenant.States.ONLINE:
+            raise IncorrectStateException("Tenant must be in stable state to perform this operation")
+
+        stale_time = timezone.now() - timedelta(seconds=get_setting('IMPORT_STALE_TIMEOUT'))
+        if user_import.state == models.UserImport.States.PROCESSING and user_import.modified > stale_time:
+            raise IncorrectStateException("Import is being processed already")
+
+        unfinished = user_import.rows.filter(state__in=models.UserImportRow.States.UNFINISHED).count()
+        if not unfinished:
+            raise IncorrectStateException("All users of import have been processed already")
+
+        user_import.state = models.UserImport.States.PENDING
+        user_import.save(update_fields=['state', 'modified'])
+        send_task('exchange', 'import_users')(user_import.uuid.hex)
+
+        return Response({'status': "%s users scheduled for creation" % unfinished}, status=HTTP_200_OK)
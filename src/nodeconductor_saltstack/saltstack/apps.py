@@ -11,7 +11,7 @@ class SaltStackConfig(AppConfig):
 
     def ready(self):
         from .backend import SaltStackBackend
-        from .models import SaltStackProperty
+        from .models import SaltStackProperty, SearchTrigram
         import handlers
         SupportedServices.register_backend(SaltStackBackend)
 
@@ -42,6 +42,18 @@ class SaltStackConfig(AppConfig):
             )
         )
 
+        signals.post_save.connect(
+            handlers.invalidate_backend_cache,
+            sender=ServiceSettings,
+            dispatch_uid='nodeconductor_saltstack.saltstack.handlers.invalidate_backend_cache_on_save',
+        )
+
+        signals.post_delete.connect(
+            handlers.invalidate_backend_cache,
+            sender=ServiceSettings,
+            dispatch_uid='nodeconductor_saltstack.saltstack.handlers.invalidate_backend_cache_on_delete',
+        )
+
         for index, model in enumerate(SaltStackProperty.get_all_models()):
             signals.post_save.connect(
                 handlers.log_saltstack_property_created,
@@ -56,3 +68,18 @@ class SaltStackConfig(AppConfig):
                 dispatch_uid='nodeconductor_saltstack.saltstack.handlers.log_saltstack_property_deleted{}_{}'.format(
                     model.__name__, index),
             )
+
+        for index, model in enumerate(SearchTrigram.get_indexed_models()):
+            signals.post_save.connect(
+                handlers.update_search_index,
+                sender=model,
+                dispatch_uid='nodeconductor_saltstack.saltstack.handlers.update_search_index_{}_{}'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.delete_search_index,
+                sender=model,
+                dispatch_uid='nodeconductor_saltstack.saltstack.handlers.delete_search_index_{}_{}'.format(
+                    model.__name__, index),
+            )
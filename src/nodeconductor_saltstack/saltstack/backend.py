@@ -1,14 +1,29 @@
+import os
 import re
+import sys
 import json
+import time
+import random
+import hashlib
+import itertools
 import types
 import logging
 import requests
 import functools
+import threading
 
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from django.core.cache import cache
 from django.utils import six
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from nodeconductor.structure import ServiceBackend, ServiceBackendError
 
 from . import models
+from .metrics import metrics
+from .settings import get_setting
 from .. import __version__
 
 
@@ -39,6 +54,28 @@ class SaltStackBackendError(ServiceBackendError):
             self.traceback_str = '; '.join(["%s: %s" % (k, v) for k, v in traceback.items()])
 
 
+class SaltStackUnavailableError(SaltStackBackendError):
+    """ SaltStack master or minions of target haven't responded """
+
+    def __init__(self, message, traceback=None):
+        super(SaltStackUnavailableError, self).__init__(message, traceback or message)
+
+
+class MinionUnavailableError(SaltStackUnavailableError):
+    """ None of targeted minions has responded to a command.
+        Error is accepted if command has been delivered to some minion which hasn't returned,
+        so command could have been executed anyway.
+    """
+
+    def __init__(self, message, traceback=None, accepted=False):
+        super(MinionUnavailableError, self).__init__(message, traceback)
+        self.accepted = accepted
+
+
+class CircuitOpenError(SaltStackUnavailableError):
+    """ Request hasn't been sent because circuit breaker of master and target is open """
+
+
 class SaltStackBackend(object):
 
     backends = set()
@@ -50,7 +87,7 @@ class SaltStackBackend(object):
         if backend_class not in backends:
             raise SaltStackBackendError("Unknown SaltStack backend class: %s" % backend_class)
 
-        self.backend = backend_class(settings, **kwargs)
+        self.backend = backend_cache.get(backend_class, settings, **kwargs)
 
     def __getattr__(self, name):
         return getattr(self.backend, name)
@@ -60,6 +97,58 @@ class SaltStackBackend(object):
         cls.backends.add(backend_class)
 
 
+class BackendCache(object):
+    """ Per-thread LRU cache of backend instances.
+        Instances are keyed by service settings, their version and tenant;
+        version is stored in Django cache and bumped whenever service settings are saved.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @staticmethod
+    def get_version_key(settings_id):
+        return 'saltstack-settings-version:%s' % settings_id
+
+    def invalidate(self, settings):
+        key = self.get_version_key(settings.pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def get(self, backend_class, settings, **kwargs):
+        size = get_setting('BACKEND_CACHE_SIZE')
+        if not size or settings.pk is None:
+            return backend_class(settings, **kwargs)
+
+        if not hasattr(self.local, 'backends'):
+            self.local.backends = OrderedDict()
+        backends = self.local.backends
+
+        tenant = kwargs.get('tenant')
+        version = cache.get(self.get_version_key(settings.pk), 0)
+        key = (settings.pk, version, backend_class, tenant.pk if tenant is not None else None)
+
+        try:
+            backend = backends.pop(key)
+        except KeyError:
+            backend = backend_class(settings, **kwargs)
+            while len(backends) >= size:
+                backends.popitem(last=False)
+        else:
+            # Bind fresh model instances to reused backend
+            backend.settings = settings
+            for name, value in kwargs.items():
+                setattr(backend, name, value)
+
+        backends[key] = backend
+        return backend
+
+
+backend_cache = BackendCache()
+
+
 class SaltStackMetaclass(type):
 
     def __new__(cls, name, bases, args):
@@ -97,16 +186,27 @@ class SaltStackBaseBackend(six.with_metaclass(SaltStackMetaclass, ServiceBackend
 
     def sync(self):
         for cls in SaltStackBackend.backends:
-            cls(self.settings).sync_backend()
+            backend_cache.get(cls, self.settings).sync_backend()
 
     def ping(self, raise_exception=False):
         try:
-            return all(cls(self.settings).base.ping() for cls in SaltStackBackend.backends)
+            return all(backend_cache.get(cls, self.settings).base.ping() for cls in SaltStackBackend.backends)
         except Exception as e:
             if raise_exception:
-                six.reraise(SaltStackBackendError, e)
+                states = ', '.join('%s: %s' % item for item in sorted(self.get_circuit_states().items()))
+                six.reraise(
+                    SaltStackBackendError, SaltStackBackendError('%s (circuit breakers: %s)' % (e, states)),
+                    sys.exc_info()[2])
             return False
 
+    def get_circuit_states(self):
+        """ Return states of circuit breakers of targets of service settings """
+        options = self.settings.options or {}
+        api_url = self.settings.backend_url.rstrip('/')
+        return {
+            options[cls.TARGET_OPTION_NAME]: circuit_breakers.get(api_url, options[cls.TARGET_OPTION_NAME]).get_state()
+            for cls in SaltStackBackend.backends if options.get(cls.TARGET_OPTION_NAME)}
+
     def get_stats(self):
         links = models.SaltStackServiceProjectLink.objects.filter(
             service__settings=self.settings)
@@ -128,6 +228,326 @@ class SaltStackBaseBackend(six.with_metaclass(SaltStackMetaclass, ServiceBackend
         return stats
 
 
+class SessionPool(object):
+    """ Per-process pool of keep-alive HTTP sessions to salt-api, one session per backend URL.
+        Sessions which haven't been used for POOL_IDLE_TIMEOUT seconds are closed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.sessions = {}
+
+    def get(self, url):
+        with self.lock:
+            # sockets must not be shared between forked celery workers
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.sessions = {}
+
+            now = time.time()
+            self.evict(now - get_setting('POOL_IDLE_TIMEOUT'))
+
+            try:
+                session, _ = self.sessions[url]
+            except KeyError:
+                session = self.create_session()
+            self.sessions[url] = (session, now)
+            return session
+
+    def evict(self, deadline):
+        for url, (session, last_used) in self.sessions.items():
+            if last_used < deadline:
+                del self.sessions[url]
+                session.close()
+
+    def create_session(self):
+        # Retry only failed connections: commands which have reached salt-api must not be executed twice
+        retry = Retry(
+            total=get_setting('MAX_RETRIES'), read=0, backoff_factor=get_setting('RETRY_BACKOFF'))
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=get_setting('POOL_SIZE'), max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.verify = False
+        session.headers.update({
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'User-Agent': 'NodeConductorSaltStack/%s' % __version__,
+        })
+        return session
+
+
+session_pool = SessionPool()
+
+
+class TokenCache(object):
+    """ Cache of salt-api authentication tokens.
+        Tokens are kept in process memory and shared with other processes via Django cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            for storage in (self.tokens, cache):
+                token, expire = storage.get(key) or (None, 0)
+                if expire > now:
+                    self.tokens[key] = (token, expire)
+                    return token
+
+    def set(self, key, token, expire):
+        with self.lock:
+            self.tokens[key] = (token, expire)
+        cache.set(key, (token, expire), timeout=max(int(expire - time.time()), 1))
+
+    def delete(self, key):
+        with self.lock:
+            self.tokens.pop(key, None)
+        cache.delete(key)
+
+
+token_cache = TokenCache()
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker of SaltStack master and target.
+
+        Closed breaker passes requests and tracks their failures during BREAKER_WINDOW seconds.
+        Once at least BREAKER_MIN_CALLS calls have been made and BREAKER_FAILURE_RATE of them have failed,
+        breaker opens: requests fail immediately during BREAKER_OPEN_TIMEOUT seconds.
+        Then breaker becomes half-open: target is probed with test.ping, success closes breaker,
+        failure opens it again. Opening is shared with other processes via Django cache.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, api_url, target):
+        self.api_url = api_url
+        self.target = target
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.calls = deque()
+        self.failures = 0
+        self.opened_until = 0
+
+    @property
+    def cache_key(self):
+        key = '%s:%s' % (self.api_url, self.target)
+        return 'saltstack-circuit:%s' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_state(self):
+        """ Return state of breaker taking into account breakers of other processes """
+        now = time.time()
+        with self.lock:
+            if self.state == self.CLOSED:
+                opened_until = cache.get(self.cache_key) or 0
+                if opened_until > now:
+                    self.open(opened_until, share=False)
+            if self.state == self.OPEN and self.opened_until <= now:
+                return self.HALF_OPEN
+            return self.state
+
+    def check(self, probe):
+        """ Raise CircuitOpenError if request must not be sent, probe target if breaker is half-open """
+        if not get_setting('BREAKER_FAILURE_RATE'):
+            return
+
+        state = self.get_state()
+        if state == self.CLOSED:
+            return
+
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            # only one thread probes the target, others fail fast meanwhile
+            if state == self.OPEN or self.state == self.HALF_OPEN:
+                raise CircuitOpenError(
+                    "Circuit breaker of %s on %s is %s, retry in %d seconds" % (
+                        self.target, self.api_url, self.state, max(self.opened_until - time.time(), 0)))
+            self.state = self.HALF_OPEN
+
+        # breaker must leave half-open state whatever happens to the probe, e.g. malformed response
+        # or soft time limit of celery task, otherwise it would reject all calls of the process
+        available = False
+        try:
+            available = probe()
+        except Exception as e:
+            logger.warning('Probe of %s on %s has failed: %s', self.target, self.api_url, e)
+        finally:
+            with self.lock:
+                if available:
+                    self.close()
+                else:
+                    self.open(time.time() + get_setting('BREAKER_OPEN_TIMEOUT'))
+        if not available:
+            raise CircuitOpenError("%s on %s haven't responded to test.ping" % (self.target, self.api_url))
+
+    def record(self, failed):
+        if not get_setting('BREAKER_FAILURE_RATE'):
+            return
+
+        now = time.time()
+        with self.lock:
+            if self.state != self.CLOSED:
+                return
+
+            self.calls.append((now, failed))
+            self.failures += failed
+            deadline = now - get_setting('BREAKER_WINDOW')
+            while self.calls and self.calls[0][0] < deadline:
+                _, expired_failed = self.calls.popleft()
+                self.failures -= expired_failed
+
+            if (len(self.calls) >= get_setting('BREAKER_MIN_CALLS') and
+                    self.failures >= get_setting('BREAKER_FAILURE_RATE') * len(self.calls)):
+                logger.warning(
+                    'Circuit breaker of %s on %s has been opened: %s of %s calls failed',
+                    self.target, self.api_url, self.failures, len(self.calls))
+                self.open(now + get_setting('BREAKER_OPEN_TIMEOUT'))
+
+    def open(self, until, share=True):
+        """ Open breaker, caller must hold the lock """
+        self.state = self.OPEN
+        self.opened_until = until
+        self.calls.clear()
+        self.failures = 0
+        if share:
+            cache.set(self.cache_key, until, timeout=max(int(until - time.time()), 1))
+
+    def close(self):
+        """ Close breaker, caller must hold the lock """
+        if self.state != self.CLOSED:
+            logger.info('Circuit breaker of %s on %s has been closed', self.target, self.api_url)
+        self.state = self.CLOSED
+        self.opened_until = 0
+        cache.delete(self.cache_key)
+
+
+class CircuitBreakerPool(object):
+    """ Per-process circuit breakers of (backend URL, target) pairs """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.breakers = {}
+
+    def get(self, api_url, target):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.breakers = {}
+
+            key = (api_url, target)
+            breaker = self.breakers.get(key)
+            if breaker is None:
+                breaker = self.breakers[key] = CircuitBreaker(api_url, target)
+            return breaker
+
+
+circuit_breakers = CircuitBreakerPool()
+
+
+class MinionSelector(object):
+    """ Spreads commands of target between its minions instead of running them on all matched minions.
+
+        Minions of target are resolved with test.ping and cached for MINIONS_CACHE_TTL seconds.
+        With TARGET_SELECTION 'round_robin' minions are taken in turn, with 'least_outstanding'
+        a minion with the least number of running commands of all processes is chosen.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.counters = {}
+
+    def get_key(self, prefix, *args):
+        key = ':'.join(args)
+        return '%s:%s' % (prefix, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def get_minions(self, api):
+        key = self.get_key('saltstack-minions', api.api_url, api.target)
+        minions = cache.get(key)
+        if minions is None:
+            response = api.request('/run', {
+                'client': 'local',
+                'fun': 'test.ping',
+                'tgt': api.target,
+            })
+            minions = sorted(minion for minion, alive in (response['return'][0] or {}).items() if alive)
+            if minions:
+                cache.set(key, minions, get_setting('MINIONS_CACHE_TTL'))
+        return minions
+
+    def discard(self, api, minion):
+        """ Exclude minion which hasn't responded until minions of target are resolved again """
+        key = self.get_key('saltstack-minions', api.api_url, api.target)
+        minions = [m for m in cache.get(key) or [] if m != minion]
+        if minions:
+            cache.set(key, minions, get_setting('MINIONS_CACHE_TTL'))
+        else:
+            cache.delete(key)
+
+    def get_turn(self, api):
+        with self.lock:
+            # forked processes start from random positions, so they don't choose the same minions
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.counters = {}
+            key = (api.api_url, api.target)
+            if key not in self.counters:
+                self.counters[key] = itertools.count(random.randint(0, 1000))
+            return next(self.counters[key])
+
+    def select(self, api, exclude=()):
+        """ Return minion to run a command on or None if there are no minions left """
+        minions = [minion for minion in self.get_minions(api) if minion not in exclude]
+        if not minions:
+            return None
+
+        turn = self.get_turn(api) % len(minions)
+        minions = minions[turn:] + minions[:turn]
+        if get_setting('TARGET_SELECTION') == 'least_outstanding':
+            keys = {minion: self.get_key('saltstack-outstanding', api.api_url, minion) for minion in minions}
+            outstanding = cache.get_many(keys.values())
+            # minions with equal load are taken in turn
+            return min(minions, key=lambda minion: outstanding.get(keys[minion], 0))
+        return minions[0]
+
+    @contextmanager
+    def track(self, api, minion):
+        """ Count command running on minion """
+        if get_setting('TARGET_SELECTION') != 'least_outstanding':
+            yield
+            return
+
+        key = self.get_key('saltstack-outstanding', api.api_url, minion)
+        # counters of killed processes expire eventually
+        cache.add(key, 0, get_setting('READ_TIMEOUT') * 2)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, get_setting('READ_TIMEOUT') * 2)
+        try:
+            yield
+        finally:
+            try:
+                if cache.decr(key) < 0:
+                    cache.set(key, 0, get_setting('READ_TIMEOUT') * 2)
+            except ValueError:
+                pass
+
+
+minion_selector = MinionSelector()
+
+
 class SaltStackAPI(object):
 
     COMMAND = 'powershell.exe -f D:\\SaaS\\bin\\{name}.ps1 {args}'
@@ -144,37 +564,107 @@ class SaltStackAPI(object):
         if cmd_mapping and isinstance(cmd_mapping, dict):
             self.MAPPING = cmd_mapping
 
-    def request(self, url, data=None):
-        if not data:
+    @property
+    def token_cache_key(self):
+        credentials = '%s:%s:%s' % (self.api_url, self.auth['username'], self.auth['password'])
+        return 'saltstack-token:%s' % hashlib.md5(credentials.encode('utf-8')).hexdigest()
+
+    def send(self, url, data=None, headers=None, method='POST'):
+        session = session_pool.get(self.api_url)
+        if data is not None:
+            data = json.dumps(data).encode()
+        request_size = len(data) if data else 0
+        timeout = (get_setting('CONNECT_TIMEOUT'), get_setting('READ_TIMEOUT'))
+        try:
+            response = session.request(method, self.api_url + url, data=data, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            metrics.track_request(request_size, outcome='connection_error')
+            raise SaltStackUnavailableError("Request to salt API %s failed: %s" % (url, e))
+        metrics.track_request(request_size, len(response.content))
+        return response
+
+    def login(self):
+        response = self.send('/login', self.auth)
+        if not response.ok:
+            metrics.track_request(outcome='auth_error')
+            error_class = SaltStackUnavailableError if response.status_code >= 500 else SaltStackBackendError
+            raise error_class(
+                "Authentication in salt API failed: %s %s" % (response.status_code, response.text))
+
+        info = response.json()['return'][0]
+        token = info['token']
+        token_cache.set(self.token_cache_key, token, info['expire'] - get_setting('TOKEN_EXPIRY_MARGIN'))
+        return token
+
+    def request(self, url, data=None, method='POST'):
+        if not data and method == 'POST':
             data = {}
 
-        data.update(self.auth)
+        if get_setting('TOKEN_AUTH'):
+            # /run bypasses session handling, lowstate with token authentication is accepted by root URL
+            if url == '/run':
+                url = '/'
 
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'User-Agent': 'NodeConductorSaltStack/%s' % __version__,
-        }
-
-        response = requests.post(
-            self.api_url + url, data=json.dumps(data).encode(), headers=headers, verify=False)
+            token = token_cache.get(self.token_cache_key) or self.login()
+            response = self.send(url, data, headers={'X-Auth-Token': token}, method=method)
+            if response.status_code == 401:
+                token_cache.delete(self.token_cache_key)
+                response = self.send(url, data, headers={'X-Auth-Token': self.login()}, method=method)
+        else:
+            # data could be either single lowstate or list of them
+            for lowstate in (data if isinstance(data, list) else [data]):
+                lowstate.update(self.auth)
+            response = self.send(url, data)
 
         if response.ok:
             return response.json()
         else:
-            raise SaltStackBackendError(
+            metrics.track_request(outcome='http_error')
+            error_class = SaltStackUnavailableError if response.status_code >= 500 else SaltStackBackendError
+            raise error_class(
                 "Request to salt API %s failed: %s %s" % (url, response.status_code, response.text))
 
-    def ping(self):
+    @contextmanager
+    def guard(self):
+        """ Pass salt-api requests made within the block through circuit breaker of master and target """
+        breaker = circuit_breakers.get(self.api_url, self.target)
+        breaker.check(self.probe)
+        try:
+            yield
+        except SaltStackUnavailableError:
+            breaker.record(failed=True)
+            raise
+        except Exception:
+            # master has responded, failure is caused by the command itself
+            breaker.record(failed=False)
+            raise
+        else:
+            breaker.record(failed=False)
+
+    def probe(self):
+        """ Return True if all minions of target respond to test.ping """
         response = self.request('/run', {
             'client': 'local',
             'fun': 'test.ping',
             'tgt': self.target,
         })
+        minions = response['return'][0]
+        return bool(minions) and all(minions.values())
 
-        return all(response['return'][0].values())
+    def ping(self):
+        """ Return False if minions of target haven't responded to test.ping, including the case when none
+            of them responded. Raise SaltStackBackendError if salt-api isn't reachable or circuit is open.
+        """
+        try:
+            with self.guard(), metrics.measure(self, 'test.ping'):
+                # exception marks missing responses as failure for circuit breaker
+                if not self.probe():
+                    raise MinionUnavailableError("Minions of %s haven't responded to test.ping" % self.target)
+        except MinionUnavailableError:
+            return False
+        return True
 
-    def run_cmd(self, cmd, **kwargs):
+    def get_command(self, cmd, **kwargs):
 
         def prepare_args():
             for k, v in kwargs.iteritems():
@@ -187,18 +677,64 @@ class SaltStackAPI(object):
                         v = re.sub(r'(["\$])', r'\\\1', v)
                     yield '-{} "{}"'.format(k, v)
 
-        command = self.COMMAND.format(name=self.MAPPING.get(cmd) or cmd, args=' '.join(prepare_args()))
+        return self.COMMAND.format(name=self.MAPPING.get(cmd) or cmd, args=' '.join(prepare_args()))
 
-        logger.debug('Executing command: {}'.format(command))
-
-        response = self.request('/run', {
+    def get_lowstate(self, command, target=None):
+        return {
             'client': 'local',
             'fun': 'cmd.run',
-            'tgt': self.target,
+            'tgt': target or self.target,
             'arg': command,
-        })
+        }
 
-        for tgt, res in response['return'][0].items():
+    def select_minion(self, func, repeatable=False):
+        """ Call func with target to run a command on: whole target glob if TARGET_SELECTION is 'all',
+            otherwise a single minion chosen by minion selector. Command is repeated on another minion
+            if chosen one hasn't received it, or if it hasn't responded and command is repeatable (reads only).
+        """
+        if get_setting('TARGET_SELECTION') == 'all':
+            return func(self.target)
+
+        tried = []
+        error = None
+        while True:
+            minion = minion_selector.select(self, exclude=tried)
+            if minion is None:
+                if error is not None:
+                    raise error
+                # minions of target are unknown, let salt match them
+                return func(self.target)
+
+            tried.append(minion)
+            try:
+                with minion_selector.track(self, minion):
+                    return func(minion)
+            except MinionUnavailableError as e:
+                minion_selector.discard(self, minion)
+                if e.accepted and not repeatable:
+                    # minion could have run the command already, repeating it could apply a change twice
+                    raise
+                logger.warning('Minion %s of %s has not responded, trying another one', minion, self.target)
+                error = e
+
+    @staticmethod
+    def is_active_output(res):
+        """ Check if minion has returned output of command rather than inactive status or nothing """
+        if res is False or not res or (isinstance(res, basestring) and res.startswith('Minion did not return')):
+            return False
+        try:
+            return json.loads(res).get('Status') != 'Inactive'
+        except (TypeError, ValueError, AttributeError):
+            # malformed output is reported by parse_cmd_output()
+            return True
+
+    def parse_cmd_output(self, cmd, command, output):
+        accepted = False
+        for tgt, res in output.items():
+            if res is False or (isinstance(res, basestring) and res.startswith('Minion did not return')):
+                # minion has been matched but hasn't returned in time
+                accepted = True
+                continue
             try:
                 result = json.loads(res)
             except ValueError:
@@ -209,8 +745,8 @@ class SaltStackAPI(object):
             if result['Status'] != 'Inactive':
                 break
         else:
-            raise SaltStackBackendError(
-                "Empty response from SaltStack during execution of %s on %s" % (cmd, self.target))
+            raise MinionUnavailableError(
+                "Empty response from SaltStack during execution of %s on %s" % (cmd, self.target), accepted=accepted)
 
         if result['Status'] == 'OK':
             return result['Output']
@@ -221,6 +757,267 @@ class SaltStackAPI(object):
                     cmd, self.target, result.get('Message') or result.get('Output')),
                 result.get('Message'))
 
+    def run_cmd(self, cmd, repeatable=False, **kwargs):
+        """ Run command and return its output. Repeatable commands don't change anything on backend,
+            so they are sent to another minion if selected one hasn't returned.
+        """
+        command = self.get_command(cmd, **kwargs)
+
+        logger.debug('Executing command: {}'.format(command))
+
+        def run(target):
+            response = self.request('/run', self.get_lowstate(command, target))
+            return self.parse_cmd_output(cmd, command, response['return'][0])
+
+        with self.guard(), metrics.measure(self, cmd):
+            return self.select_minion(run, repeatable=repeatable)
+
+    def run_cmds(self, cmds, repeatable=False):
+        """ Execute several commands within a single salt-api request.
+            Expects list of (cmd, kwargs) tuples and returns list of commands outputs
+            where failed commands are represented by SaltStackBackendError instances.
+            Batch is sent to another minion only if all its commands are repeatable, same as in run_cmd().
+        """
+        commands = [self.get_command(cmd, **kwargs) for cmd, kwargs in cmds]
+
+        logger.debug('Executing commands: {}'.format('; '.join(commands)))
+
+        def run(target):
+            response = self.request('/run', [self.get_lowstate(command, target) for command in commands])
+            results = []
+            for (cmd, _), command, output in zip(cmds, commands, response['return']):
+                try:
+                    results.append(self.parse_cmd_output(cmd, command, output))
+                except SaltStackBackendError as e:
+                    results.append(e)
+            # batch is repeated on another minion if selected one hasn't responded at all
+            if target != self.target and results and all(isinstance(r, MinionUnavailableError) for r in results):
+                raise results[0]
+            return results
+
+        with self.guard(), metrics.measure(self, [cmd for cmd, _ in cmds]) as measurement:
+            results = self.select_minion(run, repeatable=repeatable)
+            measurement.outcomes = ['error' if isinstance(r, SaltStackBackendError) else 'ok' for r in results]
+        return results
+
+    def submit_cmd(self, cmd, **kwargs):
+        """ Start command execution as an asynchronous salt job.
+            Returns job description to be passed to get_job_output().
+        """
+        command = self.get_command(cmd, **kwargs)
+
+        logger.debug('Submitting command: {}'.format(command))
+
+        def submit(target):
+            lowstate = self.get_lowstate(command, target)
+            lowstate['client'] = 'local_async'
+            job = self.request('/run', lowstate)['return'][0]
+            if not job or not job.get('minions'):
+                raise MinionUnavailableError(
+                    "Cannot start execution of %s: no minions matched target %s" % (cmd, target))
+            return job
+
+        with self.guard():
+            job = self.select_minion(submit)
+
+        logger.info('Command %s has been submitted as salt job %s', cmd, job['jid'])
+
+        return {
+            'cmd': cmd,
+            'command': command,
+            'jid': job['jid'],
+            'minions': job['minions'],
+            'submitted': time.time(),
+        }
+
+    def get_job_output(self, job):
+        """ Return output of a salt job command or None if job is still running """
+        with self.guard():
+            if get_setting('TOKEN_AUTH'):
+                response = self.request('/jobs/%s' % job['jid'], method='GET')
+            else:
+                # jobs endpoint requires session token, lookup it via runner instead
+                response = self.request('/run', {'client': 'runner', 'fun': 'jobs.lookup_jid', 'jid': job['jid']})
+
+        output = response['return'][0] or {}
+        # the first minion which has run the command is enough, others may be inactive or down
+        active = {minion: res for minion, res in output.items() if self.is_active_output(res)}
+        if not active and set(job['minions']) - set(output.keys()):
+            return None
+
+        # duration of asynchronous command is measured from its submission until output is fetched
+        outcome = 'error'
+        try:
+            result = self.parse_cmd_output(job['cmd'], job['command'], active or output)
+            outcome = 'ok'
+        finally:
+            metrics.record(
+                self.api_url, self.target, self.MAPPING.get(job['cmd']) or job['cmd'], outcome,
+                time.time() - job['submitted'])
+        return result
+
+
+class Entity(object):
+    """ Base class for objects returned by SaltStackBaseAPI methods.
+        Each API has its own subclass with slots for all output fields of its methods.
+    """
+    __slots__ = ()
+
+    def __init__(self, opts):
+        for key, val in opts.items():
+            setattr(self, key, val)
+
+    def __repr__(self):
+        info = ", ".join("%s=%s" % (k, v) for k, v in sorted(self.to_dict().items()))
+        return "<%s %s>" % (self.__class__.__name__, info)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}
+
+
+class APIMethod(object):
+    """ Precompiled specification of a method from SaltStackBaseAPI.Methods """
+
+    WRITE_PREFIXES = ('create', 'change', 'delete', 'add_', 'del_', 'set_', 'reset_')
+
+    def __init__(self, api_name, fn_name, opts):
+        self.api_name = api_name
+        self.fn_name = fn_name
+        self.func = opts['name']
+        self.cached = opts.get('cached', fn_name == 'list' or fn_name.startswith('list_'))
+        self.invalidates = opts.get('invalidates', fn_name.startswith(self.WRITE_PREFIXES))
+        self.input = opts.get('input') or {}
+        self.many = opts.get('many', False)
+        self.output = opts.get('output')
+        self.clean = opts.get('clean') or {}
+        self.paths = {opt: path.split('.') for opt, path in (opts.get('paths') or {}).items()}
+        self.defaults = [(opt, self.compile_default(opt, fn))
+                         for opt, fn in (opts.get('defaults') or {}).items()]
+
+    def compile_default(self, opt, fn):
+        if isinstance(fn, basestring):
+            return lambda backend, kwargs: fn.format(backend=backend, **kwargs)
+        elif isinstance(fn, types.FunctionType):
+            return lambda backend, kwargs: fn(backend, **kwargs)
+        elif isinstance(fn, (int, bool, float)) or fn is None:
+            return lambda backend, kwargs: fn
+        else:
+            raise NotImplementedError(
+                "Unknown default argument '%s' for method %s.%s" % (opt, self.api_name, self.func))
+
+    def get_cmd_args(self, backend, kwargs):
+        for opt, default in self.defaults:
+            if opt not in kwargs:
+                kwargs[opt] = default(backend, kwargs)
+
+        opts = {}
+        for opt, val in kwargs.items():
+            if opt in self.input:
+                if opt in self.paths:
+                    val = reduce(getattr, self.paths[opt], val)
+                opts[self.input[opt]] = val
+            else:
+                raise NotImplementedError(
+                    "Unknown argument '%s' for method %s.%s" % (opt, self.api_name, self.func))
+
+        return opts
+
+    def __get__(self, api, api_class=None):
+        if api is None:
+            return self
+        return functools.partial(api.call_method, self.fn_name)
+
+
+class BatchResult(object):
+    """ Placeholder for result of a method called within SaltStackBaseAPI.batch() block """
+
+    def __init__(self, name):
+        self.name = name
+        self.executed = False
+        self.value = None
+        self.error = None
+
+    def set_value(self, value):
+        self.executed = True
+        self.value = value
+
+    def set_error(self, error):
+        self.executed = True
+        self.error = error
+
+    @property
+    def result(self):
+        if not self.executed:
+            raise SaltStackBackendError("Method %s hasn't been executed yet" % self.name)
+        if self.error:
+            raise self.error
+        return self.value
+
+
+class Snapshot(object):
+    """ Result of API list() method with hash indexes by INDEXED_FIELDS """
+
+    INDEXED_FIELDS = ('id', 'email', 'url')
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.indexes = {field: {} for field in self.INDEXED_FIELDS}
+        for entity in entities:
+            for field, index in self.indexes.items():
+                value = getattr(entity, field, None)
+                if value is not None:
+                    index.setdefault(value, []).append(entity)
+
+    def find(self, **kwargs):
+        candidates = self.entities
+        for field in self.INDEXED_FIELDS:
+            if field in kwargs:
+                candidates = self.indexes[field].get(kwargs[field], [])
+                break
+
+        for obj in candidates:
+            if all(getattr(obj, attr_name) == attr_val for attr_name, attr_val in kwargs.items()):
+                yield obj
+
+
+class SnapshotCache(object):
+    """ Per-process LRU cache of snapshots of API lists.
+        Snapshots are keyed by cache key of list() output, which changes with generation of API lists,
+        so snapshots of invalidated lists are never returned and are evicted eventually.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, snapshot = self.snapshots.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            self.snapshots[key] = (expires, snapshot)
+            return snapshot
+
+    def set(self, key, snapshot, ttl):
+        size = get_setting('SNAPSHOT_CACHE_SIZE')
+        if not size:
+            return
+        with self.lock:
+            self.snapshots.pop(key, None)
+            while len(self.snapshots) >= size:
+                self.snapshots.popitem(last=False)
+            self.snapshots[key] = (time.time() + ttl, snapshot)
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+
+
+snapshot_cache = SnapshotCache()
+
 
 class SaltStackBaseAPI(SaltStackAPI):
 
@@ -256,113 +1053,232 @@ class SaltStackBaseAPI(SaltStackAPI):
                     clean={  # execute some operations on output before provision
                         'Accepted DomainName': <clean_function>
                     },
+                    # output of list() and list_*() methods is cached for LIST_CACHE_TTL seconds,
+                    # it could be switched on or off explicitly
+                    cached=False,
                 )
+
+            Cache of API lists is dropped by create*(), change*(), delete*(), add_*(), del_*(),
+            set_*() and reset_*() methods, or by methods marked with invalidates=True.
+            Cached lists of APIs named in invalidates_apis are dropped by these methods as well.
         """
 
+    # names of API classes with lists of the same tenant which depend on objects of this API
+    invalidates_apis = ()
+
     def __init__(self, *args, **kwargs):
         super(SaltStackBaseAPI, self).__init__(*args, **kwargs)
+        self.compile_methods()
+        self.batch_calls = None
+        self.batch_invalidates = False
+
+    @classmethod
+    def compile_methods(cls):
+        """ Compile Methods specification and Entity class once per API class """
+        if 'methods' in cls.__dict__:
+            return
+
+        name = cls.__name__
+        methods = {}
+        fields = set()
+        for fn_name, opts in cls.Methods.__dict__.items():
+            if fn_name.startswith('_'):
+                continue
+            methods[fn_name] = APIMethod(name, fn_name, opts)
+            if isinstance(opts.get('output'), dict):
+                fields.update(opts['output'].values())
+            setattr(cls, fn_name, methods[fn_name])
 
-        name = self.__class__.__name__
-        methods = {k: v for k, v in self.Methods.__dict__.items() if not k.startswith('_')}
+        cls.methods = methods
+        cls.entity_class = type(name.replace('API', ''), (Entity,), {'__slots__': tuple(sorted(fields))})
 
-        def create_entity(entity, fn_opts):
-            out = fn_opts.get('output')
-            clean = fn_opts.get('clean')
+    def create_entity(self, method, data):
+        if not data or not method.output:
+            return None
 
-            if not entity or not out:
-                return None
+        # If output specified as * - return all
+        if method.output == '*':
+            return data
 
-            # If output specified as * - return all
-            if fn_opts.get('output') == '*':
+        entity = self.entity_class.__new__(self.entity_class)
+        for key, val in data.items():
+            field = method.output.get(key)
+            if field is None:
+                logger.debug(
+                    "Unknown field '%s' in method %s.%s output" % (key, self.__class__.__name__, method.fn_name))
+                continue
+            if key in method.clean:
+                val = method.clean[key](val)
+            setattr(entity, field, val)
+
+        return entity
+
+    def prepare_method(self, fn_name, **kwargs):
+        """ Convert method arguments to backend command name and its arguments """
+        method = self.methods[fn_name]
+        return method.func, method.get_cmd_args(self.backend, kwargs)
+
+    def process_method_output(self, fn_name, results):
+        """ Convert command output to method result """
+        method = self.methods[fn_name]
+        if isinstance(results, list):
+            entities = [self.create_entity(method, entity) for entity in results]
+            if method.many:
+                return entities
+            elif len(entities) > 0:
+                return entities[0]
+            else:
+                return []
+        elif isinstance(results, dict):
+            entity = self.create_entity(method, results)
+            if method.many:
+                return [entity] if entity else []
+            else:
                 return entity
+        elif isinstance(results, basestring):
+            entity = results
+        else:
+            raise NotImplementedError(
+                "Wrong output for method %s.%s: %s" % (self.__class__.__name__, method.func, results))
 
-            opts = {}
-            for key, val in entity.items():
-                if key in out:
-                    if clean and key in clean:
-                        val = clean[key](val)
-                    opts[out[key]] = val
-                else:
-                    logger.debug(
-                        "Unknown field '%s' in method %s.%s output" % (key, name, fn_name.lower()))
-
-            class Entity(object):
-                def __init__(self, opts):
-                    self.__dict__ = opts
-
-                def __repr__(self):
-                    reprkeys = sorted(k for k in self.__dict__.keys())
-                    info = ", ".join("%s=%s" % (k, getattr(self, k)) for k in reprkeys)
-                    return "<%s %s>" % (self.__class__.__name__, info)
-
-            return type(name.replace('API', ''), (Entity,), {})(opts)
-
-        def method_fn(self, fn_opts=(), **kwargs):
-            inp = fn_opts.get('input') or {}
-            func = fn_opts['name']
-            opts = {}
-
-            if 'defaults' in fn_opts:
-                for opt in fn_opts['defaults']:
-                    if opt not in kwargs:
-                        fn = fn_opts['defaults'][opt]
-                        if isinstance(fn, basestring):
-                            kwargs[opt] = fn.format(backend=self.backend, **kwargs)
-                        elif isinstance(fn, types.FunctionType):
-                            kwargs[opt] = fn(self.backend, **kwargs)
-                        elif isinstance(fn, (int, bool, float)) or fn is None:
-                            kwargs[opt] = fn
-                        else:
-                            raise NotImplementedError(
-                                "Unknown default argument '%s' for method %s.%s" % (opt, name, func))
-
-            paths = fn_opts.get('paths') or {}
-            for opt, val in kwargs.items():
-                if opt in inp:
-                    if opt in paths:
-                        opts[inp[opt]] = reduce(getattr, paths[opt].split('.'), val)
-                    else:
-                        opts[inp[opt]] = val
-                else:
-                    raise NotImplementedError(
-                        "Unknown argument '%s' for method %s.%s" % (opt, name, func))
+    def call_method(self, fn_name, **kwargs):
+        method = self.methods[fn_name]
+        func, opts = self.prepare_method(fn_name, **kwargs)
 
-            results = self.run_cmd(func, **opts)
+        if self.batch_calls is not None:
+            result = BatchResult('%s.%s' % (self.__class__.__name__, fn_name))
+            self.batch_calls.append((func, opts, functools.partial(self.process_method_output, fn_name), result))
+            self.batch_invalidates = self.batch_invalidates or method.invalidates
+            return result
 
-            if isinstance(results, list):
-                entities = [create_entity(entity, fn_opts) for entity in results]
-                if fn_opts.get('many'):
-                    return entities
-                elif len(entities) > 0:
-                    return entities[0]
-                else:
-                    return []
-            elif isinstance(results, dict):
-                entity = create_entity(results, fn_opts)
-                if fn_opts.get('many'):
-                    return [entity] if entity else []
-                else:
-                    return entity
-            elif isinstance(results, basestring):
-                entity = results
-            else:
-                raise NotImplementedError(
-                    "Wrong output for method %s.%s: %s" % (name, func, results))
+        if method.cached:
+            output = self.run_cached_cmd(func, **opts)
+        else:
+            try:
+                output = self.run_cmd(func, repeatable=not method.invalidates, **opts)
+            finally:
+                if method.invalidates:
+                    self.invalidate_cache()
+
+        return self.process_method_output(fn_name, output)
+
+    def get_cache_scope(self, api_name):
+        tenant = getattr(self.backend, 'tenant', None)
+        scope = '%s:%s:%s:%s' % (api_name, self.api_url, self.target, getattr(tenant, 'backend_id', ''))
+        return hashlib.md5(scope.encode('utf-8')).hexdigest()
+
+    @property
+    def cache_scope(self):
+        return self.get_cache_scope(self.__class__.__name__)
+
+    def invalidate_cache(self):
+        """ Drop cached lists of this API and APIs from invalidates_apis of the same tenant """
+        for api_name in (self.__class__.__name__,) + tuple(self.invalidates_apis):
+            key = 'saltstack-list-generation:%s' % self.get_cache_scope(api_name)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+    def get_cache_key(self, cmd, **kwargs):
+        scope = self.cache_scope
+        generation = cache.get('saltstack-list-generation:%s' % scope, 0)
+        command = json.dumps([cmd, kwargs], sort_keys=True, default=str)
+        return 'saltstack-list:%s:%s:%s' % (scope, generation, hashlib.md5(command.encode('utf-8')).hexdigest())
+
+    def run_cached_cmd(self, cmd, **kwargs):
+        """ Run command or return its output cached during LIST_CACHE_TTL seconds """
+        ttl = get_setting('LIST_CACHE_TTL')
+        if not ttl:
+            return self.run_cmd(cmd, repeatable=True, **kwargs)
+
+        key = self.get_cache_key(cmd, **kwargs)
+        output = cache.get(key)
+        if output is None:
+            output = self.run_cmd(cmd, repeatable=True, **kwargs)
+            cache.set(key, output, ttl)
+        return output
+
+    def submit(self, fn_name, **kwargs):
+        """ Start method execution as salt job. Result should be obtained later with collect() """
+        func, opts = self.prepare_method(fn_name, **kwargs)
+        return self.submit_cmd(func, **opts)
+
+    def collect(self, fn_name, job):
+        """ Return result of method started with submit() or None if its job is still running """
+        output = self.get_job_output(job)
+        if output is not None:
+            return self.process_method_output(fn_name, output)
+
+    @contextmanager
+    def batch(self):
+        """ Collect methods calls and execute them within a single salt-api request on exit.
+            Methods called inside the block return BatchResult objects which hold
+            the results once the block is finished. Example:
+
+            with backend.groups.batch():
+                results = [backend.groups.add_member(id=group_id, user_id=u) for u in user_ids]
+            members = [r.result for r in results]
+        """
+        if self.batch_calls is not None:
+            # nested batch is a part of outer one
+            yield
+            return
+
+        self.batch_calls = []
+        self.batch_invalidates = False
+        try:
+            yield
+            calls = self.batch_calls
+            invalidates = self.batch_invalidates
+        finally:
+            self.batch_calls = None
+            self.batch_invalidates = False
 
-        for fn_name, method in methods.items():
-            func = types.MethodType(functools.partial(method_fn, fn_opts=method), self)
-            setattr(self, fn_name, func)
+        try:
+            self.execute_batch(calls, repeatable=not invalidates)
+        finally:
+            if invalidates:
+                self.invalidate_cache()
+
+    def execute_batch(self, calls, repeatable=False):
+        size = get_setting('BATCH_SIZE')
+        for index in range(0, len(calls), size):
+            chunk = calls[index:index + size]
+            outputs = self.run_cmds([(func, opts) for func, opts, _, _ in chunk], repeatable=repeatable)
+            for (_, _, process, result), output in zip(chunk, outputs):
+                if isinstance(output, SaltStackBackendError):
+                    result.set_error(output)
+                    continue
+                try:
+                    result.set_value(process(output))
+                except Exception as e:
+                    result.set_error(e)
+
+        errors = [result.error for _, _, _, result in calls if result.error]
+        if errors:
+            raise errors[0]
+
+    # methods findall(), get() and get_many() expects list() method implementation
+    def get_snapshot(self):
+        """ Return result of list() indexed by common attributes.
+            Snapshot is shared by all APIs of the process while list() output is cached,
+            so its entities must not be changed by callers.
+        """
+        ttl = get_setting('LIST_CACHE_TTL')
+        if not ttl or not self.methods['list'].cached or self.batch_calls is not None:
+            return Snapshot(self.list())
+
+        func, opts = self.prepare_method('list')
+        key = self.get_cache_key(func, **opts)
+        snapshot = snapshot_cache.get(key)
+        if snapshot is None:
+            snapshot = Snapshot(self.process_method_output('list', self.run_cached_cmd(func, **opts)))
+            snapshot_cache.set(key, snapshot, ttl)
+        return snapshot
 
-    # methods findall() and get() expects list() method implementation
     def findall(self, **kwargs):
-        for obj in self.list():
-            found = True
-            for attr_name, attr_val in kwargs.items():
-                found = found and getattr(obj, attr_name) == attr_val
-                if not found:
-                    break
-            if found:
-                yield obj
+        return self.get_snapshot().find(**kwargs)
 
     def get(self, obj_id):
         try:
@@ -370,6 +1286,11 @@ class SaltStackBaseAPI(SaltStackAPI):
         except StopIteration:
             return None
 
+    def get_many(self, obj_ids):
+        """ Return dictionary {id: object} of objects found by a single list() call """
+        index = self.get_snapshot().indexes['id']
+        return {obj_id: index[obj_id][0] for obj_id in obj_ids if obj_id in index}
+
 
 class ServiceSettingsAPI(SaltStackBaseAPI):
 
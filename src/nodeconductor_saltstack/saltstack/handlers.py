@@ -4,7 +4,7 @@ import logging
 
 from django.db import models
 
-from .log import event_logger
+from .log import event_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +31,8 @@ def is_field_loggable(instance, field):
 
 def log_saltstack_property_created(sender, instance, created=False, **kwargs):
     if created:
-        event_logger.saltstack_property.info(
+        event_buffer.log(
+            'saltstack_property',
             '%s %s has been created in {resource_full_name}.' % (
                 instance.get_type_display_name(), get_property_identifier(instance)),
             event_type='saltstack_property_creation_succeeded',
@@ -49,7 +50,8 @@ def log_saltstack_property_created(sender, instance, created=False, **kwargs):
         if not changes:
             return
 
-        event_logger.saltstack_property.info(
+        event_buffer.log(
+            'saltstack_property',
             '%s %s has been updated in {resource_full_name}. Changes: %s.' % (
                 instance.get_type_display_name(), get_property_identifier(instance), ', '.join(changes)),
             event_type='saltstack_property_update_succeeded',
@@ -59,10 +61,32 @@ def log_saltstack_property_created(sender, instance, created=False, **kwargs):
 
 
 def log_saltstack_property_deleted(sender, instance, **kwargs):
-    event_logger.saltstack_property.info(
+    event_buffer.log(
+        'saltstack_property',
         '%s %s has been deleted from {resource_full_name}.' % (
             instance.get_type_display_name(), get_property_identifier(instance)),
         event_type='saltstack_property_deletion_succeeded',
         event_context={
             'property': instance,
         })
+
+
+def invalidate_backend_cache(sender, instance, **kwargs):
+    from .apps import SaltStackConfig
+    from .backend import backend_cache
+
+    if instance.type == SaltStackConfig.service_name:
+        backend_cache.invalidate(instance)
+
+
+def update_search_index(sender, instance, created=False, **kwargs):
+    from .models import SearchTrigram
+
+    if created or any(instance.tracker.has_changed(field) for field in instance.search_fields):
+        SearchTrigram.update_index(sender, [instance])
+
+
+def delete_search_index(sender, instance, **kwargs):
+    from .models import SearchTrigram
+
+    SearchTrigram.delete_index(instance)
@@ -1,5 +1,13 @@
+import threading
+
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import transaction
+
 from nodeconductor.logging.loggers import EventLogger, event_logger
 from nodeconductor_saltstack.saltstack.models import SaltStackProperty
+from nodeconductor_saltstack.saltstack.settings import get_setting
 
 
 class SaltStackPropertyEventLogger(EventLogger):
@@ -14,3 +22,76 @@ class SaltStackPropertyEventLogger(EventLogger):
 
 
 event_logger.register('saltstack_property', SaltStackPropertyEventLogger)
+
+
+class EventBuffer(threading.local):
+    """ Defers events of a request or task until it is finished.
+
+        Events logged within collect() block are emitted when the block exits without errors
+        and enclosing DB transaction is committed, so rolled back changes are not reported
+        and event context is compiled outside of transaction. Events of failed block are dropped.
+        Outside of collect() block events are emitted immediately.
+    """
+
+    def __init__(self):
+        self.events = None
+
+    @contextmanager
+    def collect(self):
+        if self.events is not None:
+            # nested block is a part of outer one
+            yield
+            return
+
+        self.events = []
+        try:
+            yield
+            events = self.events
+        finally:
+            self.events = None
+
+        if events and transaction.get_connection().in_atomic_block and hasattr(transaction, 'on_commit'):
+            # dropped by Django if enclosing transaction is rolled back
+            transaction.on_commit(lambda: self.flush(events))
+        else:
+            self.flush(events)
+
+    def flush(self, events):
+        for logger_name, level, message, event_type, event_context in events:
+            logger = getattr(event_logger, logger_name)
+            getattr(logger, level)(message, event_type=event_type, event_context=event_context)
+
+    def log(self, logger_name, message, event_type, event_context, level='info'):
+        event = (logger_name, level, message, event_type, event_context)
+        if self.events is None:
+            self.flush([event])
+        else:
+            self.events.append(event)
+
+    def log_items(self, logger_name, message, summary, items, event_type, event_context, level='info'):
+        """ Log event for each item, e.g. added group member.
+            If there are more items than EVENTS_SUMMARY_THRESHOLD a single summary event is logged instead.
+
+            message - template with %s placeholder for item;
+            summary - template with %(count)s and %(items)s placeholders.
+        """
+        items = sorted(items)
+        threshold = get_setting('EVENTS_SUMMARY_THRESHOLD')
+        if threshold and len(items) > threshold:
+            shown = '%s and %s more' % (', '.join(items[:threshold]), len(items) - threshold)
+            self.log(logger_name, summary % {'count': len(items), 'items': shown}, event_type, event_context, level)
+        else:
+            for item in items:
+                self.log(logger_name, message % item, event_type, event_context, level)
+
+
+event_buffer = EventBuffer()
+
+
+def buffer_events(fn):
+    """ Emit events logged via event_buffer only after successful completion of decorated function """
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        with event_buffer.collect():
+            return fn(*args, **kwargs)
+    return wrapped
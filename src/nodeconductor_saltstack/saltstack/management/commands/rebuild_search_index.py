@@ -0,0 +1,19 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from nodeconductor_saltstack.saltstack.models import SearchTrigram
+from nodeconductor_saltstack.saltstack.settings import get_setting
+
+
+class Command(BaseCommand):
+    help = "Rebuild search index of tenant directory objects."
+
+    def handle(self, *args, **options):
+        SearchTrigram.objects.all().delete()
+        chunk_size = get_setting('BULK_UPDATE_SIZE')
+        for model in SearchTrigram.get_indexed_models():
+            ids = list(model.objects.values_list('pk', flat=True).order_by('pk'))
+            for index in range(0, len(ids), chunk_size):
+                SearchTrigram.update_index(model, model.objects.filter(pk__in=ids[index:index + chunk_size]))
+            self.stdout.write('%s: %s objects indexed' % (model.get_type_display_name(), len(ids)))
@@ -0,0 +1,252 @@
+import os
+import time
+import socket
+import bisect
+import threading
+
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from .settings import get_setting
+
+
+class Measurement(object):
+    """ Sizes and outcome of salt-api requests made for a command or a batch of commands """
+
+    __slots__ = ('request_size', 'response_size', 'outcome', 'outcomes')
+
+    def __init__(self):
+        self.request_size = 0
+        self.response_size = 0
+        self.outcome = None
+        self.outcomes = None
+
+
+class Histogram(object):
+    """ Prometheus-style histogram: counts of observations per bucket upper bound, their sum and count """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, data):
+        self.counts = [a + b for a, b in zip(self.counts, data['counts'])]
+        self.sum += data['sum']
+        self.count += data['count']
+
+    def to_dict(self):
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    def cumulative(self):
+        """ Return list of (upper bound, cumulative count) as exposed by Prometheus """
+        bounds = list(self.buckets) + [float('inf')]
+        total = 0
+        result = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """ Estimate quantile as upper bound of the bucket which contains it,
+            None if it exceeds the largest bucket or there are no observations.
+        """
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank and total > 0:
+                return bound if bound != float('inf') else None
+        return None
+
+
+class MetricsAggregator(object):
+    """ Latency, payload sizes and outcomes of salt-api commands aggregated into histograms.
+
+        Each process accumulates histograms per (master, target, command, outcome) in memory
+        and stores them in Django cache once per METRICS_FLUSH_INTERVAL seconds,
+        collect() merges snapshots of all processes which have flushed during METRICS_TTL seconds.
+    """
+
+    LABELS = ('master', 'target', 'command', 'outcome')
+    DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+    HISTOGRAMS = (
+        ('duration', DURATION_BUCKETS),
+        ('request_size', SIZE_BUCKETS),
+        ('response_size', SIZE_BUCKETS),
+    )
+    INDEX_KEY = 'saltstack-metrics-processes'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pid = None
+        self.series = {}
+        self.flushed = 0
+
+    @property
+    def process_key(self):
+        return 'saltstack-metrics:%s:%s' % (socket.gethostname(), os.getpid())
+
+    @property
+    def enabled(self):
+        return bool(get_setting('METRICS_FLUSH_INTERVAL'))
+
+    def create_series(self):
+        return {name: Histogram(buckets) for name, buckets in self.HISTOGRAMS}
+
+    @contextmanager
+    def measure(self, api, cmd):
+        """ Measure salt-api requests made within the block for command cmd of api.
+            If cmd is a list of batched commands, duration and sizes are split between them evenly
+            and outcomes of separate commands could be set to measurement.outcomes.
+        """
+        if not self.enabled:
+            yield Measurement()
+            return
+
+        measurement = Measurement()
+        previous = getattr(self.local, 'measurement', None)
+        self.local.measurement = measurement
+        started = time.time()
+        try:
+            yield measurement
+        except Exception:
+            measurement.outcome = measurement.outcome or 'error'
+            raise
+        else:
+            measurement.outcome = measurement.outcome or 'ok'
+        finally:
+            self.local.measurement = previous
+            duration = time.time() - started
+            cmds = cmd if isinstance(cmd, list) else [cmd]
+            outcomes = measurement.outcomes or [measurement.outcome] * len(cmds)
+            for name, outcome in zip(cmds, outcomes):
+                self.record(
+                    api.api_url, api.target, api.MAPPING.get(name) or name, outcome, duration / len(cmds),
+                    measurement.request_size / len(cmds), measurement.response_size / len(cmds))
+
+    def track_request(self, request_size=0, response_size=0, outcome=None):
+        """ Account HTTP request of the measured command, outcome marks failures of transport level """
+        measurement = getattr(self.local, 'measurement', None)
+        if measurement is None:
+            return
+        measurement.request_size += request_size
+        measurement.response_size += response_size
+        if outcome:
+            measurement.outcome = outcome
+
+    def record(self, master, target, command, outcome, duration, request_size=0, response_size=0):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            # forked celery workers start their own series
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.series = {}
+                self.flushed = time.time()
+
+            key = (master, target, command, outcome)
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = self.create_series()
+            series['duration'].observe(duration)
+            series['request_size'].observe(request_size)
+            series['response_size'].observe(response_size)
+
+            if time.time() - self.flushed >= get_setting('METRICS_FLUSH_INTERVAL'):
+                self.flush()
+
+    def flush(self):
+        """ Store series of this process in cache, caller must hold the lock """
+        now = time.time()
+        ttl = get_setting('METRICS_TTL')
+        snapshot = [
+            (key, {name: histogram.to_dict() for name, histogram in series.items()})
+            for key, series in self.series.items()]
+        cache.set(self.process_key, snapshot, ttl)
+
+        # index is updated without locking, lost entries are restored by the next flush of their process
+        processes = cache.get(self.INDEX_KEY) or {}
+        processes = {key: flushed for key, flushed in processes.items() if flushed > now - ttl}
+        processes[self.process_key] = now
+        cache.set(self.INDEX_KEY, processes, None)
+        self.flushed = now
+
+    def collect(self, master=None):
+        """ Merge series of all processes, return list of series sorted by total duration """
+        with self.lock:
+            if self.series and self.pid == os.getpid():
+                self.flush()
+
+        merged = {}
+        processes = cache.get(self.INDEX_KEY) or {}
+        for snapshot in cache.get_many(processes.keys()).values():
+            for key, data in snapshot:
+                key = tuple(key)
+                if master is not None and key[0] != master:
+                    continue
+                series = merged.get(key)
+                if series is None:
+                    series = merged[key] = self.create_series()
+                for name, histogram in series.items():
+                    histogram.merge(data[name])
+
+        result = [dict(zip(self.LABELS, key), **series) for key, series in merged.items()]
+        return sorted(result, key=lambda series: series['duration'].sum, reverse=True)
+
+    def to_dict(self, series):
+        data = {label: series[label] for label in self.LABELS}
+        duration = series['duration']
+        data.update({
+            'count': duration.count,
+            'duration_sum': duration.sum,
+            'duration_mean': duration.sum / duration.count if duration.count else None,
+            'duration_p50': duration.quantile(0.5),
+            'duration_p99': duration.quantile(0.99),
+            'request_size_sum': series['request_size'].sum,
+            'response_size_sum': series['response_size'].sum,
+            'duration_buckets': [(format_bound(bound), count) for bound, count in duration.cumulative()],
+        })
+        return data
+
+    def to_prometheus(self, series):
+        """ Format series in Prometheus text exposition format """
+        metrics = (
+            ('duration', 'saltstack_command_duration_seconds', 'Duration of salt-api commands'),
+            ('request_size', 'saltstack_command_request_bytes', 'Size of salt-api requests of commands'),
+            ('response_size', 'saltstack_command_response_bytes', 'Size of salt-api responses to commands'),
+        )
+        lines = []
+        for name, metric, description in metrics:
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s histogram' % metric)
+            for item in series:
+                labels = ','.join('%s="%s"' % (label, escape_label(item[label])) for label in self.LABELS)
+                histogram = item[name]
+                for bound, count in histogram.cumulative():
+                    lines.append('%s_bucket{%s,le="%s"} %s' % (metric, labels, format_bound(bound), count))
+                lines.append('%s_sum{%s} %r' % (metric, labels, float(histogram.sum)))
+                lines.append('%s_count{%s} %s' % (metric, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def escape_label(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+metrics = MetricsAggregator()
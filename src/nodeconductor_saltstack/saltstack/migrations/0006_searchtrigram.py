@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('saltstack', '0005_label_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('tenant_id', models.PositiveIntegerField()),
+                ('object_id', models.PositiveIntegerField()),
+                ('trigram', models.CharField(max_length=3)),
+                ('content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+                ('tenant_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='searchtrigram',
+            index_together=set([('tenant_type', 'tenant_id', 'trigram'), ('content_type', 'object_id')]),
+        ),
+    ]
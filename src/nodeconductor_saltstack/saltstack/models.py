@@ -1,7 +1,12 @@
 from __future__ import unicode_literals
 
+import re
+
+from collections import defaultdict
+
 from django.apps import apps
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
 from django.utils.lru_cache import lru_cache
 from django.utils.encoding import python_2_unicode_compatible
 from model_utils import FieldTracker
@@ -12,6 +17,8 @@ from nodeconductor.quotas.fields import CounterQuotaField, LimitAggregatorQuotaF
 from nodeconductor.quotas.models import QuotaModelMixin
 from nodeconductor.structure import models as structure_models
 
+from .settings import get_setting
+
 
 class SaltStackService(structure_models.Service):
     projects = models.ManyToManyField(
@@ -97,6 +104,9 @@ class SaltStackProperty(core_models.UuidMixin, core_models.NameMixin, LoggableMi
 
     tracker = FieldTracker()
 
+    # Fields indexed for tenant directory search, see SearchTrigram
+    search_fields = ()
+
     class Meta(object):
         abstract = True
 
@@ -120,3 +130,95 @@ class SaltStackProperty(core_models.UuidMixin, core_models.NameMixin, LoggableMi
     @lru_cache(maxsize=1)
     def get_all_models(cls):
         return [model for model in apps.get_models() if issubclass(model, cls)]
+
+
+def get_trigrams(text):
+    """ Split text into lowercase words and return set of their trigrams.
+        Words are padded with two spaces in front and one at the end the same way as pg_trgm does,
+        so short words and word beginnings produce trigrams as well.
+    """
+    trigrams = set()
+    for word in re.findall(r'\w+', text.lower(), re.UNICODE):
+        word = '  %s ' % word
+        trigrams.update(word[index:index + 3] for index in range(len(word) - 2))
+    return trigrams
+
+
+class SearchTrigram(models.Model):
+    """ Inverted trigram index of tenant directory objects.
+        Each row links trigram of indexed field value to SaltStack property of some tenant,
+        search ranks properties by share of query trigrams they contain.
+    """
+    # Minimal share of query trigrams which property should contain to be found
+    MIN_SIMILARITY = 0.3
+
+    tenant_type = models.ForeignKey(ContentType, related_name='+')
+    tenant_id = models.PositiveIntegerField()
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    trigram = models.CharField(max_length=3)
+
+    class Meta(object):
+        index_together = (('tenant_type', 'tenant_id', 'trigram'), ('content_type', 'object_id'))
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def get_indexed_models(cls):
+        return [model for model in SaltStackProperty.get_all_models() if model.search_fields]
+
+    @classmethod
+    def update_index(cls, model, objects):
+        """ Replace index rows of given objects of the same model """
+        objects = list(objects)
+        if not objects:
+            return
+        content_type = ContentType.objects.get_for_model(model)
+        tenant_type = ContentType.objects.get_for_model(model._meta.get_field('tenant').rel.to)
+        rows = []
+        for obj in objects:
+            text = ' '.join(unicode(getattr(obj, field) or '') for field in model.search_fields)
+            rows.extend(cls(tenant_type=tenant_type, tenant_id=obj.tenant_id, content_type=content_type,
+                            object_id=obj.pk, trigram=trigram) for trigram in get_trigrams(text))
+
+        with transaction.atomic():
+            cls.objects.filter(content_type=content_type, object_id__in=[obj.pk for obj in objects]).delete()
+            cls.objects.bulk_create(rows, batch_size=get_setting('BULK_UPDATE_SIZE'))
+
+    @classmethod
+    def delete_index(cls, obj):
+        cls.objects.filter(content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk).delete()
+
+    @classmethod
+    def search(cls, tenant, query, property_models=None):
+        """ Return queryset of matched properties of tenant ordered by rank.
+            Each item is a dictionary with content_type, object_id and number of matched trigrams.
+        """
+        trigrams = get_trigrams(query)
+        queryset = cls.objects.filter(
+            tenant_type=ContentType.objects.get_for_model(tenant), tenant_id=tenant.pk, trigram__in=trigrams)
+        if property_models is not None:
+            queryset = queryset.filter(
+                content_type__in=ContentType.objects.get_for_models(*property_models).values())
+        return (queryset
+                .values('content_type', 'object_id')
+                .annotate(matches=models.Count('id'))
+                .filter(matches__gte=max(1, int(len(trigrams) * cls.MIN_SIMILARITY)))
+                .order_by('-matches', 'content_type', 'object_id'))
+
+    @classmethod
+    def get_results(cls, query, ranking):
+        """ Load properties for search ranking, returns list of (property, rank) pairs in ranking order """
+        ranking = list(ranking)
+        object_ids = defaultdict(list)
+        for item in ranking:
+            object_ids[item['content_type']].append(item['object_id'])
+
+        objects = {}
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for obj in model.objects.filter(pk__in=ids).select_related('tenant'):
+                objects[content_type_id, obj.pk] = obj
+
+        query_size = len(get_trigrams(query)) or 1
+        return [(objects[item['content_type'], item['object_id']], float(item['matches']) / query_size)
+                for item in ranking if (item['content_type'], item['object_id']) in objects]
@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, FloatField, Q, Value, When
+
+from nodeconductor.quotas.exceptions import QuotaExceededException
+from nodeconductor.quotas.models import Quota
+
+from .settings import get_setting
+
+
+class QuotaSnapshot(object):
+    """ Quotas of several objects loaded with a single query and reused for all checks.
+        Usually it is shared by serializers of one request via get_quota_snapshot().
+    """
+
+    def __init__(self):
+        self.quotas = {}
+        self.scopes = set()
+
+    @staticmethod
+    def get_scope_key(scope):
+        return ContentType.objects.get_for_model(scope).id, scope.pk
+
+    def load(self, *scopes):
+        """ Fetch quotas of all given scopes which haven't been loaded yet """
+        missing = defaultdict(set)
+        for scope in scopes:
+            key = self.get_scope_key(scope)
+            if key not in self.scopes:
+                missing[key[0]].add(key[1])
+                self.scopes.add(key)
+        if not missing:
+            return
+
+        query = Q()
+        for content_type_id, object_ids in missing.items():
+            query |= Q(content_type_id=content_type_id, object_id__in=object_ids)
+        for quota in Quota.objects.filter(query):
+            self.quotas[(quota.content_type_id, quota.object_id, quota.name)] = quota
+
+    def get(self, scope, name):
+        self.load(scope)
+        content_type_id, object_id = self.get_scope_key(scope)
+        try:
+            return self.quotas[(content_type_id, object_id, str(name))]
+        except KeyError:
+            raise Quota.DoesNotExist("Quota %s of %s doesn't exist" % (name, scope))
+
+    def validate_quota_change(self, scope, quota_deltas):
+        """ Same as QuotaModelMixin.validate_quota_change(raise_exception=True) using loaded quotas """
+        errors = []
+        for name, delta in quota_deltas.items():
+            quota = self.get(scope, name)
+            if quota.is_exceeded(delta):
+                errors.append('%s quota limit: %s, requires %s (%s)\n' % (
+                    quota.name, quota.limit, quota.usage + delta, scope))
+        if errors:
+            raise QuotaExceededException('One or more quotas were exceeded: %s' % ';'.join(errors))
+
+
+def get_quota_snapshot(context):
+    """ Return QuotaSnapshot stored in serializer context, nested and list serializers share it """
+    if 'quota_snapshot' not in context:
+        context['quota_snapshot'] = QuotaSnapshot()
+    return context['quota_snapshot']
+
+
+def bulk_sync_quotas(model, quota_name, values):
+    """ Update quotas of several model instances with a few UPDATE statements.
+        Expects dictionary {instance id: {'usage': <usage>, 'limit': <limit>}},
+        writes changed values only and returns counts of changed and unchanged quotas.
+
+        Quotas are updated without saving model instances,
+        so aggregated quotas of parents have to be recalculated by caller.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    quotas = Quota.objects.filter(content_type=content_type, object_id__in=values.keys(), name=quota_name)
+
+    updates = {'usage': {}, 'limit': {}}
+    changed = set()
+    unchanged = 0
+    for quota_id, object_id, usage, limit in quotas.values_list('id', 'object_id', 'usage', 'limit'):
+        new_values = values[object_id]
+        current_values = {'usage': usage, 'limit': limit}
+        for field, value in new_values.items():
+            if value != current_values[field]:
+                updates[field][quota_id] = value
+                changed.add(quota_id)
+        if quota_id not in changed:
+            unchanged += 1
+
+    chunk_size = get_setting('BULK_UPDATE_SIZE')
+    with transaction.atomic():
+        for field, field_updates in updates.items():
+            quota_ids = field_updates.keys()
+            for index in range(0, len(quota_ids), chunk_size):
+                chunk = quota_ids[index:index + chunk_size]
+                Quota.objects.filter(id__in=chunk).update(**{field: Case(
+                    *[When(id=quota_id, then=Value(field_updates[quota_id])) for quota_id in chunk],
+                    output_field=FloatField())})
+
+    return {'changed': len(changed), 'unchanged': unchanged}
@@ -1,6 +1,7 @@
 import re
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from nodeconductor.quotas import serializers as quotas_serializers
 from nodeconductor.structure import serializers as structure_serializers
 
@@ -70,3 +71,49 @@ class PhoneValidationMixin(object):
             raise serializers.ValidationError({'phone': "Missed phone number for notification."})
 
         return attrs
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    query = serializers.CharField(min_length=2)
+    type = serializers.MultipleChoiceField(choices=[], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super(SearchQuerySerializer, self).__init__(*args, **kwargs)
+        self.fields['type'].choices = [(model.get_type_name(), model.get_type_display_name())
+                                       for model in models.SearchTrigram.get_indexed_models()]
+
+    def validate(self, attrs):
+        types = attrs.pop('type', None)
+        if types:
+            attrs['property_models'] = [model for model in models.SearchTrigram.get_indexed_models()
+                                        if model.get_type_name() in types]
+        return attrs
+
+
+class SearchResultSerializer(serializers.Serializer):
+    """ Serializes (property, rank) pairs returned by SearchTrigram.get_results() """
+    url = serializers.SerializerMethodField()
+    uuid = serializers.SerializerMethodField()
+    type = serializers.SerializerMethodField()
+    name = serializers.SerializerMethodField()
+    email = serializers.SerializerMethodField()
+    rank = serializers.SerializerMethodField()
+
+    def get_url(self, result):
+        obj, _ = result
+        return reverse(obj.get_url_name() + '-detail', kwargs={'uuid': obj.uuid.hex}, request=self.context['request'])
+
+    def get_uuid(self, result):
+        return result[0].uuid.hex
+
+    def get_type(self, result):
+        return result[0].get_type_name()
+
+    def get_name(self, result):
+        return result[0].name
+
+    def get_email(self, result):
+        return getattr(result[0], 'email', '')
+
+    def get_rank(self, result):
+        return round(result[1], 3)
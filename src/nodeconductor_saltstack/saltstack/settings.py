@@ -0,0 +1,72 @@
+from django.conf import settings
+
+
+# Default values of NODECONDUCTOR_SALTSTACK settings
+DEFAULT_SETTINGS = {
+    # HTTP connections to salt-api kept open per process and per backend URL
+    'POOL_SIZE': 10,
+    # Seconds an unused connection pool is kept alive before it is closed
+    'POOL_IDLE_TIMEOUT': 60,
+    # Seconds to wait for connection to salt-api and for its response
+    'CONNECT_TIMEOUT': 10,
+    'READ_TIMEOUT': 10 * 60,
+    # Connection retries to salt-api; requests that reached salt-api are never repeated
+    'MAX_RETRIES': 3,
+    # Backoff factor for connection retries: {backoff} * (2 ^ ({retry number} - 1)) seconds
+    'RETRY_BACKOFF': 0.3,
+    # Authenticate in salt-api once and reuse token instead of sending credentials with each command
+    'TOKEN_AUTH': True,
+    # Seconds before token expiration when it is considered as expired already
+    'TOKEN_EXPIRY_MARGIN': 60,
+    # Maximum number of commands sent to salt-api within a single request by SaltStackBaseAPI.batch()
+    'BATCH_SIZE': 50,
+    # Initial and maximum delay between checks of asynchronous salt job status, seconds
+    'JOB_POLL_INTERVAL': 5,
+    'JOB_POLL_MAX_INTERVAL': 60,
+    # Seconds after which unfinished asynchronous salt job is considered as failed
+    'JOB_TIMEOUT': 60 * 60,
+    # Maximum number of rows updated by a single UPDATE statement during bulk synchronization
+    'BULK_UPDATE_SIZE': 500,
+    # Seconds during which unchanged backend snapshot allows to skip properties reconciliation
+    'RECONCILE_SNAPSHOT_TTL': 24 * 60 * 60,
+    # Number of tenants synchronized by a single celery task
+    'SYNC_CHUNK_SIZE': 10,
+    # Maximum number of synchronization tasks running against one SaltStack master at the same time
+    'SYNC_CONCURRENCY': 3,
+    # Part of celerybeat period used to spread tenants synchronization
+    'SYNC_SPREAD': 0.8,
+    # Number of backend instances cached per thread, 0 disables caching
+    'BACKEND_CACHE_SIZE': 100,
+    # Number of users created on backend by a single batch request during users import
+    'IMPORT_CHUNK_SIZE': 50,
+    # Seconds since last progress of users import after which it is considered as interrupted and could be resumed
+    'IMPORT_STALE_TIMEOUT': 10 * 60,
+    # Seconds during which output of API list methods is cached, 0 disables caching
+    'LIST_CACHE_TTL': 5 * 60,
+    # Number of indexed snapshots of cached lists kept by each process for lookups by id and email
+    'SNAPSHOT_CACHE_SIZE': 50,
+    # Number of members above which membership change is logged as a single summary event, 0 disables summaries
+    'EVENTS_SUMMARY_THRESHOLD': 20,
+    # Seconds between writes of per-process salt-api metrics to Django cache, 0 disables metrics
+    'METRICS_FLUSH_INTERVAL': 10,
+    # Seconds during which metrics of a process which stopped flushing them are kept
+    'METRICS_TTL': 24 * 60 * 60,
+    # Part of failed calls to SaltStack master and target within BREAKER_WINDOW seconds which opens
+    # circuit breaker, if at least BREAKER_MIN_CALLS calls have been made; 0 disables circuit breakers
+    'BREAKER_FAILURE_RATE': 0.5,
+    'BREAKER_MIN_CALLS': 5,
+    'BREAKER_WINDOW': 60,
+    # Seconds during which open circuit breaker fails calls before target is probed with test.ping
+    'BREAKER_OPEN_TIMEOUT': 30,
+    # How commands are distributed between minions of target: 'all' sends them to target glob,
+    # 'round_robin' and 'least_outstanding' run each command on a single minion chosen accordingly
+    'TARGET_SELECTION': 'all',
+    # Seconds during which minions of target resolved with test.ping are cached
+    'MINIONS_CACHE_TTL': 5 * 60,
+}
+
+
+def get_setting(name):
+    """ Get value of NODECONDUCTOR_SALTSTACK setting or its default """
+    user_settings = getattr(settings, 'NODECONDUCTOR_SALTSTACK', {})
+    return user_settings.get(name, DEFAULT_SETTINGS[name])
@@ -0,0 +1,196 @@
+import json
+import hashlib
+
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, ManyToManyField, Max, Q, Value, When, signals
+
+from .log import event_buffer
+from .settings import get_setting
+
+
+def reconcile_properties(model, scope, backend_objects, fields, before_delete=None):
+    """ Bring properties stored in DB in line with backend using three-way diff by backend_id.
+
+        model - SaltStackProperty model;
+        scope - filter for properties of one tenant, e.g. {'tenant': tenant}, also applied to new properties;
+        backend_objects - list of dictionaries with backend_id and values of new properties;
+        fields - fields which are compared and updated for existing properties;
+        before_delete - function which receives queryset of properties missing on backend
+                        and returns queryset of properties which should be deleted.
+
+        Missing properties are created in bulk, changed ones are updated with a few UPDATE statements
+        and removed ones are deleted with a single query.
+        If neither backend snapshot nor count and last id of stored properties have changed
+        since last reconciliation it is skipped.
+        Returns counts of created, updated, deleted and unchanged properties.
+    """
+    queryset = model.objects.filter(**scope)
+    scope_key = ','.join('%s=%s' % (k, getattr(v, 'pk', v)) for k, v in sorted(scope.items()))
+    snapshot_key = 'saltstack-snapshot:%s:%s' % (model._meta.db_table, scope_key)
+    snapshot = json.dumps(sorted(backend_objects, key=lambda o: o['backend_id']), sort_keys=True, default=str)
+    checksum = hashlib.md5(snapshot.encode('utf-8')).hexdigest()
+    # properties created or deleted in DB since last reconciliation change its fingerprint
+    fingerprint = queryset.aggregate(count=Count('pk'), last=Max('pk'))
+    if cache.get(snapshot_key) == (checksum, fingerprint['count'], fingerprint['last']):
+        return {'skipped': True}
+
+    current = {obj.backend_id: obj for obj in queryset}
+    backend = {obj['backend_id']: obj for obj in backend_objects}
+    report = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    # property events are emitted after changes are committed
+    with event_buffer.collect(), transaction.atomic():
+        created_ids = set(backend) - set(current)
+        if created_ids:
+            new_objects = [model(**dict(scope, **backend[backend_id])) for backend_id in created_ids]
+            model.objects.bulk_create(new_objects, batch_size=get_setting('BULK_UPDATE_SIZE'))
+            # bulk_create doesn't send signals, while quotas and events rely on them
+            for obj in queryset.filter(backend_id__in=created_ids):
+                signals.post_save.send(sender=model, instance=obj, created=True)
+            report['created'] = len(created_ids)
+
+        deleted_ids = set(current) - set(backend)
+        if deleted_ids:
+            deleted = queryset.filter(backend_id__in=deleted_ids)
+            if before_delete:
+                deleted = before_delete(deleted)
+            report['deleted'] = deleted.count()
+            deleted.delete()
+
+        updates = defaultdict(dict)
+        updated = []
+        for backend_id in set(current) & set(backend):
+            obj = current[backend_id]
+            changed_fields = [f for f in fields if f in backend[backend_id] and
+                              getattr(obj, f) != backend[backend_id][f]]
+            if changed_fields:
+                for field in changed_fields:
+                    setattr(obj, field, backend[backend_id][field])
+                    updates[field][obj.pk] = backend[backend_id][field]
+                updated.append(obj)
+            else:
+                report['unchanged'] += 1
+
+        chunk_size = get_setting('BULK_UPDATE_SIZE')
+        for field, field_updates in updates.items():
+            pks = field_updates.keys()
+            for index in range(0, len(pks), chunk_size):
+                chunk = pks[index:index + chunk_size]
+                model.objects.filter(pk__in=chunk).update(**{field: Case(
+                    *[When(pk=pk, then=Value(field_updates[pk])) for pk in chunk],
+                    output_field=model._meta.get_field(field))})
+        # queryset update doesn't send signals, instances still track their previous values for handlers
+        for obj in updated:
+            signals.post_save.send(sender=model, instance=obj, created=False)
+        report['updated'] = len(updated)
+
+    fingerprint = queryset.aggregate(count=Count('pk'), last=Max('pk'))
+    cache.set(snapshot_key, (checksum, fingerprint['count'], fingerprint['last']),
+              timeout=get_setting('RECONCILE_SNAPSHOT_TTL'))
+    return report
+
+
+class MembersSync(object):
+    """ Synchronize members of a property with backend and DB.
+
+        Difference between current and new members is computed once, backend receives
+        a single add and a single remove command with comma-joined backend ids and
+        many-to-many relation is changed with bulk queries on its through table.
+
+        obj - property which members are changed;
+        field_name - many-to-many field of property with members;
+        api - backend API of property, e.g. backend.groups;
+        add_method, del_method - names of API methods which add and remove members.
+    """
+
+    def __init__(self, obj, field_name, api, add_method, del_method):
+        self.obj = obj
+        self.field_name = field_name
+        self.api = api
+        self.add_method = add_method
+        self.del_method = del_method
+
+    def get_members(self):
+        return set(getattr(self.obj, self.field_name).all())
+
+    def diff(self, members, current=None):
+        """ Return sets of added and removed members """
+        members = set(members)
+        if current is None:
+            current = self.get_members()
+        return members - current, current - members
+
+    def push(self, added, removed):
+        """ Send changes to backend, return results of called methods """
+        results = []
+        if added:
+            results.append(getattr(self.api, self.add_method)(
+                id=self.obj.backend_id, user_id=','.join(sorted(m.backend_id for m in added))))
+        if removed:
+            results.append(getattr(self.api, self.del_method)(
+                id=self.obj.backend_id, user_id=','.join(sorted(m.backend_id for m in removed))))
+        return results
+
+    def save(self, added, removed):
+        """ Store changes in DB """
+        field = self.obj._meta.get_field(self.field_name)
+        if not isinstance(field, ManyToManyField):
+            # generic relations managers already change members in bulk
+            manager = getattr(self.obj, self.field_name)
+            manager.remove(*removed)
+            manager.add(*added)
+            return
+
+        through = field.rel.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        symmetrical = field.rel.symmetrical and field.rel.to == field.model
+        with transaction.atomic():
+            if removed:
+                ids = [member.pk for member in removed]
+                query = Q(**{source: self.obj.pk, target + '__in': ids})
+                if symmetrical:
+                    query |= Q(**{source + '__in': ids, target: self.obj.pk})
+                through.objects.filter(query).delete()
+
+            if added:
+                rows = [through(**{source + '_id': self.obj.pk, target + '_id': member.pk}) for member in added]
+                if symmetrical:
+                    rows.extend(through(**{source + '_id': member.pk, target + '_id': self.obj.pk})
+                                for member in added if member.pk != self.obj.pk)
+                through.objects.bulk_create(rows)
+
+    def apply(self, members):
+        """ Push difference with new members to backend within single request and store it in DB.
+            Must not be called inside of API batch() block as results are checked before DB is changed.
+        """
+        added, removed = self.diff(members)
+        with self.api.batch():
+            results = self.push(added, removed)
+        for result in results:
+            result.result  # raise backend error if any
+        self.save(added, removed)
+        return added, removed
+
+
+def schedule_tenants_sync(tenants, task, period):
+    """ Spread synchronization of tenants over celerybeat period with bounded load of each SaltStack master.
+
+        Tenants are grouped by master URL and split into chunks of SYNC_CHUNK_SIZE tenants.
+        Chunks are started by waves of SYNC_CONCURRENCY tasks per master,
+        waves are distributed evenly within SYNC_SPREAD part of the period.
+    """
+    masters = defaultdict(list)
+    for uuid, backend_url in tenants.values_list('uuid', 'service_project_link__service__settings__backend_url'):
+        masters[backend_url].append(uuid.hex)
+
+    chunk_size = get_setting('SYNC_CHUNK_SIZE')
+    concurrency = get_setting('SYNC_CONCURRENCY')
+    for backend_url, uuids in masters.items():
+        chunks = [uuids[index:index + chunk_size] for index in range(0, len(uuids), chunk_size)]
+        waves = (len(chunks) + concurrency - 1) // concurrency
+        interval = period * get_setting('SYNC_SPREAD') / waves
+        for index, chunk in enumerate(chunks):
+            task.apply_async(args=(chunk,), countdown=int(index // concurrency * interval))
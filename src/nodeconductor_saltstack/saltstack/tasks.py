@@ -1,11 +1,71 @@
+import time
+import logging
+
 from celery import shared_task
+from django.apps import apps
+from django.utils import six
 
+from .backend import Entity, MinionUnavailableError, SaltStackBackendError, SaltStackUnavailableError
 from .models import SaltStackServiceProjectLink
-from ..sharepoint.tasks import sync_spl_quotas as sharepoint_sync_spl_quotas
+from .settings import get_setting
+
+
+logger = logging.getLogger(__name__)
 
 
 # celerybeat tasks
 @shared_task(name='nodeconductor.saltstack.sync_quotas')
 def sync_quotas():
+    # imported here to avoid circular import as sharepoint tasks use poll_job
+    from ..sharepoint.tasks import sync_spl_quotas as sharepoint_sync_spl_quotas
+
     for spl in SaltStackServiceProjectLink.objects.all():
         sharepoint_sync_spl_quotas.delay(spl.id)
+
+
+def store_error_message(obj, error):
+    """ Save error of a task to the object it has been working on, if the object keeps errors """
+    if hasattr(obj, 'error_message'):
+        obj.error_message = six.text_type(error)
+        obj.save(update_fields=['error_message'])
+
+
+@shared_task(name='nodeconductor.saltstack.poll_job', bind=True, max_retries=None)
+def poll_job(self, job, model_label, object_uuid, api_name, fn_name):
+    """ Wait for a salt job submitted with SaltStackBaseAPI.submit() and return result of the method.
+        Polls backend with exponential backoff and releases a worker between attempts.
+    """
+    model = apps.get_model(model_label)
+    obj = model.objects.get(uuid=object_uuid)
+    api = getattr(obj.get_backend(), api_name)
+
+    try:
+        result = api.collect(fn_name, job)
+    except MinionUnavailableError as e:
+        # all minions have reported, none of them has run the command
+        store_error_message(obj, e)
+        raise
+    except SaltStackUnavailableError as e:
+        # master is temporarily unavailable while the job keeps running on minion
+        logger.warning('Cannot check status of salt job %s, will retry: %s', job['jid'], e)
+        result = None
+    except Exception as e:
+        store_error_message(obj, e)
+        raise
+
+    if result is None:
+        if time.time() - job['submitted'] > get_setting('JOB_TIMEOUT'):
+            error = SaltStackBackendError(
+                "Salt job %s of %s.%s has not finished in time" % (job['jid'], api_name, fn_name))
+            store_error_message(obj, error)
+            raise error
+
+        countdown = min(get_setting('JOB_POLL_INTERVAL') * 2 ** self.request.retries,
+                        get_setting('JOB_POLL_MAX_INTERVAL'))
+        raise self.retry(countdown=countdown)
+
+    if isinstance(result, list):
+        return [r.to_dict() if isinstance(r, Entity) else r for r in result]
+    elif isinstance(result, Entity):
+        return result.to_dict()
+    return result
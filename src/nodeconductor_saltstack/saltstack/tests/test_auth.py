@@ -0,0 +1,55 @@
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from nodeconductor_saltstack.saltstack.backend import SaltStackAPI, token_cache
+
+
+def response(status_code=200, data=None):
+    return MagicMock(status_code=status_code, ok=status_code < 400, json=MagicMock(return_value=data))
+
+
+@override_settings(NODECONDUCTOR_SALTSTACK={'TOKEN_AUTH': True, 'TOKEN_EXPIRY_MARGIN': 60})
+class TokenAuthTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.tokens.clear()
+        self.api = SaltStackAPI('http://master', 'user', 'password', 'exchange-*')
+        self.tokens = iter(['token-1', 'token-2'])
+        self.sent = []
+        self.expired_token = None
+
+    def send(self, api, url, data=None, headers=None, method='POST'):
+        self.sent.append((url, headers))
+        if url == '/login':
+            return response(data={'return': [{'token': next(self.tokens), 'expire': time.time() + 3600}]})
+        if headers['X-Auth-Token'] == self.expired_token:
+            return response(401)
+        return response(data={'return': [{'exchange-1': True}]})
+
+    def test_token_is_obtained_once_and_sent_with_commands(self):
+        with patch.object(SaltStackAPI, 'send', self.send):
+            self.api.request('/run', {'fun': 'test.ping'})
+            self.api.request('/run', {'fun': 'test.ping'})
+
+        self.assertEqual([url for url, _ in self.sent], ['/login', '/', '/'])
+        self.assertEqual(self.sent[-1][1], {'X-Auth-Token': 'token-1'})
+
+    def test_token_is_shared_with_other_processes(self):
+        with patch.object(SaltStackAPI, 'send', self.send):
+            self.api.request('/run', {'fun': 'test.ping'})
+            token_cache.tokens.clear()
+            self.api.request('/run', {'fun': 'test.ping'})
+
+        self.assertEqual([url for url, _ in self.sent].count('/login'), 1)
+
+    def test_rejected_token_is_replaced_by_new_login(self):
+        self.expired_token = 'token-1'
+        with patch.object(SaltStackAPI, 'send', self.send):
+            result = self.api.request('/run', {'fun': 'test.ping'})
+
+        self.assertEqual(result, {'return': [{'exchange-1': True}]})
+        self.assertEqual([url for url, _ in self.sent], ['/login', '/', '/login', '/'])
+        self.assertEqual(token_cache.get(self.api.token_cache_key), 'token-2')
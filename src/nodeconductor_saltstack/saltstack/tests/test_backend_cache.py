@@ -0,0 +1,59 @@
+import threading
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory, ServiceSettingsFactory
+from nodeconductor_saltstack.saltstack.backend import BackendCache, backend_cache
+
+
+class Backend(object):
+    def __init__(self, settings, tenant=None):
+        self.settings = settings
+        self.tenant = tenant
+
+
+class BackendCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.settings = ServiceSettingsFactory()
+        self.backend_cache = BackendCache()
+
+    def test_backend_is_reused_within_thread(self):
+        backend = self.backend_cache.get(Backend, self.settings)
+        self.assertIs(self.backend_cache.get(Backend, self.settings), backend)
+
+        other_thread = []
+        thread = threading.Thread(target=lambda: other_thread.append(self.backend_cache.get(Backend, self.settings)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_thread[0], backend)
+
+    def test_reused_backend_is_bound_to_fresh_tenant(self):
+        tenant = ExchangeTenantFactory()
+        backend = self.backend_cache.get(Backend, self.settings, tenant=tenant)
+
+        fresh_tenant = type(tenant).objects.get(pk=tenant.pk)
+        self.assertIs(self.backend_cache.get(Backend, self.settings, tenant=fresh_tenant), backend)
+        self.assertIs(backend.tenant, fresh_tenant)
+        self.assertIsNot(self.backend_cache.get(Backend, self.settings, tenant=ExchangeTenantFactory()), backend)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'BACKEND_CACHE_SIZE': 1})
+    def test_least_recently_used_backend_is_evicted(self):
+        backend = self.backend_cache.get(Backend, self.settings)
+        self.backend_cache.get(Backend, ServiceSettingsFactory())
+        self.assertIsNot(self.backend_cache.get(Backend, self.settings), backend)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'BACKEND_CACHE_SIZE': 0})
+    def test_backend_is_not_cached_if_cache_is_disabled(self):
+        backend = self.backend_cache.get(Backend, self.settings)
+        self.assertIsNot(self.backend_cache.get(Backend, self.settings), backend)
+
+    def test_saved_settings_drop_cached_backend(self):
+        backend = backend_cache.get(Backend, self.settings)
+        self.assertIs(backend_cache.get(Backend, self.settings), backend)
+
+        self.settings.backend_url = 'http://example.org/'
+        self.settings.save()
+
+        self.assertIsNot(backend_cache.get(Backend, self.settings), backend)
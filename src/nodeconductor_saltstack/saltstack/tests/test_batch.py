@@ -0,0 +1,142 @@
+import json
+import re
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+
+from nodeconductor_saltstack.saltstack.backend import SaltStackAPI, SaltStackBackendError, SaltStackBaseAPI
+
+
+class GroupAPI(SaltStackBaseAPI):
+
+    class Methods:
+        list = dict(
+            name='GroupList',
+            many=True,
+            output={
+                'Guid': 'id',
+                'Name': 'name',
+            },
+        )
+
+        add_member = dict(
+            name='AddGroupMember',
+            input={
+                'id': 'GroupId',
+                'user_id': 'UserId',
+            },
+            output={
+                'Guid': 'id',
+                'Member': 'member',
+            },
+        )
+
+        get_member = dict(
+            name='GroupMember',
+            input={
+                'id': 'GroupId',
+                'user_id': 'UserId',
+            },
+            output={
+                'Guid': 'id',
+                'Member': 'member',
+            },
+        )
+
+
+class Backend(object):
+    tenant = None
+
+
+class FakeSaltAPI(object):
+    """ Run GroupList, AddGroupMember and GroupMember commands, the latter two fail for user 'missing' """
+
+    def __init__(self):
+        self.requests = []
+
+    def execute(self, command):
+        if 'GroupList' in command:
+            return {'Status': 'OK', 'Output': [{'Guid': 'group', 'Name': 'Group'}]}
+        user_id = re.search(r'-UserId "(\w+)"', command).group(1)
+        if user_id == 'missing':
+            return {'Status': 'Error', 'Message': 'User %s is not found' % user_id}
+        return {'Status': 'OK', 'Output': {'Guid': 'group', 'Member': user_id}}
+
+    def request(self, api, url, data=None, method='POST'):
+        self.requests.append(data)
+        lowstates = data if isinstance(data, list) else [data]
+        return {'return': [{'exchange-1': json.dumps(self.execute(lowstate['arg']))} for lowstate in lowstates]}
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = GroupAPI('http://master', 'user', 'password', 'exchange-*')
+        self.api.backend = Backend()
+        self.salt = FakeSaltAPI()
+        patcher = patch.object(SaltStackAPI, 'request', self.salt.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_are_split_back_into_calls(self):
+        with self.api.batch():
+            results = [self.api.get_member(id='group', user_id=user_id) for user_id in ('alice', 'bob')]
+
+        self.assertEqual(len(self.salt.requests), 1)
+        self.assertEqual([result.result.member for result in results], ['alice', 'bob'])
+
+    def test_command_error_is_assigned_to_its_call(self):
+        with self.assertRaises(SaltStackBackendError):
+            with self.api.batch():
+                results = [self.api.get_member(id='group', user_id=user_id)
+                           for user_id in ('alice', 'missing', 'bob')]
+
+        self.assertEqual(results[0].result.member, 'alice')
+        self.assertRaisesRegexp(SaltStackBackendError, 'missing', lambda: results[1].result)
+        self.assertEqual(results[2].result.member, 'bob')
+
+    def test_result_is_not_available_inside_of_block(self):
+        with self.api.batch():
+            result = self.api.get_member(id='group', user_id='alice')
+            self.assertRaises(SaltStackBackendError, lambda: result.result)
+
+    def test_nested_batch_is_sent_with_outer_one(self):
+        with self.api.batch():
+            first = self.api.get_member(id='group', user_id='alice')
+            with self.api.batch():
+                second = self.api.get_member(id='group', user_id='bob')
+            self.assertEqual(self.salt.requests, [])
+
+        self.assertEqual(len(self.salt.requests), 1)
+        self.assertEqual((first.result.member, second.result.member), ('alice', 'bob'))
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'BATCH_SIZE': 2})
+    def test_large_batch_is_split_into_requests_of_batch_size(self):
+        with self.api.batch():
+            results = [self.api.get_member(id='group', user_id='user%s' % index) for index in range(5)]
+
+        self.assertEqual([len(data) for data in self.salt.requests], [2, 2, 1])
+        self.assertEqual([result.result.member for result in results], ['user%s' % index for index in range(5)])
+
+    def test_batch_with_write_drops_cached_lists(self):
+        self.api.list()
+        with self.api.batch():
+            self.api.get_member(id='group', user_id='alice')
+        self.api.list()
+        self.assertEqual(len(self.salt.requests), 2)
+
+        with self.api.batch():
+            self.api.get_member(id='group', user_id='alice')
+            self.api.add_member(id='group', user_id='bob')
+        self.api.list()
+        self.assertEqual(len(self.salt.requests), 4)
+
+    def test_failed_batch_with_write_drops_cached_lists(self):
+        self.api.list()
+        with self.assertRaises(SaltStackBackendError):
+            with self.api.batch():
+                self.api.add_member(id='group', user_id='missing')
+        self.api.list()
+
+        self.assertEqual(len(self.salt.requests), 3)
@@ -0,0 +1,77 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import MagicMock
+
+from nodeconductor_saltstack.saltstack.backend import CircuitBreaker, CircuitOpenError
+
+
+BREAKER_SETTINGS = {
+    'BREAKER_FAILURE_RATE': 0.5,
+    'BREAKER_MIN_CALLS': 4,
+    'BREAKER_WINDOW': 60,
+    'BREAKER_OPEN_TIMEOUT': 30,
+}
+
+
+@override_settings(NODECONDUCTOR_SALTSTACK=BREAKER_SETTINGS)
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('http://master', 'exchange-*')
+        self.probe = MagicMock(return_value=True)
+
+    def fail(self, failures, successes=0):
+        for _ in range(successes):
+            self.breaker.record(failed=False)
+        for _ in range(failures):
+            self.breaker.record(failed=True)
+
+    def test_breaker_stays_closed_below_failure_rate(self):
+        self.fail(failures=1, successes=3)
+
+        self.breaker.check(self.probe)
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+
+    def test_open_breaker_fails_fast_without_probe(self):
+        self.fail(failures=2, successes=2)
+
+        self.assertRaises(CircuitOpenError, self.breaker.check, self.probe)
+        self.assertFalse(self.probe.called)
+
+    def test_breaker_is_shared_between_processes(self):
+        self.fail(failures=4)
+
+        other = CircuitBreaker('http://master', 'exchange-*')
+        self.assertEqual(other.get_state(), CircuitBreaker.OPEN)
+        self.assertEqual(CircuitBreaker('http://master', 'sharepoint-*').get_state(), CircuitBreaker.CLOSED)
+
+    def test_successful_probe_closes_half_open_breaker(self):
+        with override_settings(NODECONDUCTOR_SALTSTACK=dict(BREAKER_SETTINGS, BREAKER_OPEN_TIMEOUT=0)):
+            self.fail(failures=4)
+            self.assertEqual(self.breaker.get_state(), CircuitBreaker.HALF_OPEN)
+
+            self.breaker.check(self.probe)
+
+        self.probe.assert_called_once_with()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+
+    def test_failed_probe_opens_breaker_again(self):
+        self.probe.return_value = False
+        with override_settings(NODECONDUCTOR_SALTSTACK=dict(BREAKER_SETTINGS, BREAKER_OPEN_TIMEOUT=0)):
+            self.fail(failures=4)
+            self.assertRaises(CircuitOpenError, self.breaker.check, self.probe)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_unexpected_probe_exception_opens_breaker_again(self):
+        self.probe.side_effect = ValueError('Malformed test.ping response')
+        with override_settings(NODECONDUCTOR_SALTSTACK=dict(BREAKER_SETTINGS, BREAKER_OPEN_TIMEOUT=0)):
+            self.fail(failures=4)
+            self.assertRaises(CircuitOpenError, self.breaker.check, self.probe)
+
+            # breaker isn't stuck in half-open state, the next call probes target again
+            self.probe.side_effect = None
+            self.breaker.check(self.probe)
+
+        self.assertEqual(self.probe.call_count, 2)
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
@@ -0,0 +1,77 @@
+import json
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from nodeconductor_saltstack.exchange.models import ExchangeTenant
+from nodeconductor_saltstack.exchange.tests.factories import ExchangeTenantFactory
+from nodeconductor_saltstack.saltstack.backend import SaltStackAPI, SaltStackBackendError
+from nodeconductor_saltstack.saltstack.tasks import poll_job
+
+
+def job_output(**outputs):
+    return {'return': [{minion: json.dumps(output) for minion, output in outputs.items()}]}
+
+
+class JobOutputTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = SaltStackAPI('http://master', 'user', 'password', 'exchange-*')
+        self.job = {
+            'cmd': 'AddTenant',
+            'command': 'AddTenant.ps1',
+            'jid': '20160101000000000001',
+            'minions': ['exchange-1', 'exchange-2', 'exchange-3'],
+            'submitted': time.time(),
+        }
+
+    def get_job_output(self, response):
+        with patch.object(SaltStackAPI, 'request', lambda *args, **kwargs: response):
+            return self.api.get_job_output(self.job)
+
+    def test_output_of_first_active_minion_is_returned_without_waiting_for_others(self):
+        response = job_output(**{
+            'exchange-1': {'Status': 'Inactive'},
+            'exchange-2': {'Status': 'OK', 'Output': 'done'},
+        })
+        self.assertEqual(self.get_job_output(response), 'done')
+
+    def test_job_is_running_while_only_inactive_minions_have_returned(self):
+        response = job_output(**{'exchange-1': {'Status': 'Inactive'}})
+        self.assertIsNone(self.get_job_output(response))
+
+
+class PollJobTest(TestCase):
+    def setUp(self):
+        self.tenant = ExchangeTenantFactory()
+        self.backend = MagicMock()
+        patcher = patch.object(ExchangeTenant, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.job = {'cmd': 'AddTenant', 'jid': '20160101000000000001', 'submitted': time.time()}
+
+    def poll(self):
+        return poll_job(self.job, 'exchange.ExchangeTenant', self.tenant.uuid.hex, 'tenants', 'create')
+
+    def test_failed_command_is_saved_as_error_of_object(self):
+        self.backend.tenants.collect.side_effect = SaltStackBackendError('Tenant already exists')
+
+        self.assertRaises(SaltStackBackendError, self.poll)
+        self.tenant.refresh_from_db()
+        self.assertEqual(self.tenant.error_message, 'Tenant already exists')
+
+    def test_unfinished_job_fails_after_timeout(self):
+        self.job['submitted'] = time.time() - 120
+        self.backend.tenants.collect.return_value = None
+
+        with override_settings(NODECONDUCTOR_SALTSTACK={'JOB_TIMEOUT': 60}):
+            self.assertRaisesRegexp(SaltStackBackendError, 'has not finished in time', self.poll)
+        self.tenant.refresh_from_db()
+        self.assertIn(self.job['jid'], self.tenant.error_message)
+
+    def test_finished_job_returns_method_result(self):
+        self.backend.tenants.collect.return_value = 'done'
+
+        self.assertEqual(self.poll(), 'done')
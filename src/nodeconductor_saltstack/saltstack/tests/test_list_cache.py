@@ -0,0 +1,111 @@
+import json
+import re
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+
+from nodeconductor_saltstack.exchange.backend import DistributionGroupAPI, UserAPI
+from nodeconductor_saltstack.saltstack.backend import SaltStackAPI, SaltStackBackendError
+
+
+class Tenant(object):
+    def __init__(self, backend_id):
+        self.backend_id = backend_id
+        self.domain = '%s.example.com' % backend_id
+
+
+class Backend(object):
+    def __init__(self, tenant):
+        self.tenant = tenant
+
+
+class FakeSaltAPI(object):
+    """ Return a single group member for any command, fail commands for user 'missing' """
+
+    def __init__(self):
+        self.commands = []
+
+    def request(self, api, url, data=None, method='POST'):
+        command = data['arg']
+        self.commands.append(re.search(r'(\w+)\.ps1', command).group(1))
+        if 'missing' in command:
+            output = {'Status': 'Error', 'Message': 'User is not found'}
+        else:
+            output = {'Status': 'OK', 'Output': [{'Guid': 'user', 'EmailAddress': 'alice@example.com'}]}
+        return {'return': [{'exchange-1': json.dumps(output)}]}
+
+
+class ListCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.salt = FakeSaltAPI()
+        patcher = patch.object(SaltStackAPI, 'request', self.salt.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = self.create_api(UserAPI, 'tenant')
+        self.groups = self.create_api(DistributionGroupAPI, 'tenant')
+
+    def create_api(self, api_class, tenant_id):
+        api = api_class('http://master', 'user', 'password', 'exchange-*')
+        api.backend = Backend(Tenant(tenant_id))
+        return api
+
+    def count(self, command):
+        return self.salt.commands.count(command)
+
+    def test_list_output_is_cached(self):
+        self.assertEqual(self.groups.list_members(id='group')[0].email, 'alice@example.com')
+        self.assertEqual(self.groups.list_members(id='group')[0].email, 'alice@example.com')
+        self.assertEqual(self.count('DgMemberList'), 1)
+
+        # arguments are part of cache key
+        self.groups.list_members(id='other')
+        self.assertEqual(self.count('DgMemberList'), 2)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'LIST_CACHE_TTL': 0})
+    def test_list_output_is_not_cached_if_cache_is_disabled(self):
+        self.groups.list_members(id='group')
+        self.groups.list_members(id='group')
+        self.assertEqual(self.count('DgMemberList'), 2)
+
+    def test_invalidation_bumps_generation_of_api_and_tenant(self):
+        key = self.groups.get_cache_key('DgMemberList', Id='group')
+        self.groups.invalidate_cache()
+
+        self.assertEqual(cache.get('saltstack-list-generation:%s' % self.groups.cache_scope), 1)
+        self.assertNotEqual(self.groups.get_cache_key('DgMemberList', Id='group'), key)
+        other_tenant = self.create_api(DistributionGroupAPI, 'other')
+        self.assertIsNone(cache.get('saltstack-list-generation:%s' % other_tenant.cache_scope))
+
+    def test_write_drops_lists_of_the_same_api(self):
+        self.users.list()
+        self.users.delete(id='user')
+        self.users.list()
+        self.assertEqual(self.count('UserList'), 2)
+
+    def test_failed_write_drops_lists(self):
+        self.users.list()
+        self.assertRaises(SaltStackBackendError, lambda: self.users.delete(id='missing'))
+        self.users.list()
+        self.assertEqual(self.count('UserList'), 2)
+
+    def test_write_of_users_drops_group_members_of_the_same_tenant(self):
+        other_groups = self.create_api(DistributionGroupAPI, 'other')
+        for groups in (self.groups, other_groups):
+            groups.list_members(id='group')
+            groups.list_delivery_members(id='group')
+
+        self.users.delete(id='user')
+        for groups in (self.groups, other_groups):
+            groups.list_members(id='group')
+            groups.list_delivery_members(id='group')
+
+        self.assertEqual(self.count('DgMemberList'), 3)
+        self.assertEqual(self.count('DgDeliveryList'), 3)
+
+    def test_write_of_groups_keeps_users_lists(self):
+        self.users.list()
+        self.groups.delete(id='group')
+        self.users.list()
+        self.assertEqual(self.count('UserList'), 1)
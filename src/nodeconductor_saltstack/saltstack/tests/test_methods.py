@@ -0,0 +1,80 @@
+from django.test import TestCase
+from mock import patch
+
+from nodeconductor_saltstack.saltstack import backend
+from nodeconductor_saltstack.saltstack.backend import SaltStackBaseAPI
+
+
+def make_api_class(base=SaltStackBaseAPI):
+
+    class ContactAPI(base):
+
+        class Methods:
+            list = dict(
+                name='ContactList',
+                many=True,
+                output={
+                    'Guid': 'id',
+                    'Email': 'email',
+                },
+            )
+
+            create = dict(
+                name='AddContact',
+                input={
+                    'email': 'Email',
+                    'name': 'Name',
+                },
+                defaults={
+                    'name': '{email}',
+                },
+                output={
+                    'Guid': 'id',
+                    'DisplayName': 'name',
+                },
+            )
+
+    return ContactAPI
+
+
+class CompileMethodsTest(TestCase):
+    def test_methods_are_compiled_once_per_class(self):
+        api_class = make_api_class()
+        with patch.object(backend, 'APIMethod', wraps=backend.APIMethod) as api_method:
+            first = api_class('http://master', 'user', 'password', 'exchange-*')
+            second = api_class('http://master', 'user', 'password', 'exchange-*')
+
+        self.assertEqual(api_method.call_count, 2)  # list and create
+        self.assertIs(first.methods, second.methods)
+        self.assertIs(first.entity_class, second.entity_class)
+
+    def test_subclass_is_compiled_with_its_own_methods(self):
+        api_class = make_api_class()
+        api_class('http://master', 'user', 'password', 'exchange-*')
+
+        class UserAPI(api_class):
+
+            class Methods:
+                list = dict(
+                    name='UserList',
+                    many=True,
+                    output={
+                        'Guid': 'id',
+                        'UserPrincipalName': 'email',
+                    },
+                )
+
+        api = UserAPI('http://master', 'user', 'password', 'exchange-*')
+        self.assertEqual(api.methods['list'].func, 'UserList')
+        self.assertEqual(api_class.methods['list'].func, 'ContactList')
+
+    def test_entity_class_has_fields_of_all_outputs(self):
+        api = make_api_class()('http://master', 'user', 'password', 'exchange-*')
+        self.assertEqual(api.entity_class.__name__, 'Contact')
+        self.assertEqual(api.entity_class.__slots__, ('email', 'id', 'name'))
+
+    def test_cmd_args_are_built_from_compiled_defaults(self):
+        api = make_api_class()('http://master', 'user', 'password', 'exchange-*')
+        api.backend = None
+        self.assertEqual(api.prepare_method('create', email='alice@example.com'),
+                         ('AddContact', {'Email': 'alice@example.com', 'Name': 'alice@example.com'}))
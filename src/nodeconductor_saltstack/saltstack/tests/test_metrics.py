@@ -0,0 +1,70 @@
+from django.core.cache import cache
+from django.test import TestCase
+from mock import MagicMock
+
+from nodeconductor_saltstack.saltstack.backend import SaltStackBackendError
+from nodeconductor_saltstack.saltstack.metrics import MetricsAggregator
+
+
+class OtherProcessMetrics(MetricsAggregator):
+    process_key = 'saltstack-metrics:other'
+
+
+class MetricsAggregatorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.metrics = MetricsAggregator()
+        self.api = MagicMock(api_url='http://master', target='exchange-*', MAPPING={'list_users': 'UserList'})
+
+    def measure(self, cmd, request_size=100, response_size=1000, fail=False):
+        with self.metrics.measure(self.api, cmd):
+            self.metrics.track_request(request_size, response_size)
+            if fail:
+                raise SaltStackBackendError('Failed')
+
+    def test_commands_are_aggregated_by_mapped_name_and_outcome(self):
+        self.measure('list_users')
+        self.measure('list_users')
+        self.assertRaises(SaltStackBackendError, self.measure, 'list_users', fail=True)
+
+        series = {item['outcome']: self.metrics.to_dict(item) for item in self.metrics.collect()}
+
+        self.assertEqual(series['ok']['command'], 'UserList')
+        self.assertEqual(series['ok']['count'], 2)
+        self.assertEqual(series['ok']['request_size_sum'], 200)
+        self.assertEqual(series['ok']['response_size_sum'], 2000)
+        self.assertEqual(series['error']['count'], 1)
+
+    def test_batch_is_split_between_commands(self):
+        with self.metrics.measure(self.api, ['AddUser', 'AddUser']) as measurement:
+            self.metrics.track_request(200, 400)
+            measurement.outcomes = ['ok', 'error']
+
+        series = {item['outcome']: item for item in self.metrics.collect()}
+
+        self.assertEqual(series['ok']['request_size'].sum, 100)
+        self.assertEqual(series['error']['response_size'].sum, 200)
+
+    def test_series_of_all_processes_are_merged(self):
+        other = OtherProcessMetrics()
+        self.metrics.record('http://master', 'exchange-*', 'UserList', 'ok', 0.2)
+        other.record('http://master', 'exchange-*', 'UserList', 'ok', 0.3)
+        other.record('http://other', 'exchange-*', 'UserList', 'ok', 0.3)
+        with other.lock:
+            other.flush()
+
+        series = self.metrics.collect(master='http://master')
+
+        self.assertEqual(len(series), 1)
+        self.assertEqual(series[0]['duration'].count, 2)
+
+    def test_prometheus_exposition(self):
+        self.metrics.record('http://master', 'exchange-*', 'UserList', 'ok', 0.2, 100, 1000)
+
+        text = self.metrics.to_prometheus(self.metrics.collect())
+
+        labels = 'master="http://master",target="exchange-*",command="UserList",outcome="ok"'
+        self.assertIn('# TYPE saltstack_command_duration_seconds histogram', text)
+        self.assertIn('saltstack_command_duration_seconds_bucket{%s,le="0.25"} 1' % labels, text)
+        self.assertIn('saltstack_command_duration_seconds_bucket{%s,le="0.1"} 0' % labels, text)
+        self.assertIn('saltstack_command_response_bytes_count{%s} 1' % labels, text)
@@ -0,0 +1,115 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+
+from nodeconductor_saltstack.saltstack.backend import (
+    MinionSelector, MinionUnavailableError, SaltStackAPI, minion_selector)
+
+
+def salt_response(request_data):
+    """ Emulate salt-api: exchange-1 is down, exchange-2 and exchange-3 are alive """
+    alive = ['exchange-2', 'exchange-3']
+    if request_data['fun'] == 'test.ping':
+        return {'return': [dict({minion: True for minion in alive}, **{'exchange-1': False})]}
+    output = json.dumps({'Status': 'OK', 'Output': {'Minion': request_data['tgt']}})
+    return {'return': [{request_data['tgt']: output} if request_data['tgt'] in alive else {}]}
+
+
+class MinionSelectorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = SaltStackAPI('http://master', 'user', 'password', 'exchange-*')
+        self.selector = MinionSelector()
+
+    @patch.object(SaltStackAPI, 'request', lambda self, url, data: salt_response(data))
+    def test_only_responding_minions_are_selected(self):
+        self.assertEqual(self.selector.get_minions(self.api), ['exchange-2', 'exchange-3'])
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'round_robin'})
+    @patch.object(SaltStackAPI, 'request', lambda self, url, data: salt_response(data))
+    def test_round_robin_takes_minions_in_turn(self):
+        minions = [self.selector.select(self.api) for _ in range(4)]
+
+        self.assertEqual(set(minions[:2]), {'exchange-2', 'exchange-3'})
+        self.assertEqual(minions[:2], minions[2:])
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'least_outstanding'})
+    @patch.object(SaltStackAPI, 'request', lambda self, url, data: salt_response(data))
+    def test_least_outstanding_skips_busy_minion(self):
+        with self.selector.track(self.api, 'exchange-2'):
+            minions = {self.selector.select(self.api) for _ in range(4)}
+
+        self.assertEqual(minions, {'exchange-3'})
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'round_robin'})
+    def test_command_is_repeated_on_another_minion(self):
+        requests = []
+
+        def request(api, url, data):
+            requests.append(data)
+            if data['fun'] == 'test.ping':
+                return {'return': [{'exchange-1': True, 'exchange-2': True}]}
+            return salt_response(data)
+
+        with patch.object(SaltStackAPI, 'request', request):
+            outputs = {self.api.run_cmd('UserList', TenantName='tenant')['Minion'] for _ in range(3)}
+
+        self.assertEqual(outputs, {'exchange-2'})
+        # silent minion is excluded after the first failure
+        self.assertEqual([data['tgt'] for data in requests].count('exchange-1'), 1)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'round_robin'})
+    def test_error_is_raised_if_no_minion_responds(self):
+        def request(api, url, data):
+            if data['fun'] == 'test.ping':
+                return {'return': [{'exchange-1': True}]}
+            return {'return': [{}]}
+
+        with patch.object(SaltStackAPI, 'request', request):
+            self.assertRaises(MinionUnavailableError, self.api.run_cmd, 'UserList', TenantName='tenant')
+
+
+    def run_on_silent_minion(self, cmd, response, **kwargs):
+        """ Run command while exchange-1 is selected first and gives response, return targets of sent commands """
+        requests = []
+
+        def request(api, url, data):
+            requests.append(data['tgt'])
+            if data['tgt'] == 'exchange-1':
+                return {'return': [response]}
+            return salt_response(data)
+
+        def select(api, exclude=()):
+            for minion in ('exchange-1', 'exchange-2'):
+                if minion not in exclude:
+                    return minion
+
+        with patch.object(SaltStackAPI, 'request', request), patch.object(minion_selector, 'select', select):
+            try:
+                self.api.run_cmd(cmd, **kwargs)
+            except MinionUnavailableError as e:
+                requests.append(e)
+        return requests
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'round_robin'})
+    def test_received_write_is_not_repeated_on_another_minion(self):
+        requests = self.run_on_silent_minion(
+            'AddUser', {'exchange-1': 'Minion did not return. [No response]'}, UserName='alice')
+
+        self.assertEqual(requests[0], 'exchange-1')
+        self.assertIsInstance(requests[1], MinionUnavailableError)
+        self.assertTrue(requests[1].accepted)
+        self.assertEqual(len(requests), 2)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'round_robin'})
+    def test_not_received_write_is_repeated_on_another_minion(self):
+        requests = self.run_on_silent_minion('AddUser', {}, UserName='alice')
+        self.assertEqual(requests, ['exchange-1', 'exchange-2'])
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'TARGET_SELECTION': 'round_robin'})
+    def test_received_read_is_repeated_on_another_minion(self):
+        requests = self.run_on_silent_minion(
+            'UserList', {'exchange-1': False}, repeatable=True, TenantName='tenant')
+        self.assertEqual(requests, ['exchange-1', 'exchange-2'])
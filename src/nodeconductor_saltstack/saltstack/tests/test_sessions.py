@@ -0,0 +1,39 @@
+from django.test import TestCase, override_settings
+from mock import patch
+
+from nodeconductor_saltstack.saltstack.backend import SessionPool
+
+
+class SessionPoolTest(TestCase):
+    def setUp(self):
+        self.pool = SessionPool()
+
+    def test_session_is_reused_for_the_same_master(self):
+        session = self.pool.get('http://master')
+
+        self.assertIs(self.pool.get('http://master'), session)
+        self.assertIsNot(self.pool.get('http://other-master'), session)
+
+    def test_commands_which_reached_master_are_not_retried(self):
+        with override_settings(NODECONDUCTOR_SALTSTACK={'MAX_RETRIES': 3}):
+            session = self.pool.get('http://master')
+
+        retry = session.get_adapter('http://master').max_retries
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(retry.read, 0)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'POOL_IDLE_TIMEOUT': 60})
+    def test_idle_session_is_closed(self):
+        with patch('nodeconductor_saltstack.saltstack.backend.time.time', return_value=1000):
+            session = self.pool.get('http://master')
+
+        with patch.object(session, 'close') as close, \
+                patch('nodeconductor_saltstack.saltstack.backend.time.time', return_value=1061):
+            self.assertIsNot(self.pool.get('http://master'), session)
+        close.assert_called_once_with()
+
+    def test_forked_process_does_not_share_sessions(self):
+        session = self.pool.get('http://master')
+
+        with patch('nodeconductor_saltstack.saltstack.backend.os.getpid', return_value=-1):
+            self.assertIsNot(self.pool.get('http://master'), session)
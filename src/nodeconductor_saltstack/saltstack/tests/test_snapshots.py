@@ -0,0 +1,120 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+
+from nodeconductor_saltstack.saltstack import backend
+from nodeconductor_saltstack.saltstack.backend import SaltStackAPI, SaltStackBaseAPI, snapshot_cache
+
+
+class ContactAPI(SaltStackBaseAPI):
+
+    class Methods:
+        list = dict(
+            name='ContactList',
+            many=True,
+            output={
+                'Guid': 'id',
+                'EmailAddress': 'email',
+                'DisplayName': 'name',
+            },
+        )
+
+        delete = dict(
+            name='DelContact',
+            input={
+                'id': 'Id',
+            },
+        )
+
+
+class Backend(object):
+    tenant = None
+
+
+class FakeSaltAPI(object):
+
+    def __init__(self):
+        self.contacts = [
+            {'Guid': 'alice', 'EmailAddress': 'alice@example.com', 'DisplayName': 'Alice'},
+            {'Guid': 'bob', 'EmailAddress': 'bob@example.com', 'DisplayName': 'Bob'},
+            {'Guid': 'carol', 'EmailAddress': 'carol@example.com', 'DisplayName': 'Bob'},
+        ]
+        self.requests = 0
+
+    def request(self, api, url, data=None, method='POST'):
+        self.requests += 1
+        output = self.contacts if 'ContactList' in data['arg'] else []
+        return {'return': [{'exchange-1': json.dumps({'Status': 'OK', 'Output': output})}]}
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot_cache.clear()
+        self.api = self.create_api()
+        self.salt = FakeSaltAPI()
+        patcher = patch.object(SaltStackAPI, 'request', self.salt.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_api(self, target='exchange-*'):
+        api = ContactAPI('http://master', 'user', 'password', target)
+        api.backend = Backend()
+        return api
+
+    def test_findall_uses_index_and_checks_all_attributes(self):
+        self.assertEqual([c.id for c in self.api.findall(email='bob@example.com')], ['bob'])
+        self.assertEqual(sorted(c.id for c in self.api.findall(name='Bob')), ['bob', 'carol'])
+        self.assertEqual([c.id for c in self.api.findall(name='Bob', email='carol@example.com')], ['carol'])
+        self.assertEqual(list(self.api.findall(name='Alice', email='bob@example.com')), [])
+
+    def test_get_returns_object_or_none(self):
+        self.assertEqual(self.api.get('alice').email, 'alice@example.com')
+        self.assertIsNone(self.api.get('missing'))
+
+    def test_get_many_skips_missing_objects(self):
+        contacts = self.api.get_many(['alice', 'carol', 'missing'])
+        self.assertEqual(sorted(contacts), ['alice', 'carol'])
+        self.assertEqual(contacts['carol'].email, 'carol@example.com')
+
+    def test_snapshot_is_reused_by_lookups_and_api_instances(self):
+        with patch.object(backend, 'Snapshot', wraps=backend.Snapshot) as snapshot:
+            self.api.get('alice')
+            self.api.get_many(['bob'])
+            list(self.create_api().findall(email='carol@example.com'))
+
+        self.assertEqual(snapshot.call_count, 1)
+        self.assertEqual(self.salt.requests, 1)
+
+    def test_snapshot_is_rebuilt_once_lists_are_invalidated(self):
+        self.assertEqual(self.api.get('alice').name, 'Alice')
+        self.salt.contacts[0]['DisplayName'] = 'Alice Lebowski'
+        self.assertEqual(self.api.get('alice').name, 'Alice')
+
+        self.api.delete(id='bob')
+        self.assertEqual(self.api.get('alice').name, 'Alice Lebowski')
+
+    def test_snapshots_of_different_targets_are_separate(self):
+        self.api.get('alice')
+        self.create_api('sharepoint-*').get('alice')
+        self.assertEqual(self.salt.requests, 2)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'SNAPSHOT_CACHE_SIZE': 1})
+    def test_least_recently_used_snapshot_is_evicted(self):
+        other_api = self.create_api('sharepoint-*')
+        with patch.object(backend, 'Snapshot', wraps=backend.Snapshot) as snapshot:
+            self.api.get('alice')
+            other_api.get('alice')
+            self.api.get('alice')
+
+        self.assertEqual(snapshot.call_count, 3)
+        # lists are still cached in Django cache
+        self.assertEqual(self.salt.requests, 2)
+
+    @override_settings(NODECONDUCTOR_SALTSTACK={'LIST_CACHE_TTL': 0})
+    def test_snapshot_is_not_kept_if_list_cache_is_disabled(self):
+        self.api.get('alice')
+        self.api.get('alice')
+        self.assertEqual(self.salt.requests, 2)
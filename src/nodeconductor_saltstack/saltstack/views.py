@@ -1,6 +1,8 @@
 from functools import wraps
 from django.db import IntegrityError, transaction
-from rest_framework import exceptions, filters, permissions, viewsets
+from rest_framework import exceptions, filters, permissions, renderers, viewsets
+from rest_framework.decorators import detail_route
+from rest_framework.response import Response
 
 from nodeconductor.core.exceptions import IncorrectStateException
 from nodeconductor.structure.filters import GenericRoleFilter
@@ -8,6 +10,8 @@ from nodeconductor.structure.models import Resource
 from nodeconductor.structure import views as structure_views
 
 from .backend import SaltStackBackendError
+from .log import buffer_events
+from .metrics import metrics
 from . import models, serializers
 
 
@@ -21,16 +25,59 @@ def track_exceptions(view_fn):
     return wrapped
 
 
+class PrometheusRenderer(renderers.BaseRenderer):
+    """ Render salt-api metrics in Prometheus text exposition format """
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, list):  # error details
+            return '%s\n' % data
+        return metrics.to_prometheus(data)
+
+
 class SaltStackServiceViewSet(structure_views.BaseServiceViewSet):
     queryset = models.SaltStackService.objects.all()
     serializer_class = serializers.ServiceSerializer
 
+    @detail_route(methods=['get'], permission_classes=[permissions.IsAdminUser],
+                  renderer_classes=[renderers.JSONRenderer, PrometheusRenderer])
+    def metrics(self, request, pk=None, **kwargs):
+        """ Latency, payload sizes and outcomes of salt-api commands sent to SaltStack master of the service,
+            most time consuming commands go first. Use ?format=prometheus to get them as Prometheus metrics.
+        """
+        service = self.get_object()
+        series = metrics.collect(master=service.settings.backend_url.rstrip('/'))
+        if request.accepted_renderer.format == PrometheusRenderer.format:
+            return Response(series)
+        return Response([metrics.to_dict(item) for item in series])
+
 
 class SaltStackServiceProjectLinkViewSet(structure_views.BaseServiceProjectLinkViewSet):
     queryset = models.SaltStackServiceProjectLink.objects.all()
     serializer_class = serializers.ServiceProjectLinkSerializer
 
 
+class TenantSearchMixin(object):
+    """ Ranked and paginated search over directory objects of tenant, see SearchTrigram """
+
+    @detail_route(methods=['get'])
+    def search(self, request, pk=None, **kwargs):
+        tenant = self.get_object()
+        serializer = serializers.SearchQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        query = serializer.validated_data['query']
+        ranking = models.SearchTrigram.search(tenant, **serializer.validated_data)
+        page = self.paginate_queryset(ranking)
+        results = models.SearchTrigram.get_results(query, page if page is not None else ranking)
+        data = serializers.SearchResultSerializer(results, many=True, context={'request': request}).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
 class BasePropertyViewSet(viewsets.ModelViewSet):
     queryset = NotImplemented
     serializer_class = NotImplemented
@@ -39,6 +86,14 @@ class BasePropertyViewSet(viewsets.ModelViewSet):
     filter_backends = (GenericRoleFilter, filters.DjangoFilterBackend,)
     backend_name = NotImplemented
 
+    def get_queryset(self):
+        queryset = super(BasePropertyViewSet, self).get_queryset()
+        # serializers declare related objects which are required for representation
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, 'eager_load'):
+            queryset = serializer_class.eager_load(queryset)
+        return queryset
+
     def get_backend(self, tenant):
         backend = tenant.get_backend()
         return getattr(backend, self.backend_name)
@@ -59,6 +114,7 @@ class BasePropertyViewSet(viewsets.ModelViewSet):
         pass
 
     @track_exceptions
+    @buffer_events
     def perform_create(self, serializer):
         tenant = serializer.validated_data['tenant']
         backend = self.get_backend(tenant)
@@ -77,6 +133,7 @@ class BasePropertyViewSet(viewsets.ModelViewSet):
             self.post_create(obj, serializer, backend_obj)
 
     @track_exceptions
+    @buffer_events
     def perform_update(self, serializer):
         obj = self.get_object()
         backend = self.get_backend(obj.tenant)
@@ -92,6 +149,7 @@ class BasePropertyViewSet(viewsets.ModelViewSet):
             self.post_update(obj, serializer)
 
     @track_exceptions
+    @buffer_events
     def perform_destroy(self, obj):
         backend = self.get_backend(obj.tenant)
         backend.delete(id=obj.backend_id)
@@ -19,6 +19,7 @@ class SharepointExtension(NodeConductorExtension):
             'sharepoint-sync-tenants': {
                 'task': 'nodeconductor.sharepoint.sync_tenants',
                 'schedule': timedelta(minutes=10),
-                'args': ()
+                'args': (),
+                'kwargs': {'period': timedelta(minutes=10).total_seconds()},
             },
         }
@@ -74,6 +74,7 @@ class User(SaltStackProperty):
     personal_site_collection = models.ForeignKey('SiteCollection', related_name='+', blank=True, null=True)
 
     tracker = FieldTracker()
+    search_fields = ('name', 'username', 'email', 'first_name', 'last_name')
 
     class Defaults(object):
         admin = {
@@ -83,6 +84,10 @@ class User(SaltStackProperty):
             'last_name': 'Admin',
         }
 
+    @classmethod
+    def get_url_name(cls):
+        return 'sharepoint-users'
+
     def init_personal_site_collection(self, url):
         self.personal_site_collection = SiteCollection.objects.create(
             name=SiteCollection.Defaults.personal_site_collection['name'],
@@ -6,6 +6,7 @@ from nodeconductor.structure import serializers as structure_serializers
 
 from ..saltstack.models import SaltStackServiceProjectLink
 from ..saltstack.serializers import PhoneValidationMixin
+from ..saltstack.quotas import get_quota_snapshot
 from .models import SharepointTenant, Template, User, SiteCollection
 
 
@@ -34,6 +35,10 @@ class SiteCollectionSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ('uuid', 'access_url', 'type')
         protected_fields = ('template',)
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related('template', 'user').prefetch_related('quotas')
+
     def validate_user(self, user):
         if user.tenant.state != SharepointTenant.States.ONLINE:
             raise serializers.ValidationError(
@@ -44,7 +49,7 @@ class SiteCollectionSerializer(serializers.HyperlinkedModelSerializer):
         # TODO: Check that template belong to the same service settings.
         user = attrs['user']
         tenant = user.tenant
-        storage_quota = tenant.quotas.get(name=tenant.Quotas.storage)
+        storage_quota = get_quota_snapshot(self.context).get(tenant, tenant.Quotas.storage)
         if storage_quota.is_exceeded(delta=attrs['storage']):
             max_storage = storage_quota.limit - storage_quota.usage
             raise serializers.ValidationError(
@@ -80,10 +85,18 @@ class UserSerializer(AugmentedSerializerMixin, PhoneValidationMixin, serializers
             'tenant': ('uuid', 'domain')
         }
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.select_related(
+            'tenant',
+            'personal_site_collection__template',
+            'personal_site_collection__user',
+        ).prefetch_related('personal_site_collection__quotas')
+
     def validate_tenant(self, tenant):
         if tenant.state != SharepointTenant.States.ONLINE:
             raise serializers.ValidationError('It is impossible to create site collection if tenant is not online.')
-        storage_quota = tenant.quotas.get(name=SharepointTenant.Quotas.storage)
+        storage_quota = get_quota_snapshot(self.context).get(tenant, SharepointTenant.Quotas.storage)
         if storage_quota.is_exceeded(delta=SiteCollection.Defaults.personal_site_collection['storage']):
             raise serializers.ValidationError('Tenant has not enough space for user creation.')
         return tenant
@@ -164,12 +177,13 @@ class TenantSerializer(PhoneValidationMixin, structure_serializers.PublishableRe
 
         if not self.instance:
             spl = attrs.get('service_project_link')
+            snapshot = get_quota_snapshot(self.context)
 
-            sharepoint_tenant_number_quota = spl.quotas.get(name=spl.Quotas.sharepoint_tenant_number)
+            sharepoint_tenant_number_quota = snapshot.get(spl, spl.Quotas.sharepoint_tenant_number)
             if sharepoint_tenant_number_quota.is_exceeded(delta=1):
                 raise serializers.ValidationError("You have reached the maximum number of allowed tenants.")
 
-            spl_storage_quota = spl.quotas.get(name=spl.Quotas.sharepoint_storage)
+            spl_storage_quota = snapshot.get(spl, spl.Quotas.sharepoint_storage)
             if spl_storage_quota.is_exceeded(delta=attrs.get('storage')):
                 storage_left = spl_storage_quota.limit - spl_storage_quota.usage
                 raise serializers.ValidationError({
@@ -212,14 +226,17 @@ class TenantQuotaSerializer(serializers.Serializer):
 
     def validate_storage(self, value):
         tenant = self.context['tenant']
-        old_quota = tenant.quotas.get(name=SharepointTenant.Quotas.storage)
+        spl = tenant.service_project_link
+        snapshot = get_quota_snapshot(self.context)
+        snapshot.load(tenant, spl)
+
+        old_quota = snapshot.get(tenant, SharepointTenant.Quotas.storage)
         if value < old_quota.usage:
             raise serializers.ValidationError('New storage quota limit cannot be lower than current usage.')
 
         diff = value - old_quota.limit
         if diff > 0:
-            spl = tenant.service_project_link
-            spl_storage_quota = spl.quotas.get(name=spl.Quotas.sharepoint_storage)
+            spl_storage_quota = snapshot.get(spl, spl.Quotas.sharepoint_storage)
             if spl_storage_quota.is_exceeded(delta=diff):
                 storage_left = spl_storage_quota.limit - spl_storage_quota.usage
                 raise serializers.ValidationError(
@@ -235,11 +252,14 @@ class SiteCollectionQuotaSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         site_collection = self.context['site_collection']
-        site_collection_quota = site_collection.quotas.get(name=SiteCollection.Quotas.storage)
+        tenant = site_collection.user.tenant
+        snapshot = get_quota_snapshot(self.context)
+        snapshot.load(site_collection, tenant)
+        site_collection_quota = snapshot.get(site_collection, SiteCollection.Quotas.storage)
 
         old_limit = site_collection_quota.limit
         new_limit = attrs['storage']
-        storage_quota = site_collection.user.tenant.quotas.get(name=SharepointTenant.Quotas.storage)
+        storage_quota = snapshot.get(tenant, SharepointTenant.Quotas.storage)
         if new_limit > old_limit and storage_quota.is_exceeded(delta=new_limit-old_limit):
             max_storage = storage_quota.limit - storage_quota.usage + old_limit
             raise serializers.ValidationError(
@@ -1,19 +1,34 @@
 import binascii
+import logging
 import os
 
-from celery import shared_task
+from celery import chain, shared_task
 from django.utils import timezone
 
-from nodeconductor.core.tasks import save_error_message, transition
+from nodeconductor.core.tasks import save_error_message, transition, throttle
 
 from .models import SharepointTenant, SiteCollection, Template, User
 from ..saltstack.models import SaltStackServiceProjectLink
+from ..saltstack.tasks import poll_job, store_error_message
+from ..saltstack.settings import get_setting
+from ..saltstack.sync import reconcile_properties, schedule_tenants_sync
 from ..saltstack.utils import sms_user_password
 
 
+logger = logging.getLogger(__name__)
+
+
 @shared_task(name='nodeconductor.sharepoint.provision')
-def provision(tenant_uuid, **kwargs):
-    provision_tenant.si(tenant_uuid, **kwargs).apply_async(
+def provision(tenant_uuid, site_name=None, site_description=None, template_uuid=None, phone=None, **kwargs):
+    chain(
+        provision_tenant.si(tenant_uuid, **kwargs),
+        poll_job.s('sharepoint.SharepointTenant', tenant_uuid, 'tenants', 'create'),
+        create_admin.s(tenant_uuid, site_name=site_name, site_description=site_description,
+                       template_uuid=template_uuid, phone=phone),
+        poll_job.s('sharepoint.SharepointTenant', tenant_uuid, 'site_collections', 'create_main'),
+        init_site_collections.s(tenant_uuid, site_name=site_name, site_description=site_description,
+                                template_uuid=template_uuid),
+    ).apply_async(
         link=set_online.si(tenant_uuid),
         link_error=set_erred.si(tenant_uuid)
     )
@@ -43,75 +58,89 @@ def schedule_deletion(tenant_uuid):
     backend.tenants.delete()
 
 
-@shared_task(is_heavy_task=True)
+@shared_task
 @transition(SharepointTenant, 'begin_provisioning')
 @save_error_message
-def provision_tenant(tenant_uuid, transition_entity=None,
-                     site_name=None, site_description=None, template_uuid=None, phone=None, notify=None, **kwargs):
-    # Create tenant itself
+def provision_tenant(tenant_uuid, transition_entity=None, **kwargs):
     tenant = transition_entity
     backend = tenant.get_backend()
     # generate a random name to be used as unique tenant id in MS Exchange
     # Example of format: NC_28052BF28A
     tenant_backend_id = 'NC_%s' % binascii.b2a_hex(os.urandom(5)).upper()
-
-    backend.tenants.create(
-        backend_id=tenant_backend_id,
-        domain=tenant.domain,
-    )
     tenant.backend_id = tenant_backend_id
     tenant.save()
 
-    # Create admin user
-    backend = tenant.get_backend()  # get backend again to mark admin user as available
-    admin_data = dict(email='admin@{}'.format(tenant.domain), **User.Defaults.admin)
-    backend_admin = backend.users.create(**admin_data)
-
-    admin = User.objects.create(
-        tenant=tenant,
-        backend_id=backend_admin.id,
-        admin_id=backend_admin.admin_id,
-        password=backend_admin.password,
-        phone=phone or '',  # hotfix - phone cannot be None
-        **admin_data
-    )
-    tenant.admin = admin
-    admin.init_personal_site_collection(backend_admin.personal_site_collection_url)
-    sms_user_password(admin)
+    # Start creation of tenant itself, it is finished by create_admin task
+    return backend.tenants.submit('create', backend_id=tenant_backend_id, domain=tenant.domain)
+
+
+@shared_task(is_heavy_task=True)
+def create_admin(backend_tenant, tenant_uuid, site_name=None, site_description=None, template_uuid=None, phone=None):
+    tenant = SharepointTenant.objects.get(uuid=tenant_uuid)
+    try:
+        backend = tenant.get_backend()
+        admin_data = dict(email='admin@{}'.format(tenant.domain), **User.Defaults.admin)
+        backend_admin = backend.users.create(**admin_data)
+
+        admin = User.objects.create(
+            tenant=tenant,
+            backend_id=backend_admin.id,
+            admin_id=backend_admin.admin_id,
+            password=backend_admin.password,
+            phone=phone or '',  # hotfix - phone cannot be None
+            **admin_data
+        )
+        tenant.admin = admin
+        admin.init_personal_site_collection(backend_admin.personal_site_collection_url)
+        sms_user_password(admin)
 
-    # Initialize default site collections
+        tenant.save()
+
+        # Start initialization of default site collections, it is finished by init_site_collections task
+        template = Template.objects.get(uuid=template_uuid)
+        return backend.site_collections.submit(
+            'create_main',
+            admin_id=admin.admin_id,
+            name=site_name,
+            description=site_description,
+            template_code=template.code,
+            storage=SiteCollection.Defaults.main_site_collection['storage'],
+        )
+    except Exception as e:
+        store_error_message(tenant, e)
+        raise
+
+
+@shared_task
+def init_site_collections(backend_collections_details, tenant_uuid,
+                          site_name=None, site_description=None, template_uuid=None):
+    tenant = SharepointTenant.objects.get(uuid=tenant_uuid)
+    admin = tenant.admin
     template = Template.objects.get(uuid=template_uuid)
-    backend_collections_details = backend.site_collections.create_main(
-        admin_id=admin.admin_id,
-        name=site_name,
-        description=site_description,
-        template_code=template.code,
-        storage=SiteCollection.Defaults.main_site_collection['storage'],
-    )
 
     main_sc = SiteCollection.objects.create(
         name=site_name,
         description=site_description,
         template=template,
-        access_url=backend_collections_details.main_site_collection_url,
+        access_url=backend_collections_details['main_site_collection_url'],
         user=admin,
         type=SiteCollection.Types.MAIN,
     )
-    storage = backend_collections_details.main_site_collection_storage
+    storage = backend_collections_details['main_site_collection_storage']
     main_sc.set_quota_limit(SiteCollection.Quotas.storage, storage)
     tenant.main_site_collection = main_sc
 
-    template_code = backend_collections_details.admin_site_collection_template_code
+    template_code = backend_collections_details['admin_site_collection_template_code']
     admin_sc = SiteCollection.objects.create(
         name=SiteCollection.Defaults.admin_site_collection['name'],
         description=SiteCollection.Defaults.admin_site_collection['description'],
-        access_url=backend_collections_details.admin_site_collection_url,
+        access_url=backend_collections_details['admin_site_collection_url'],
         user=admin,
         template=Template.objects.filter(
             code=template_code, settings=tenant.service_project_link.service.settings).first(),
         type=SiteCollection.Types.ADMIN,
     )
-    storage = backend_collections_details.admin_site_collection_storage
+    storage = backend_collections_details['admin_site_collection_storage']
     admin_sc.set_quota_limit(SiteCollection.Quotas.storage, storage)
     tenant.admin_site_collection = admin_sc
 
@@ -147,10 +176,9 @@ def sync_spl_quotas(spl_id):
 
 
 @shared_task(name='nodeconductor.sharepoint.sync_tenants')
-def sync_tenants():
+def sync_tenants(period=10 * 60):
     tenants = SharepointTenant.objects.filter(state=SharepointTenant.States.ONLINE)
-    for tenant in tenants:
-        sync_site_collection_quotas.delay([tenant.uuid.hex])
+    schedule_tenants_sync(tenants, sync_site_collection_quotas, period)
 
 
 @shared_task(name='nodeconductor.sharepoint.sync_site_collection_quotas')
@@ -164,7 +192,9 @@ def sync_site_collection_quotas(tenant_uuids):
 
     for tenant in tenants:
         backend = tenant.get_backend()
-        site_collections_data = backend.site_collections.list()
+        with throttle(key=tenant.service_project_link.service.settings.backend_url,
+                      concurrency=get_setting('SYNC_CONCURRENCY')):
+            site_collections_data = backend.site_collections.list()
         for sc in site_collections_data:
             registered_site_collection = SiteCollection.objects.filter(access_url=sc.url).first()
             if registered_site_collection:
@@ -175,25 +205,32 @@ def sync_site_collection_quotas(tenant_uuids):
 @shared_task(name='nodeconductor.sharepoint.sync_tenant_users', heavy_task=True)
 def sync_tenant_users(tenant_uuid):
     tenant = SharepointTenant.objects.get(uuid=tenant_uuid)
-    user_model_fields = set(User._meta.get_all_field_names())
+    fields = ('name', 'email', 'first_name', 'last_name', 'admin_id')
 
     backend = tenant.get_backend()
-    backend_users = backend.users.list()
-    backend_users_ids = set([user.id for user in backend_users])
-    db_users_ids = set(User.objects.filter(tenant=tenant).values_list('backend_id', flat=True))
-    added_users = [user for user in backend_users if user.id not in db_users_ids]
-    for user in added_users:
-        fields = user_model_fields & set(user.__dict__.keys())
-        new_user = {field: getattr(user, field) for field in fields}
-        new_user.update({
-            'backend_id': new_user.pop('id'),
-            'tenant': tenant
+    backend_users = []
+    incomplete_ids = []
+    for user in backend.users.list():
+        if not getattr(user, 'email', None):
+            # username can't be derived, such user is neither imported nor updated nor deleted
+            logger.warning('User %s of tenant %s has no email on backend', user.id, tenant_uuid)
+            incomplete_ids.append(user.id)
+            continue
+        # attributes absent in output are not compared, so DB values are kept for them
+        backend_user = {field: getattr(user, field) or '' for field in fields if hasattr(user, field)}
+        backend_user.update({
+            'backend_id': user.id,
+            'username': user.email.split('@')[0],
         })
-        if hasattr(user, 'email') and user.email:
-            new_user['username'] = user.email.split('@')[0]
-
-        User.objects.create(**new_user)
-
-    deleted_users = db_users_ids - backend_users_ids
-    if deleted_users:
-        User.objects.filter(tenant=tenant, name__in=deleted_users).delete()
+        if hasattr(user, 'password'):
+            backend_user['password'] = user.password or ''
+        backend_users.append(backend_user)
+
+    def before_delete(users):
+        # tenant is removed together with its admin user
+        return users.exclude(id=tenant.admin_id).exclude(backend_id__in=incomplete_ids)
+
+    report = reconcile_properties(
+        User, {'tenant': tenant}, backend_users, fields=fields + ('username',), before_delete=before_delete)
+    logger.info('Users of tenant %s have been synchronized: %s', tenant_uuid, report)
+    return report
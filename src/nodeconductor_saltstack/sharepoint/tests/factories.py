@@ -0,0 +1,51 @@
+import factory
+
+from nodeconductor_saltstack.exchange.tests.factories import ServiceProjectLinkFactory, ServiceSettingsFactory
+from nodeconductor_saltstack.sharepoint.models import SharepointTenant, SiteCollection, Template, User
+
+
+class SharepointTenantFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = SharepointTenant
+
+    name = factory.Sequence(lambda n: 'tenant-%s' % n)
+    service_project_link = factory.SubFactory(ServiceProjectLinkFactory)
+    domain = factory.Sequence(lambda n: 'domain-%s' % n)
+    state = SharepointTenant.States.ONLINE
+
+
+class TemplateFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = Template
+
+    settings = factory.SubFactory(ServiceSettingsFactory)
+    name = factory.Sequence(lambda n: 'template-%s' % n)
+    code = factory.Sequence(lambda n: 'STS#%s' % n)
+    backend_id = factory.Sequence(lambda n: 'template-%s' % n)
+
+
+class SharepointUserFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = User
+
+    tenant = factory.SubFactory(SharepointTenantFactory)
+    name = factory.Sequence(lambda n: 'user-%s' % n)
+    username = factory.Sequence(lambda n: 'user%s' % n)
+    email = factory.LazyAttribute(lambda user: '%s@%s' % (user.username, user.tenant.domain))
+    backend_id = factory.Sequence(lambda n: 'backend_id-%s' % n)
+    first_name = 'Alice'
+    last_name = 'Lebowski'
+    admin_id = factory.Sequence(lambda n: 'admin_id-%s' % n)
+    password = 'secret'
+
+
+class SiteCollectionFactory(factory.DjangoModelFactory):
+    class Meta(object):
+        model = SiteCollection
+
+    user = factory.SubFactory(SharepointUserFactory)
+    template = factory.SubFactory(TemplateFactory)
+    name = factory.Sequence(lambda n: 'site-collection-%s' % n)
+    description = 'Site collection'
+    backend_id = factory.Sequence(lambda n: 'http://example.com/sites/%s' % n)
+    access_url = factory.LazyAttribute(lambda site_collection: site_collection.backend_id)
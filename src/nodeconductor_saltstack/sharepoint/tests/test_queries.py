@@ -0,0 +1,45 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status, test
+from rest_framework.reverse import reverse
+
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor_saltstack.sharepoint.models import SiteCollection
+from nodeconductor_saltstack.sharepoint.tests.factories import (
+    SharepointTenantFactory, SharepointUserFactory, SiteCollectionFactory, TemplateFactory)
+
+
+class ListQueriesTest(test.APITransactionTestCase):
+    """ Number of queries of list endpoints should not depend on number of objects """
+
+    def setUp(self):
+        self.admin = structure_factories.UserFactory(is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.tenant = SharepointTenantFactory()
+        self.template = TemplateFactory(settings=self.tenant.service_project_link.service.settings)
+
+    def create_objects(self, count):
+        for _ in range(count):
+            user = SharepointUserFactory(tenant=self.tenant)
+            user.personal_site_collection = SiteCollectionFactory(
+                user=user, template=self.template, type=SiteCollection.Types.PERSONAL)
+            user.save()
+            SiteCollectionFactory(user=user, template=self.template)
+
+    def get_queries_count(self, url_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name), {'page_size': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def assert_queries_count_is_constant(self, url_name):
+        self.create_objects(2)
+        expected = self.get_queries_count(url_name)
+        self.create_objects(8)
+        self.assertEqual(self.get_queries_count(url_name), expected)
+
+    def test_users_list(self):
+        self.assert_queries_count_is_constant('sharepoint-users-list')
+
+    def test_site_collections_list(self):
+        self.assert_queries_count_is_constant('sharepoint-site-collections-list')
@@ -7,12 +7,13 @@ from nodeconductor_saltstack.saltstack.views import track_exceptions
 
 from . import models, serializers, filters
 from ..saltstack.backend import SaltStackBackendError
-from ..saltstack.views import BasePropertyViewSet
+from ..saltstack.views import BasePropertyViewSet, TenantSearchMixin
+from ..saltstack.quotas import get_quota_snapshot
 from ..saltstack.utils import sms_user_password
 from log import event_logger
 
 
-class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
+class TenantViewSet(TenantSearchMixin, structure_views.BaseOnlineResourceViewSet):
     queryset = models.SharepointTenant.objects.all()
     serializer_class = serializers.TenantSerializer
     filter_class = filters.TenantFilter
@@ -40,7 +41,7 @@ class TenantViewSet(structure_views.BaseOnlineResourceViewSet):
         serializer = serializers.TenantQuotaSerializer(data=request.data, context={'tenant': tenant})
         serializer.is_valid(raise_exception=True)
 
-        old_quota = tenant.quotas.get(name=models.SharepointTenant.Quotas.storage)
+        old_quota = get_quota_snapshot(serializer.context).get(tenant, models.SharepointTenant.Quotas.storage)
         new_quota_limit = serializer.validated_data['storage']
         tenant.set_quota_limit(models.SharepointTenant.Quotas.storage, new_quota_limit)
 
@@ -113,6 +114,10 @@ class SiteCollectionViewSet(mixins.CreateModelMixin,
     filter_class = filters.SiteCollectionFilter
     lookup_field = 'uuid'
 
+    def get_queryset(self):
+        queryset = super(SiteCollectionViewSet, self).get_queryset()
+        return serializers.SiteCollectionSerializer.eager_load(queryset)
+
     def perform_create(self, serializer):
         user = serializer.validated_data['user']
         template = serializer.validated_data['template']
@@ -177,7 +182,7 @@ class SiteCollectionViewSet(mixins.CreateModelMixin,
                 site_collection.save()
 
         storage = serializer.validated_data['storage']
-        old_quota = site_collection.quotas.get(name=models.SiteCollection.Quotas.storage)
+        old_quota = get_quota_snapshot(serializer.context).get(site_collection, models.SiteCollection.Quotas.storage)
         backend.site_collections.set_storage(url=site_collection.access_url, storage=storage)
         site_collection.set_quota_limit(models.SiteCollection.Quotas.storage, storage)
 